@@ -3,3 +3,8 @@ from django.apps import AppConfig
 
 class AccountsConfig(AppConfig):
     name = 'accounts'
+    
+    # When django starts up ready() is called
+    def ready(self):
+        # Import signals so they get registerd when Django starts
+        import accounts.signals
@@ -1,7 +1,9 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
+from django.core.files.uploadedfile import UploadedFile
 from .models import Profile
+from books.images import process_upload
 
 # Class that inherits Django's built in form inheriting all features and security measures
 class CustomUserCreationForm(UserCreationForm):
@@ -81,6 +83,16 @@ class DeleteAccountForm(forms.Form):
 
 
 class ProfilePictureForm(forms.ModelForm):
+    
+    # Shrink the picture to the size of the avatar and remove its metadata like the location it was taken at
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        
+        if isinstance(image, UploadedFile):
+            return process_upload(image, 'profile')
+        
+        return image
+    
     class Meta:
         model = Profile
         fields = ['image']
@@ -89,7 +101,9 @@ class ProfilePictureForm(forms.ModelForm):
             'image': forms.FileInput(attrs={
                 'class': 'form-control',
                 # Make it so that only images are shown in the file picker for the user
-                'accept': 'image/*'
+                'accept': 'image/*',
+                # The upload script sends the picture straight to storage, the field still works without javascript
+                'data-direct-upload': 'profile',
             })
         }
 
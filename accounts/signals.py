@@ -0,0 +1,10 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from books.cache import bump_library_version
+from .models import Profile
+
+
+# Listen for when a profile is saved, the statistics page shows the reading goal so cached pages need a new library version
+@receiver(post_save, sender=Profile)
+def profile_changed(sender, instance, **kwargs):
+    bump_library_version(instance.user_id)
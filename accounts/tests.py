@@ -1,4 +1,7 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from io import BytesIO
+from PIL import Image
 from django.contrib.auth.models import User
 from django.urls import reverse
 from .models import Profile
@@ -84,3 +87,41 @@ class RegistrationTests(TestCase):
         
        
     
+
+
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+class ProfilePictureTests(TestCase):
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123!')
+        Profile.objects.create(user=self.user)
+        self.client.login(username='testuser', password='testpass123!')
+    
+    def test_profile_picture_uploaded_straight_to_storage_is_saved(self):
+        # Arrange - Upload the picture to the local stand in for Cloudinary like the browser does
+        buffer = BytesIO()
+        Image.new('RGB', (60, 60), 'navy').save(buffer, 'PNG')
+        signature = self.client.get(reverse('upload-signature'), {'kind': 'profile'}).json()
+        uploaded = self.client.post(signature['upload_url'], {**signature['fields'], 'file': SimpleUploadedFile('me.png', buffer.getvalue())}).json()
+        # Act
+        response = self.client.post(reverse('upload_profile_picture'), {
+            'uploaded_image': uploaded['public_id'],
+            'uploaded_version': uploaded['version'],
+            'uploaded_signature': uploaded['signature'],
+        })
+        # Assert
+        self.assertRedirects(response, reverse('profile'))
+        self.assertEqual(Profile.objects.get(user=self.user).image.name, uploaded['public_id'])
+    
+    def test_profile_picture_is_shrunk_to_avatar_size(self):
+        # Arrange
+        buffer = BytesIO()
+        Image.new('RGB', (3000, 3000), 'navy').save(buffer, 'JPEG')
+        # Act
+        self.client.post(reverse('upload_profile_picture'), {'image': SimpleUploadedFile('me.jpeg', buffer.getvalue(), content_type='image/jpeg')})
+        # Assert
+        image = Profile.objects.get(user=self.user).image
+        self.assertEqual((image.width, image.height), (300, 300))
@@ -4,6 +4,7 @@ from django.contrib.auth.decorators import login_required
 from .forms import CustomUserCreationForm, EditUsernameForm, EditEmailForm, DeleteAccountForm, ProfilePictureForm, ReadingGoalForm
 from .models import Profile
 from demo.decorators import demo_restricted
+from books.uploads import get_uploaded_image
 
 
 # Create your views here.
@@ -136,7 +137,15 @@ def upload_profile_picture(request):
         form = ProfilePictureForm(request.POST, request.FILES, instance=request.user.profile)
         
         if form.is_valid():
-            form.save()
+            profile = form.save(commit=False)
+            
+            # The browser uploads the picture straight to storage when it can and only sends its name
+            uploaded_image = get_uploaded_image(request.POST, 'profile')
+            
+            if uploaded_image:
+                profile.image = uploaded_image
+            
+            profile.save()
             return redirect('profile')
         
     else:
@@ -1,5 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class BooksConfig(AppConfig):
     name = 'books'
+    
+    # When django starts up ready() is called
+    def ready(self):
+        # Import signals so they get registerd when Django starts
+        import books.signals
+        from .search import repair_search_index
+        
+        # Put the SQLite search triggers back if a migration rebuilt the books table
+        post_migrate.connect(repair_search_index, sender=self)
@@ -0,0 +1,90 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+from django.conf import settings
+from django.core.cache import cache
+from .models import LibraryVersion
+
+
+# Every user has a library version that changes whenever one of their books changes.
+# Cached data includes the version in its key so old entries are never read again after a change.
+# The version is read from the database rather than the cache because the memory cache is separate for every worker,
+# a version bumped in one worker's cache would leave the others serving old grids and 304s
+def get_library_version(user_id):
+    version = LibraryVersion.objects.filter(user_id=user_id).values_list('version', flat=True).first()
+
+    # If the version was never set start a new one, using the time means it never matches an old version
+    if version is None:
+        LibraryVersion.objects.bulk_create([LibraryVersion(user_id=user_id, version=time.time_ns())], ignore_conflicts=True)
+        version = LibraryVersion.objects.filter(user_id=user_id).values_list('version', flat=True).first()
+
+    return version
+
+
+# Give the user a new library version so everything cached for their library is rebuilt on the next request.
+# A user without a version row is left alone, reading it later starts a new version anyway
+def bump_library_version(user_id):
+    LibraryVersion.objects.filter(user_id=user_id).update(version=time.time_ns())
+
+
+# Keep rendered book grids for a day, changing the library starts a new version so old grids are never read
+GRID_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+# Build the cache key for a rendered grid from the user, their library version, the page and the filters in the url
+def get_grid_cache_key(user_id, page, params=None):
+    params_key = ''
+
+    if params:
+        # Sort the parameters so the same filters in a different order share one cache entry
+        params_key = hashlib.md5(urlencode(sorted(params.lists()), doseq=True).encode()).hexdigest()
+
+    return f'book-grid:{user_id}:{get_library_version(user_id)}:{page}:{params_key}'
+
+
+# Get a rendered grid from the cache and count it as a hit or a miss, returns None on a miss
+def get_cached_grid(key):
+    grid = cache.get(key)
+    record_grid_cache_event('hits' if grid is not None else 'misses')
+    return grid
+
+
+def cache_grid(key, grid):
+    cache.set(key, grid, GRID_CACHE_TIMEOUT)
+
+
+# Cache backends that keep their data inside one process
+LOCAL_CACHE_BACKENDS = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+# Counters can only be added up across workers and read by a management command when the cache is shared, like Redis with REDIS_URL.
+# The default memory cache is separate for every worker and every command
+def uses_shared_cache():
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_CACHE_BACKENDS
+
+
+# Add to a counter in the cache that never expires. With a shared cache the count covers every worker,
+# with the memory cache each worker only counts its own requests and the stats commands can not read them
+def increment_counter(key, amount=1):
+
+    # incr fails when the counter does not exist yet
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        cache.add(key, amount, None)
+
+
+# Count grid cache hits and misses so the timeout and cache size can be tuned
+def record_grid_cache_event(event):
+    increment_counter(f'book-grid-stats:{event}')
+
+
+def get_grid_cache_stats():
+    return {event: cache.get(f'book-grid-stats:{event}', 0) for event in ['hits', 'misses']}
+
+
+def reset_grid_cache_stats():
+    cache.delete_many(['book-grid-stats:hits', 'book-grid-stats:misses'])
@@ -0,0 +1,40 @@
+import hashlib
+from datetime import date
+from django.contrib.messages import get_messages
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_cookie
+from .cache import get_library_version
+
+
+# Build an ETag for a library page from everything the rendered page depends on.
+# This only reads the library version so a browser going back to an unchanged page gets a 304 before any books are queried
+def get_library_etag(request, *args, **kwargs):
+    
+    if not request.user.is_authenticated:
+        return None
+    
+    # Pending messages are shown once on the next page so that page has to be rendered in full
+    if len(get_messages(request)):
+        return None
+    
+    parts = [
+        request.user.id,
+        get_library_version(request.user.id),
+        # The path and query string cover the book or list being shown and the filters
+        request.get_full_path(),
+        # Forms on the page use the csrf token so a new csrf cookie needs a new page
+        request.META.get('CSRF_COOKIE', ''),
+        # The statistics page counts the current year so pages are never reused across days
+        date.today().isoformat(),
+    ]
+    
+    return hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+# Decorator for GET only library views that answers If-None-Match with a 304 when the library has not changed.
+# Browsers may keep the page but have to check with the server every time, and the page depends on who is logged in
+def library_page(view):
+    view = condition(etag_func=get_library_etag)(view)
+    view = cache_control(private=True, no_cache=True)(view)
+    return vary_on_cookie(view)
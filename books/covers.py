@@ -0,0 +1,53 @@
+import hashlib
+from urllib.parse import urlsplit
+from django.db import IntegrityError, transaction
+from .models import CoverAsset
+
+
+# Hosts Google Books serves cover thumbnails from
+COVER_URL_HOSTS = {'books.google.com', 'books.googleusercontent.com'}
+
+
+# Covers picked from a search are https links to Google Books, anything else posted as image_url such as
+# a path on the server or an internal address is never fetched
+def is_cover_url(url):
+    parts = urlsplit(url)
+    return parts.scheme == 'https' and parts.hostname in COVER_URL_HOSTS
+
+
+# Get the stored cover for a Google Books image url, a single lookup on the unique source_url index
+def get_cover_for_url(source_url):
+    return CoverAsset.objects.filter(source_url=source_url).values_list('public_id', flat=True).first()
+
+
+# Hash an uploaded file in chunks so large images are not read into memory at once
+def get_content_hash(file):
+    digest = hashlib.sha256()
+
+    for chunk in file.chunks():
+        digest.update(chunk)
+
+    # Put the file back at the start so it can still be saved
+    file.seek(0)
+
+    return digest.hexdigest()
+
+
+# Get the stored cover for an uploaded file and the hash of the file, the stored cover is None if this image was never uploaded
+def get_cover_for_file(file):
+    content_hash = get_content_hash(file)
+    public_id = CoverAsset.objects.filter(content_hash=content_hash).values_list('public_id', flat=True).first()
+
+    return public_id, content_hash
+
+
+# Record a newly stored cover so the next book with the same url or file reuses it
+def remember_cover(public_id, source_url=None, content_hash=None):
+    try:
+        # The savepoint keeps a duplicate from breaking the rest of the request transaction
+        with transaction.atomic():
+            CoverAsset.objects.create(public_id=public_id, source_url=source_url, content_hash=content_hash)
+
+    # Another request stored the same cover at the same time, its row is kept
+    except IntegrityError:
+        pass
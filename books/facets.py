@@ -0,0 +1,98 @@
+import hashlib
+from django.core.cache import cache
+from django.db.models import Count
+from django.db.models.functions import ExtractYear
+from .models import Book
+from .cache import get_library_version
+from .search import search_books
+
+
+# Keep facet counts for a day, changing a book starts a new library version so old counts are never read
+FACET_CACHE_TIMEOUT = 60 * 60 * 24
+
+# The filters on the home page that show counts
+FACET_NAMES = ['genre', 'status', 'rating', 'year']
+
+
+# Count the users books for every combination of genre, status, rating and year in one grouped query.
+# A library only has a few hundred combinations at most so every facet can be added up from these rows in Python
+def get_facet_rows(user, search=None):
+
+    # Hash the search so any text can be used in the cache key
+    search_key = hashlib.md5(search.encode()).hexdigest() if search else ''
+    key = f'book-facets:{user.id}:{get_library_version(user.id)}:{search_key}'
+
+    rows = cache.get(key)
+
+    if rows is None:
+        books = Book.objects.filter(user=user)
+
+        if search:
+            books = search_books(books, search)
+
+        # order_by() removes the default title ordering so it is not added to the GROUP BY
+        rows = list(
+            books.order_by()
+            .values('genre', 'status', 'rating', year=ExtractYear('date_finished'))
+            .annotate(count=Count('id'))
+        )
+
+        cache.set(key, rows, FACET_CACHE_TIMEOUT)
+
+    return rows
+
+
+# Turn the selected filter values from the url into the same types as the facet rows, values that are not valid are ignored
+def get_active_filters(genre, status, rating, year):
+    active = {'genre': genre or None, 'status': status or None, 'rating': None, 'year': None}
+
+    for name, value in [('rating', rating), ('year', year)]:
+        try:
+            active[name] = int(value) if value else None
+        except ValueError:
+            pass
+
+    return active
+
+
+# Add up the rows into counts for each facet.
+# Each facet uses every active filter except its own so the other options in a dropdown show how many books selecting them would give
+def count_facets(rows, active):
+    counts = {name: {} for name in FACET_NAMES}
+
+    for row in rows:
+        for name in FACET_NAMES:
+
+            # Skip the row if it does not match one of the other selected filters
+            if any(value is not None and row[other] != value for other, value in active.items() if other != name):
+                continue
+
+            if row[name] is not None:
+                counts[name][row[name]] = counts[name].get(row[name], 0) + row['count']
+
+    return counts
+
+
+# Get the facet options with counts for the home page filter dropdowns and the total number of books in the library
+def get_facets(user, search, genre, status, rating, year):
+    library_rows = get_facet_rows(user)
+
+    # Searching narrows the books so the counts need the rows for the search, the year options still come from the whole library
+    rows = get_facet_rows(user, search) if search else library_rows
+
+    counts = count_facets(rows, get_active_filters(genre, status, rating, year))
+
+    total_books = sum(row['count'] for row in library_rows)
+
+    # Show every genre, status and rating even when the count is 0 so the dropdowns keep the same options
+    facets = {
+        'genre': [{'value': value, 'label': label, 'count': counts['genre'].get(value, 0)} for value, label in Book.GENRE_CHOICES],
+        'status': [{'value': value, 'label': label, 'count': counts['status'].get(value, 0)} for value, label in Book.STATUS_CHOICES],
+        'rating': [{'value': str(value), 'label': f"{value} Star{'s' if value > 1 else ''}", 'count': counts['rating'].get(value, 0)} for value in range(5, 0, -1)],
+    }
+
+    # Only show years that have a finished book, newest first
+    years = sorted({row['year'] for row in library_rows if row['year'] is not None}, reverse=True)
+    facets['year'] = [{'value': str(value), 'label': str(value), 'count': counts['year'].get(value, 0)} for value in years]
+
+    return facets, total_books
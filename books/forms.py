@@ -1,10 +1,31 @@
 from .models import Book
+from .images import process_upload
+from .covers import is_cover_url
 from django.forms import ModelForm
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
 from django import forms
 
 
 class AddBookForm(ModelForm):
     
+    # The image input is written in the template so it can be hidden when a search cover is picked.
+    # A photo uploaded with the form is shrunk and its metadata removed, the view reads it from cleaned_data
+    def clean(self):
+        cleaned_data = super().clean()
+        image = self.files.get('image')
+        image_url = self.data.get('image_url')
+        
+        # The search cover is fetched by the server so only accept links to Google Books covers
+        if image_url and not is_cover_url(image_url):
+            raise ValidationError('Pick a cover from the book search or upload an image.')
+        
+        # A search cover is used instead of the file so do not process it
+        if image and not image_url:
+            cleaned_data['image'] = process_upload(image, 'cover')
+        
+        return cleaned_data
+    
     class Meta:
         
         # the Model from which the form will inherit from
@@ -34,6 +55,15 @@ class AddBookForm(ModelForm):
 # declaring the ModelForm
 class EditBookForm(ModelForm):
     
+    # Shrink a newly uploaded cover and remove its metadata, the image is the current cover or False when it is not changed or cleared
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        
+        if isinstance(image, UploadedFile):
+            return process_upload(image, 'cover')
+        
+        return image
+    
     class Meta:
         
         # the Model from which the form will inherit from
@@ -52,7 +82,8 @@ class EditBookForm(ModelForm):
              'review': forms.Textarea(attrs={'class': 'form-control', 'rows': '4', 'placeholder': 'Write your review...'}),
              'date_finished': forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}),
              'purchase_link': forms.URLInput(attrs={'class': 'form-control', 'placeholder': 'Purchase Link'}),
-             'image': forms.FileInput(attrs={'class': 'form-control'}),
+             # The upload script sends the file straight to storage, the field still works without javascript
+             'image': forms.FileInput(attrs={'class': 'form-control', 'accept': 'image/*', 'data-direct-upload': 'cover'}),
         }
         
         # Change status label to say reading status
@@ -0,0 +1,130 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from .cache import increment_counter
+
+
+# Results are fresh for an hour, after that they are still returned for a day while a background request refreshes them
+GOOGLE_BOOKS_CACHE_TTL = 60 * 60
+GOOGLE_BOOKS_CACHE_STALE = 60 * 60 * 24
+
+# Most searches are popular author names and title lookups so a few hundred entries covers them, the least recently used go first
+GOOGLE_BOOKS_CACHE_SIZE = 500
+
+# How long a request waits for a matching search another request is already making before giving up
+IN_FLIGHT_WAIT_SECONDS = 10
+
+# Cached results for this worker by normalized query, kept in least recently used order
+entries = OrderedDict()
+
+# Searches being made right now by normalized query, other requests for the same query wait for these instead of calling Google
+in_flight = {}
+
+cache_lock = threading.Lock()
+
+
+# Turn a search into the cache key so 'Brandon Sanderson', ' brandon  sanderson ' and 'Brandon Sanderson!' share one entry
+def normalize_query(search):
+    normalized = ' '.join(re.sub(r'[\W_]+', ' ', search.lower()).split())
+
+    # Searches that are only punctuation keep their text so they do not all share one empty key
+    return normalized or search.strip().lower()
+
+
+# Get the results for a search from the cache or by calling fetch(search, max_results).
+# Failed searches return None and are not cached so the next request tries Google again
+def get_cached_search(search, fetch, max_results):
+
+    # Callers ask for different numbers of results so the number is part of the key
+    key = f'{normalize_query(search)}:{max_results}'
+    now = time.monotonic()
+
+    with cache_lock:
+        entry = entries.get(key)
+
+        if entry is not None:
+            age = now - entry['fetched_at']
+
+            if age < GOOGLE_BOOKS_CACHE_TTL + GOOGLE_BOOKS_CACHE_STALE:
+                entries.move_to_end(key)
+
+                # Old results are returned straight away and refreshed in the background unless a refresh already started
+                if age >= GOOGLE_BOOKS_CACHE_TTL:
+                    if key not in in_flight:
+                        in_flight[key] = {'event': threading.Event(), 'results': None}
+                        threading.Thread(target=fetch_and_store, args=(key, search, fetch, max_results), daemon=True).start()
+
+                    event = 'stale'
+                else:
+                    event = 'hits'
+
+                results = entry['results']
+                flight = None
+
+            else:
+                del entries[key]
+                entry = None
+
+        # Join a search that is already being made or start a new one
+        if entry is None:
+            flight = in_flight.get(key)
+            leader = flight is None
+
+            if leader:
+                flight = {'event': threading.Event(), 'results': None}
+                in_flight[key] = flight
+
+    if entry is not None:
+        increment_counter(f'google-books-stats:cache_{event}')
+        return copy_results(results)
+
+    if leader:
+        increment_counter('google-books-stats:cache_misses')
+        results = fetch_and_store(key, search, fetch, max_results)
+    else:
+        increment_counter('google-books-stats:coalesced')
+        flight['event'].wait(IN_FLIGHT_WAIT_SECONDS)
+        results = flight['results']
+
+    return copy_results(results)
+
+
+# Call Google for a search, store the results and wake up every request waiting on it
+def fetch_and_store(key, search, fetch, max_results):
+    with cache_lock:
+        flight = in_flight[key]
+
+    results = None
+
+    try:
+        results = fetch(search, max_results)
+    finally:
+        with cache_lock:
+            if results is not None:
+                entries[key] = {'results': results, 'fetched_at': time.monotonic()}
+                entries.move_to_end(key)
+
+                # Remove the least recently used searches once the cache is full
+                while len(entries) > GOOGLE_BOOKS_CACHE_SIZE:
+                    entries.popitem(last=False)
+
+            del in_flight[key]
+
+        flight['results'] = results
+        flight['event'].set()
+
+    return results
+
+
+# Callers add keys to the result dicts like searched_author so give each caller its own copies
+def copy_results(results):
+    if results is None:
+        return None
+
+    return [dict(result) for result in results]
+
+
+def clear_google_books_cache():
+    with cache_lock:
+        entries.clear()
@@ -0,0 +1,280 @@
+import base64
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+import requests
+from PIL import Image, ImageOps
+
+
+# Width in pixels each place a cover is shown at needs, every variant is also made at double width for high density screens.
+# sizes tells the browser how wide the image is drawn so it can pick the smallest file from srcset before layout
+COVER_VARIANTS = {
+    # Quarter tiles on the my lists page
+    'tile': {'width': 200, 'sizes': '200px'},
+    # Book cards on the home, list and statistics pages
+    'card': {'width': 240, 'sizes': '240px'},
+    # Book detail page, the column is full width on phones
+    'detail': {'width': 400, 'sizes': '(min-width: 768px) 400px, 100vw'},
+}
+
+
+# Largest size photos uploaded by users are stored at, phone photos are often 4000x3000 but are only shown as a card or an avatar.
+# Covers keep enough for the detail page on high density screens and profile pictures enough for the 150 pixel avatar at double density
+UPLOAD_MAX_SIZES = {
+    'cover': (800, 1200),
+    'profile': (300, 300),
+}
+
+# Photos with more pixels than this are refused before they are decoded, well below Pillow's own decompression bomb limit
+MAX_UPLOAD_PIXELS = 50_000_000
+
+# Resizing holds the decoded photo in memory so only a couple of uploads are processed at once per worker, the rest wait their turn.
+# Pillow releases the GIL while decoding and resizing so threads run in parallel
+upload_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='upload-image')
+
+
+# Width of the blurred placeholder, a 10 pixel wide PNG is only a few hundred bytes so it can go straight in the html
+PLACEHOLDER_WIDTH = 10
+
+
+def get_variant_widths(variant):
+    width = COVER_VARIANTS[variant]['width']
+    return [width, width * 2]
+
+
+# Every width a stored cover is resized to
+def get_all_variant_widths():
+    return sorted({width for variant in COVER_VARIANTS for width in get_variant_widths(variant)})
+
+
+# Cloudinary resizes images from the url so nothing has to be stored for it, local storage needs files made with Pillow
+def uses_cloudinary():
+    return settings.STORAGES['default']['BACKEND'].startswith('cloudinary_storage')
+
+
+# Cloudinary and the local stand in for it, LocalMediaStorage, both resize images from transformations in the url
+def uses_transformation_urls():
+    return uses_cloudinary() or getattr(default_storage, 'transformation_urls', False)
+
+
+# Name of the resized file stored next to a local cover, 'images/dune.png' at 240 pixels is 'images/dune.240w.jpg'
+def get_variant_name(name, width):
+    base, _ = os.path.splitext(name)
+    return f'{base}.{width}w.jpg'
+
+
+# Get the url of a cover resized to a width, returns None if there is no resized file so the original is used
+def get_variant_url(name, width):
+    url = default_storage.url(name)
+
+    # Cloudinary makes the resized copy the first time the url is requested and caches it on its CDN.
+    # f_auto sends webp or avif to browsers that support them and q_auto picks the lowest quality that still looks the same
+    if uses_transformation_urls():
+        return url.replace('/upload/', f'/upload/c_scale,w_{width},f_auto,q_auto/', 1)
+
+    variant_name = get_variant_name(name, width)
+
+    if default_storage.exists(variant_name):
+        return default_storage.url(variant_name)
+
+    return None
+
+
+# Make the resized files for a local cover, Cloudinary covers do not need any
+def create_cover_variants(name):
+    if uses_transformation_urls():
+        return
+
+    with default_storage.open(name) as file:
+        image = Image.open(file)
+
+        # Only decode at the size that is needed when the format supports it, this is much faster for large JPEGs
+        largest = get_all_variant_widths()[-1]
+        image.draft('RGB', (largest, largest * 2))
+
+        # JPEG has no transparency so put transparent covers on white
+        image = image.convert('RGB')
+
+    for width in get_all_variant_widths():
+        resized = image.copy()
+
+        # Never make an image bigger than the original
+        if resized.width > width:
+            resized.thumbnail((width, width * 10), Image.LANCZOS)
+
+        buffer = BytesIO()
+        resized.save(buffer, 'JPEG', quality=80, optimize=True, progressive=True)
+
+        variant_name = get_variant_name(name, width)
+
+        # Replace an old file so the storage does not pick a new name
+        if default_storage.exists(variant_name):
+            default_storage.delete(variant_name)
+
+        default_storage.save(variant_name, ContentFile(buffer.getvalue()))
+
+
+# Read a cover to make its placeholder from, Cloudinary sends a small copy so the full size image is not downloaded
+def read_cover(name):
+    if uses_cloudinary():
+        url = default_storage.url(name).replace('/upload/', '/upload/c_scale,w_64,f_png/', 1)
+        response = requests.get(url, timeout=(3.05, 10))
+        response.raise_for_status()
+        return response.content
+
+    with default_storage.open(name) as file:
+        return file.read()
+
+
+# Make the blurred placeholder data uri and the average color for a cover, returns None if the cover can not be read.
+# This does not use the database so the backfill command can run it in other processes
+def get_cover_preview(name):
+    try:
+        return make_cover_preview(read_cover(name))
+    except Exception:
+        return None
+
+
+def make_cover_preview(data):
+    try:
+        image = Image.open(BytesIO(data))
+        image.draft('RGB', (64, 128))
+        image = image.convert('RGB')
+    except Exception:
+        return None
+
+    # Shrinking the whole cover to one pixel averages every pixel into the background color
+    red, green, blue = image.resize((1, 1), Image.BOX).getpixel((0, 0))
+
+    # The browser smooths the tiny image when it scales it up to the size of the cover which gives the blur
+    image.thumbnail((PLACEHOLDER_WIDTH, PLACEHOLDER_WIDTH * 10))
+    buffer = BytesIO()
+    image.save(buffer, 'PNG', optimize=True)
+
+    return {
+        'cover_placeholder': 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode(),
+        'cover_color': f'#{red:02x}{green:02x}{blue:02x}',
+    }
+
+
+# Shrink a photo a user uploaded and remove its metadata before it is stored, raises ValidationError if it is not an image.
+# Runs on the upload threads so the number of photos decoded at once is limited however many requests arrive together
+def process_upload(file, kind):
+    return upload_executor.submit(resize_upload, file, kind).result()
+
+
+def resize_upload(file, kind):
+    max_size = UPLOAD_MAX_SIZES[kind]
+
+    try:
+        file.seek(0)
+        image = Image.open(file)
+
+        if image.width * image.height > MAX_UPLOAD_PIXELS:
+            raise ValidationError('This image is too large, upload one with fewer pixels.')
+
+        # JPEGs are decoded at a half, quarter or eighth of their size when that is still bigger than needed,
+        # so a 12 megapixel photo never has to be held in memory at full size
+        image.draft('RGB', max_size)
+
+        # Phones store photos sideways with an EXIF tag saying how to turn them, turn the pixels now because the tag is removed below
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(max_size, Image.LANCZOS)
+
+        buffer = BytesIO()
+
+        # Keep transparent images transparent with WebP and save everything else as JPEG.
+        # No exif or icc_profile is passed so location and camera details are not stored
+        if image.mode in ('RGBA', 'LA', 'P') and image.has_transparency_data:
+            image.convert('RGBA').save(buffer, 'WEBP', quality=85)
+            extension = 'webp'
+        else:
+            image.convert('RGB').save(buffer, 'JPEG', quality=85, optimize=True, progressive=True)
+            extension = 'jpg'
+
+    except (OSError, ValueError, Image.DecompressionBombError):
+        raise ValidationError('Upload a valid image. The file you uploaded was either not an image or a corrupted image.')
+
+    base, _ = os.path.splitext(os.path.basename(file.name or 'image'))
+
+    return ContentFile(buffer.getvalue(), name=f'{base}.{extension}')
+
+
+# Formats a transformation can ask for and the Pillow format and content type for each
+TRANSFORMATION_FORMATS = {
+    'jpg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png'),
+    'webp': ('WEBP', 'image/webp'),
+}
+
+
+# Get a width or height from a transformation, anything bigger than the largest cover variant raises ValueError
+# so a url like c_scale,w_60000 can not make the server build a huge image
+def get_transformation_size(value):
+    size = int(value)
+
+    if not 0 < size <= get_all_variant_widths()[-1]:
+        raise ValueError(f'Unsupported size {value}')
+
+    return size
+
+
+# Apply a Cloudinary style transformation like 'c_scale,w_240,f_auto,q_auto' to an image for the local stand in.
+# Only the parts this app uses are supported, anything else raises ValueError. Returns the new image bytes and content type
+def transform_image(data, transformation):
+    options = {}
+
+    for part in transformation.split(','):
+        key, _, value = part.partition('_')
+
+        if key not in ('c', 'w', 'h', 'f', 'q') or not value:
+            raise ValueError(f'Unsupported transformation {part}')
+
+        options[key] = value
+
+    crop = options.get('c', 'scale')
+
+    if crop not in ('scale', 'limit'):
+        raise ValueError(f'Unsupported crop {crop}')
+
+    # f_auto picks WebP which every browser the app supports can show, like Cloudinary does for them
+    image_format = options.get('f', 'auto')
+    image_format = 'webp' if image_format == 'auto' else image_format
+
+    if image_format not in TRANSFORMATION_FORMATS:
+        raise ValueError(f'Unsupported format {image_format}')
+
+    image_format, content_type = TRANSFORMATION_FORMATS[image_format]
+
+    # q_auto is close to the quality Cloudinary picks for photos
+    quality = 80 if options.get('q', 'auto') == 'auto' else int(options['q'])
+
+    if not 1 <= quality <= 100:
+        raise ValueError(f'Unsupported quality {quality}')
+
+    width = get_transformation_size(options['w']) if 'w' in options else None
+    height = get_transformation_size(options['h']) if 'h' in options else None
+
+    image = Image.open(BytesIO(data))
+
+    if width or height:
+        image.draft('RGB', (width or image.width, height or image.height))
+        scale = min(width / image.width if width else float('inf'), height / image.height if height else float('inf'))
+
+        # c_limit only ever makes an image smaller, c_scale also makes it bigger
+        if crop == 'scale' or scale < 1:
+            image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.LANCZOS)
+
+    if image_format == 'JPEG':
+        image = image.convert('RGB')
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+
+    buffer = BytesIO()
+    image.save(buffer, image_format, quality=quality)
+
+    return buffer.getvalue(), content_type
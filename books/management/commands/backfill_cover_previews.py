@@ -0,0 +1,67 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.core.management.base import BaseCommand
+from books.cache import bump_library_version
+from books.images import get_cover_preview
+from books.models import Book
+
+
+# Create Django management command that inherits from BaseCommand
+class Command(BaseCommand):
+    help = 'Makes the blurred placeholder and background color for existing book covers in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Number of books read and updated at a time (default 200)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of processes resizing covers (default one per cpu)')
+        parser.add_argument('--all', action='store_true', help='Also redo books that already have a placeholder')
+
+    def handle(self, *args, **options):
+        books = Book.objects.exclude(image='').exclude(image__isnull=True).order_by('id')
+
+        if not options['all']:
+            books = books.filter(cover_placeholder='')
+
+        updated = 0
+        failed = 0
+        last_id = 0
+
+        # Every process sets up Django so the preview code can import the models, the processes never use the database
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as executor:
+            while True:
+
+                # Page by id so books updated in earlier batches do not shift the next batch
+                batch = list(books.filter(id__gt=last_id).only('id', 'user', 'image')[:options['batch_size']])
+
+                if not batch:
+                    break
+
+                last_id = batch[-1].id
+
+                # Books that share a cover only have it read once
+                names = sorted({book.image.name for book in batch})
+                previews = dict(zip(names, executor.map(get_cover_preview, names)))
+
+                changed = []
+
+                for book in batch:
+                    preview = previews[book.image.name]
+
+                    if preview is None:
+                        failed += 1
+                        continue
+
+                    book.cover_placeholder = preview['cover_placeholder']
+                    book.cover_color = preview['cover_color']
+                    changed.append(book)
+
+                # bulk_update saves the batch in one query and skips the Book signals since only the cover preview changed
+                Book.objects.bulk_update(changed, ['cover_placeholder', 'cover_color'])
+
+                for user_id in {book.user_id for book in changed}:
+                    bump_library_version(user_id)
+
+                updated += len(changed)
+                self.stdout.write(f'Updated {updated} books')
+
+        self.stdout.write(self.style.SUCCESS(f'{updated} covers updated, {failed} could not be read'))
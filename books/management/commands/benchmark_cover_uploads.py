@@ -0,0 +1,81 @@
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from PIL import Image
+from books.images import process_upload, make_cover_preview
+from books.storage import LocalMediaStorage
+
+
+# Phone photo kept in the repo, 4032x3024 and about 1MB
+DEFAULT_IMAGE = Path(__file__).resolve().parents[3] / 'images' / 'IMG_0001.jpeg'
+
+STAGES = ['resize', 'store', 'preview', 'total']
+
+
+# Create Django management command that inherits from BaseCommand
+class Command(BaseCommand):
+    help = 'Times the cover upload pipeline against the local stand in for Cloudinary with added network latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=20, help='Number of photos to upload (default 20)')
+        parser.add_argument('--concurrency', type=int, default=4, help='Number of uploads made at once, like requests on different threads (default 4)')
+        parser.add_argument('--latency', type=float, default=0.1, help='Seconds added to every storage call (default 0.1)')
+        parser.add_argument('--jitter', type=float, default=0.05, help='Up to this many more seconds added at random (default 0.05)')
+        parser.add_argument('--image', default=str(DEFAULT_IMAGE), help='Photo to upload')
+
+    # Make a different copy of the photo for every upload so the content addressed storage has to store each one
+    def get_photos(self, path, count):
+        source = Image.open(path).convert('RGB')
+        photos = []
+
+        for number in range(count):
+            source.putpixel((0, 0), (number % 256, number // 256 % 256, 0))
+            buffer = BytesIO()
+            source.save(buffer, 'JPEG', quality=90)
+            photos.append(buffer.getvalue())
+
+        return photos
+
+    # Upload one photo the way add book does and return the seconds each stage took
+    def upload(self, storage, photo):
+        started = time.perf_counter()
+
+        processed = process_upload(SimpleUploadedFile('photo.jpeg', photo), 'cover')
+        resized = time.perf_counter()
+
+        name = storage.save(f'images/{processed.name}', processed)
+        stored = time.perf_counter()
+
+        with storage.open(name) as file:
+            make_cover_preview(file.read())
+        finished = time.perf_counter()
+
+        return {'resize': resized - started, 'store': stored - resized, 'preview': finished - stored, 'total': finished - started}
+
+    def handle(self, *args, **options):
+        photos = self.get_photos(options['image'], options['count'])
+
+        with tempfile.TemporaryDirectory() as location:
+            storage = LocalMediaStorage(location=location, latency=options['latency'], jitter=options['jitter'])
+
+            started = time.perf_counter()
+
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                timings = list(executor.map(lambda photo: self.upload(storage, photo), photos))
+
+            elapsed = time.perf_counter() - started
+
+        self.stdout.write(f"{options['count']} uploads, {options['concurrency']} at once, {options['latency']}s latency: "
+                          f"{elapsed:.2f}s, {options['count'] / elapsed:.1f} uploads/s")
+        self.stdout.write(f"{'stage':<10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+
+        for stage in STAGES:
+            times = sorted(timing[stage] * 1000 for timing in timings)
+            p95 = statistics.quantiles(times, n=20, method='inclusive')[-1] if len(times) > 1 else times[0]
+
+            self.stdout.write(f'{stage:<10}{statistics.median(times):>10.1f}{p95:>10.1f}{times[-1]:>10.1f}')
@@ -0,0 +1,51 @@
+import json
+import time
+from pathlib import Path
+import orjson
+from django.core.management.base import BaseCommand
+from books.services import get_search_results
+
+
+# Responses recorded for the same search, the full one is what Google sends without the fields parameter
+FIXTURES_DIR = Path(__file__).resolve().parents[2] / 'fixtures' / 'google_books'
+
+
+# Create Django management command that inherits from BaseCommand
+class Command(BaseCommand):
+    help = 'Compares the bytes and parse time of full and partial Google Books responses using recorded fixtures'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=1000, help='Number of times each response is parsed (default 1000)')
+
+    # The responses each caller gets, partial responses with fewer results are cut from the recorded 10 result response
+    def get_cases(self):
+        full = (FIXTURES_DIR / 'volumes_full.json').read_bytes()
+        partial = (FIXTURES_DIR / 'volumes_partial.json').read_bytes()
+        items = json.loads(partial)['items']
+
+        return [
+            ('full volumes, 10 results (before)', full),
+            ('fields, 10 results (add book search)', partial),
+            ('fields, 2 results (author recommendations)', json.dumps({'items': items[:2]}, indent=2).encode()),
+            ('fields, 1 result (cover enrichment)', json.dumps({'items': items[:1]}, indent=2).encode()),
+        ]
+
+    # Average milliseconds to parse the body and build the search results
+    def time_parse(self, loads, body, runs):
+        start = time.perf_counter()
+
+        for _ in range(runs):
+            get_search_results(loads(body))
+
+        return (time.perf_counter() - start) / runs * 1000
+
+    def handle(self, *args, **options):
+        runs = options['runs']
+
+        self.stdout.write(f"{'response':<45}{'bytes':>10}{'json ms':>12}{'orjson ms':>12}")
+
+        for name, body in self.get_cases():
+            json_ms = self.time_parse(json.loads, body, runs)
+            orjson_ms = self.time_parse(orjson.loads, body, runs)
+
+            self.stdout.write(f'{name:<45}{len(body):>10}{json_ms:>12.4f}{orjson_ms:>12.4f}')
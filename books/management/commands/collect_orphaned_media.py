@@ -0,0 +1,137 @@
+import re
+import time
+from datetime import timedelta
+import cloudinary.api
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from accounts.models import Profile
+from books.models import Book, CoverAsset
+from books.images import uses_cloudinary
+from books.uploads import UPLOAD_FOLDERS
+from demo.seed_data import DEMO_BOOKS
+
+
+# Cloudinary deletes at most 100 images per call and lists at most 500 per page
+MAX_DELETE_BATCH = 100
+MAX_PAGE_SIZE = 500
+
+
+# Turn a stored name into the key every copy of one image shares so names from the database and from storage can be compared.
+# Cloudinary ids can have the media folder in front and no extension, and local covers have resized copies like dune.240w.jpg,
+# so 'media/images/dune', 'images/dune.png' and 'images/dune.240w.jpg' are all 'images/dune'
+def get_asset_key(name):
+    name = name.removeprefix('media/')
+    name = re.sub(r'\.\d+w\.jpg$', '', name)
+    return re.sub(r'\.[A-Za-z0-9]+$', '', name)
+
+
+# Create Django management command that inherits from BaseCommand
+class Command(BaseCommand):
+    help = 'Deletes stored images that no book or profile uses anymore, like replaced covers and covers of deleted books and accounts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='List the images that would be deleted without deleting them')
+        parser.add_argument('--min-age-hours', type=float, default=24, help='Keep images stored more recently than this, they may be uploads still being saved (default 24)')
+        parser.add_argument('--page-size', type=int, default=MAX_PAGE_SIZE, help=f'Number of stored images listed per request (default {MAX_PAGE_SIZE})')
+        parser.add_argument('--batch-size', type=int, default=MAX_DELETE_BATCH, help=f'Number of images deleted per request (default {MAX_DELETE_BATCH})')
+        parser.add_argument('--pause', type=float, default=1, help='Seconds to wait between delete requests so the Cloudinary rate limit is not used up (default 1)')
+
+    # List every stored image a page at a time as (name, size in bytes, time stored)
+    def list_stored_pages(self, page_size):
+        if uses_cloudinary():
+            cursor = None
+
+            while True:
+                response = cloudinary.api.resources(
+                    type='upload', resource_type='image', prefix='media/', max_results=min(page_size, MAX_PAGE_SIZE), next_cursor=cursor,
+                )
+                yield [(resource['public_id'], resource['bytes'], parse_datetime(resource['created_at'])) for resource in response['resources']]
+
+                cursor = response.get('next_cursor')
+
+                if not cursor:
+                    return
+
+        page = []
+
+        for folder in UPLOAD_FOLDERS.values():
+            if not default_storage.exists(folder):
+                continue
+
+            for filename in default_storage.listdir(folder)[1]:
+                name = f'{folder}/{filename}'
+                page.append((name, default_storage.size(name), default_storage.get_created_time(name)))
+
+                if len(page) == page_size:
+                    yield page
+                    page = []
+
+        if page:
+            yield page
+
+    # Mark every image something still uses, the demo covers are included so they are kept while reset_demo recreates the demo books
+    def get_referenced_keys(self):
+        names = Book.objects.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True).iterator()
+        profile_names = Profile.objects.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True).iterator()
+        demo_names = [book['image_url'].split('/media/')[1] for book in DEMO_BOOKS if book['image_url'] and '/media/' in book['image_url']]
+
+        return {get_asset_key(name) for name in [*names, *profile_names, *demo_names]}
+
+    def delete_batch(self, names):
+        if uses_cloudinary():
+            cloudinary.api.delete_resources(names, resource_type='image', type='upload', invalidate=True)
+        else:
+            for name in names:
+                default_storage.delete(name)
+
+    def handle(self, *args, **options):
+        newest = timezone.now() - timedelta(hours=options['min_age_hours'])
+        batch_size = min(options['batch_size'], MAX_DELETE_BATCH)
+
+        # Group the stored files by image so an image and its resized copies are kept or deleted together
+        stored = {}
+        too_new = set()
+
+        for page in self.list_stored_pages(options['page_size']):
+            for name, size, created in page:
+                key = get_asset_key(name)
+                stored.setdefault(key, []).append((name, size))
+
+                if created > newest:
+                    too_new.add(key)
+
+        referenced = self.get_referenced_keys()
+        in_use = stored.keys() & referenced
+        too_new -= referenced
+        orphans = stored.keys() - referenced - too_new
+
+        if not options['dry_run']:
+            # Stop new books reusing the orphans, then mark again so a book that reused one since the first mark keeps it
+            orphan_covers = [public_id for public_id in CoverAsset.objects.values_list('public_id', flat=True) if get_asset_key(public_id) in orphans]
+            CoverAsset.objects.filter(public_id__in=orphan_covers).delete()
+            orphans -= self.get_referenced_keys()
+
+        files = sorted(file for key in orphans for file in stored[key])
+        total_bytes = sum(size or 0 for _, size in files)
+
+        self.stdout.write(f'{len(stored)} stored images, {len(in_use)} in use, {len(too_new)} too new to delete, '
+                          f'{len(orphans)} orphaned ({len(files)} files, {total_bytes / 1024 / 1024:.1f} MB)')
+
+        if options['dry_run']:
+            for name, size in files:
+                self.stdout.write(f'  would delete {name} ({size or 0} bytes)')
+            return
+
+        names = [name for name, _ in files]
+
+        for start in range(0, len(names), batch_size):
+            # Wait between requests so a large clean up does not use up the Cloudinary admin api limit
+            if start:
+                time.sleep(options['pause'])
+
+            self.delete_batch(names[start:start + batch_size])
+            self.stdout.write(f'Deleted {min(start + batch_size, len(names))} of {len(names)} files')
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {len(orphans)} orphaned images'))
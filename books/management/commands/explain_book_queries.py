@@ -0,0 +1,117 @@
+import random
+import time
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Avg, Count
+from books.models import Book
+from books.pagination import get_sort_ordering
+from books.views import get_year_range
+
+
+# Create Django management command that inherits from BaseCommand
+class Command(BaseCommand):
+    help = 'Prints EXPLAIN plans for the main book queries with and without the composite indexes on Book'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', help='Explain the queries for an existing user instead of seeding one')
+        parser.add_argument('--seed', type=int, default=5000, help='Number of books to create for a temporary user (default 5000)')
+        parser.add_argument('--runs', type=int, default=5, help='Number of times each query is timed (default 5)')
+
+    # The queries the home, statistics, lists and recommendations pages run, each one filters by user first
+    def get_queries(self, user):
+        books = Book.objects.filter(user=user)
+        finished = books.filter(status='finished')
+        year_start, year_end = get_year_range(date.today().year)
+
+        return [
+            ('home, default sort', books.order_by(*get_sort_ordering(None))[:25]),
+            ('home, sort by author', books.order_by(*get_sort_ordering('author_asc'))[:25]),
+            ('home, sort by newest date', books.order_by(*get_sort_ordering('date_desc'))[:25]),
+            ('home, filter by status', books.filter(status='finished').order_by(*get_sort_ordering(None))[:25]),
+            ('home, filter by genre', books.filter(genre='fantasy').order_by(*get_sort_ordering(None))[:25]),
+            ('home, filter by rating', books.filter(rating=5).order_by(*get_sort_ordering(None))[:25]),
+            ('home, filter by year', books.filter(date_finished__gte=year_start, date_finished__lt=year_end).order_by(*get_sort_ordering(None))[:25]),
+            ('statistics, average rating', finished.values('user').annotate(avg=Avg('rating'))),
+            ('statistics, top 5-star books', finished.filter(rating=5, date_finished__isnull=False).order_by('-date_finished')[:3]),
+            ('essential list', books.filter(status='want_to_read').order_by('title')),
+            ('recommendations, favorite authors', finished.values('author').annotate(count=Count('id')).order_by('-count')[:3]),
+        ]
+
+    # Run EXPLAIN and time every query, returns a list of (name, plan, milliseconds)
+    def collect_plans(self, user, runs):
+        results = []
+
+        for name, queryset in self.get_queries(user):
+            plan = queryset.explain()
+
+            start = time.perf_counter()
+            for _ in range(runs):
+                list(queryset.all())
+            elapsed = (time.perf_counter() - start) * 1000 / runs
+
+            results.append((name, plan, elapsed))
+
+        return results
+
+    # Create a temporary user with random books, everything is rolled back at the end of the command
+    def seed_user(self, count):
+        user = User.objects.create_user(username=f'explain-{random.randint(0, 10**9)}')
+        genres = [choice[0] for choice in Book.GENRE_CHOICES]
+        statuses = [choice[0] for choice in Book.STATUS_CHOICES]
+        today = date.today()
+
+        Book.objects.bulk_create([
+            Book(
+                user=user,
+                title=f'Book {i}',
+                author=f'Author {random.randint(1, count // 10 + 1)}',
+                genre=random.choice(genres),
+                status=random.choice(statuses),
+                rating=random.choice([None, 1, 2, 3, 4, 5]),
+                date_finished=random.choice([None, today - timedelta(days=random.randint(0, 3650))]),
+            )
+            for i in range(count)
+        ], batch_size=1000)
+
+        return user
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+
+            if options['username']:
+                try:
+                    user = User.objects.get(username=options['username'])
+                except User.DoesNotExist:
+                    self.stdout.write(self.style.ERROR(f"No user named {options['username']}"))
+                    return
+            else:
+                user = self.seed_user(options['seed'])
+                self.stdout.write(f"Seeded {options['seed']} books for a temporary user")
+
+            # Refresh the planner statistics so it knows how many rows each user has
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+            # Drop the indexes inside a savepoint to get the plans from before they existed, then roll back to put them back
+            savepoint = transaction.savepoint()
+            with connection.cursor() as cursor:
+                for index in Book._meta.indexes:
+                    cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
+            before = self.collect_plans(user, options['runs'])
+            transaction.savepoint_rollback(savepoint)
+
+            after = self.collect_plans(user, options['runs'])
+
+            for (name, before_plan, before_ms), (_, after_plan, after_ms) in zip(before, after):
+                self.stdout.write(self.style.MIGRATE_HEADING(f'\n===== {name} ====='))
+                self.stdout.write(f'Before ({before_ms:.2f} ms):')
+                self.stdout.write(before_plan)
+                self.stdout.write(f'After ({after_ms:.2f} ms):')
+                self.stdout.write(after_plan)
+
+            # Never keep the seeded books or the dropped indexes
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS('\nExplain complete, no changes were saved.'))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from books.cache import uses_shared_cache
+from books.services import LATENCY_BUCKETS, get_google_books_stats, reset_google_books_stats
+
+
+# Create Django management command that inherits from BaseCommand
+class Command(BaseCommand):
+    help = 'Shows the number of Google Books calls, how many failed or were rejected by the circuit breaker, their latency and the search cache hit counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Set every counter back to 0')
+
+    def handle(self, *args, **options):
+
+        # The command runs in its own process so it would only see its own empty memory cache
+        if not uses_shared_cache():
+            raise CommandError('Google Books counters are only shared between processes with a shared cache, set REDIS_URL to collect them')
+
+        stats = get_google_books_stats()
+
+        # Avoid dividing by 0 if no calls have been made yet
+        avg_latency = stats['latency_ms'] / stats['calls'] if stats['calls'] else 0
+
+        self.stdout.write(f"Calls: {stats['calls']}")
+        self.stdout.write(f"Failures: {stats['failures']}")
+        self.stdout.write(f"Rejected by circuit breaker: {stats['rejected']}")
+        self.stdout.write(f'Average latency: {avg_latency:.0f}ms')
+
+        for limit in LATENCY_BUCKETS:
+            self.stdout.write(f"Under {limit}ms: {stats[f'under_{limit}ms']}")
+
+        self.stdout.write(f"Slower: {stats['slower']}")
+
+        # Searches answered by the in memory cache never reach Google so they are not in the calls above
+        self.stdout.write(f"Cache hits: {stats['cache_hits']}")
+        self.stdout.write(f"Stale cache hits: {stats['cache_stale']}")
+        self.stdout.write(f"Cache misses: {stats['cache_misses']}")
+        self.stdout.write(f"Coalesced with a search in flight: {stats['coalesced']}")
+
+        if options['reset']:
+            reset_google_books_stats()
+            self.stdout.write(self.style.SUCCESS('Counters reset'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from books.cache import get_grid_cache_stats, reset_grid_cache_stats, uses_shared_cache
+
+
+# Create Django management command that inherits from BaseCommand
+class Command(BaseCommand):
+    help = 'Shows how often rendered book grids were served from the cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Set the hit and miss counters back to 0')
+
+    def handle(self, *args, **options):
+
+        # The command runs in its own process so it would only see its own empty memory cache
+        if not uses_shared_cache():
+            raise CommandError('Grid cache counters are only shared between processes with a shared cache, set REDIS_URL to collect them')
+
+        stats = get_grid_cache_stats()
+        total = stats['hits'] + stats['misses']
+
+        # Avoid dividing by 0 if no grids have been requested yet
+        hit_rate = stats['hits'] / total * 100 if total else 0
+
+        self.stdout.write(f"Hits: {stats['hits']}")
+        self.stdout.write(f"Misses: {stats['misses']}")
+        self.stdout.write(f'Hit rate: {hit_rate:.1f}%')
+
+        if options['reset']:
+            reset_grid_cache_stats()
+            self.stdout.write(self.style.SUCCESS('Counters reset'))
@@ -0,0 +1,24 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from books.stats import rebuild_reading_stats
+
+
+# Create Django management command that inherits from BaseCommand
+class Command(BaseCommand):
+    help = 'Recounts the reading statistics tables from the books table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', action='append', help='Only rebuild the stats for this user, can be given more than once')
+
+    def handle(self, *args, **options):
+        user_ids = None
+
+        if options['username']:
+            user_ids = list(User.objects.filter(username__in=options['username']).values_list('id', flat=True))
+
+            if len(user_ids) != len(set(options['username'])):
+                raise CommandError('One or more usernames do not exist')
+
+        rebuild_reading_stats(user_ids)
+
+        self.stdout.write(self.style.SUCCESS('Reading stats rebuilt'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from books.models import Book
+from books.tasks import upload_cover
+
+
+# Create Django management command that inherits from BaseCommand
+class Command(BaseCommand):
+    help = 'Uploads the covers of books whose background upload failed or was lost when the server restarted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--failed-only', action='store_true', help='Skip books that are still pending')
+
+    def handle(self, *args, **options):
+        statuses = ['failed'] if options['failed_only'] else ['pending', 'failed']
+
+        books = Book.objects.filter(cover_status__in=statuses, cover_source_url__isnull=False)
+        book_ids = list(books.values_list('id', flat=True))
+
+        # upload_cover only works on pending books so failed ones are moved back to pending first
+        Book.objects.filter(id__in=book_ids, cover_status='failed').update(cover_status='pending')
+
+        for book_id in book_ids:
+            upload_cover(book_id)
+
+        ready = Book.objects.filter(id__in=book_ids, cover_status='ready').count()
+
+        self.stdout.write(self.style.SUCCESS(f'{ready} of {len(book_ids)} covers uploaded'))
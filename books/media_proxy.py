@@ -0,0 +1,134 @@
+import hashlib
+import os
+import tempfile
+import threading
+from io import BytesIO
+from pathlib import Path
+from django.conf import settings
+from django.core import signing
+from django.urls import reverse
+from PIL import Image
+import requests
+
+
+# Recommendation cards show covers 380 pixels tall, this covers them at double density
+MEDIA_PROXY_SIZE = (500, 760)
+
+# Covers bigger than this are not fetched, Google Books covers are well under it
+MEDIA_PROXY_MAX_BYTES = 5 * 1024 * 1024
+
+MEDIA_PROXY_TIMEOUT = (3.05, 5)
+
+# The cover for a proxy url never changes so browsers can keep it for a year
+MEDIA_PROXY_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+MEDIA_PROXY_SALT = 'books.media_proxy'
+
+# Only one thread of a worker evicts at a time
+eviction_lock = threading.Lock()
+
+
+def get_cache_dir():
+    return Path(settings.MEDIA_PROXY_CACHE_DIR)
+
+
+# Get the proxy url for a remote cover. The url is signed so the proxy only fetches covers the app linked to and can not be used
+# to fetch anything else. The resize size is part of the signed value so changing it gives every cover a new url
+def get_proxy_url(url):
+    token = signing.Signer(salt=MEDIA_PROXY_SALT).sign_object({'url': url, 'size': MEDIA_PROXY_SIZE})
+    return reverse('media-proxy', args=[token])
+
+
+# Get the remote url from a proxy token, raises signing.BadSignature if the token was changed
+def read_proxy_token(token):
+    return signing.Signer(salt=MEDIA_PROXY_SALT).unsign_object(token)['url']
+
+
+# Name of the cached file for a token, the same token always gives the same bytes so the name doubles as the ETag
+def get_cache_key(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+# Read a cover from the disk cache and mark it as just used, returns None if it is not cached
+def read_cached_cover(key):
+    path = get_cache_dir() / f'{key}.jpg'
+
+    try:
+        data = path.read_bytes()
+
+        # The modified time is when the cover was last used so eviction removes the least recently used covers first
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+
+    return data
+
+
+# Fetch a remote cover and shrink it, returns None if it can not be fetched or is not an image
+def fetch_cover(url):
+
+    # Google sends the small covers as http links, they are also served over https
+    url = url.replace('http://', 'https://', 1)
+
+    try:
+        with requests.get(url, timeout=MEDIA_PROXY_TIMEOUT, stream=True) as response:
+            response.raise_for_status()
+            data = response.raw.read(MEDIA_PROXY_MAX_BYTES + 1, decode_content=True)
+
+        if len(data) > MEDIA_PROXY_MAX_BYTES:
+            return None
+
+        image = Image.open(BytesIO(data))
+        image.draft('RGB', MEDIA_PROXY_SIZE)
+        image = image.convert('RGB')
+        image.thumbnail(MEDIA_PROXY_SIZE, Image.LANCZOS)
+
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', quality=80, optimize=True, progressive=True)
+    except (requests.RequestException, OSError, ValueError):
+        return None
+
+    return buffer.getvalue()
+
+
+# Store a cover in the disk cache then remove the least recently used covers if the cache is over its size limit
+def cache_cover(key, data):
+    cache_dir = get_cache_dir()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    # Write to a temporary file and rename it so another worker never reads half a file
+    with tempfile.NamedTemporaryFile(dir=cache_dir, suffix='.tmp', delete=False) as file:
+        file.write(data)
+
+    os.replace(file.name, cache_dir / f'{key}.jpg')
+
+    evict_covers()
+
+
+def evict_covers():
+    limit = settings.MEDIA_PROXY_CACHE_BYTES
+
+    with eviction_lock:
+        files = []
+
+        for entry in os.scandir(get_cache_dir()):
+            if entry.name.endswith('.jpg'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+
+        if total <= limit:
+            return
+
+        # Go down to 90% of the limit so the next few covers do not each have to evict again
+        for _, size, path in sorted(files):
+            if total <= limit * 0.9:
+                break
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+            total -= size
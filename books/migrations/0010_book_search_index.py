@@ -0,0 +1,23 @@
+from django.db import migrations
+from books.search import create_search_index, drop_search_index
+
+
+def forwards(apps, schema_editor):
+    create_search_index(schema_editor)
+
+
+def backwards(apps, schema_editor):
+    drop_search_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0009_book_uuid'),
+    ]
+
+    # Full text search index over title, author and review.
+    # PostgreSQL gets a generated tsvector column with a GIN index and SQLite gets an FTS5 shadow table kept in sync by triggers
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
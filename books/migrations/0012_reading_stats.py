@@ -0,0 +1,71 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from books.stats import rebuild_reading_stats
+
+
+# Fill the stats tables from the books that already exist
+def forwards(apps, schema_editor):
+    models = {name: apps.get_model('books', name) for name in ['Book', 'ReadingStats', 'GenreStats', 'YearStats', 'AuthorStats']}
+    rebuild_reading_stats(models=models)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0011_book_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReadingStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_books', models.IntegerField(default=0)),
+                ('rating_total', models.IntegerField(default=0)),
+                ('rated_books', models.IntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GenreStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('genre', models.CharField(choices=[('fiction', 'Fiction'), ('nonfiction', 'Non-Fiction'), ('mystery', 'Mystery'), ('scifi', 'Science Fiction'), ('fantasy', 'Fantasy'), ('thriller', 'Thriller'), ('romance', 'Romance'), ('biography', 'Biography'), ('history', 'History'), ('selfhelp', 'Self-Help')], max_length=50)),
+                ('total_books', models.IntegerField(default=0)),
+                ('rating_total', models.IntegerField(default=0)),
+                ('rated_books', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'genre'), name='unique_genre_stats')],
+            },
+        ),
+        migrations.CreateModel(
+            name='YearStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('total_books', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'year'), name='unique_year_stats')],
+            },
+        ),
+        migrations.CreateModel(
+            name='AuthorStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('author', models.CharField(max_length=100)),
+                ('total_books', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-total_books'], name='author_stats_top_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'author'), name='unique_author_stats')],
+            },
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0012_reading_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='cover_status',
+            field=models.CharField(choices=[('ready', 'Ready'), ('pending', 'Pending'), ('failed', 'Failed')], default='ready', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='cover_source_url',
+            field=models.URLField(blank=True, max_length=800, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0013_book_cover_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoverAsset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_url', models.URLField(blank=True, max_length=800, null=True, unique=True)),
+                ('content_hash', models.CharField(blank=True, max_length=64, null=True, unique=True)),
+                ('public_id', models.CharField(max_length=255)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0014_coverasset'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='cover_placeholder',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='cover_color',
+            field=models.CharField(blank=True, default='', max_length=7),
+        ),
+    ]
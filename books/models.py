@@ -27,6 +27,13 @@ class Book(models.Model):
         ('finished', 'Finished'),
     ]
     
+    # Covers picked from a Google Books search are uploaded in the background, the book shows a placeholder until they are ready
+    COVER_STATUS_CHOICES = [
+        ('ready', 'Ready'),
+        ('pending', 'Pending'),
+        ('failed', 'Failed'),
+    ]
+    
     # Create Universally unique indetifier field that generates a default uuid that is unique and can not be edited
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     
@@ -41,6 +48,12 @@ class Book(models.Model):
     genre = models.CharField(max_length=50, choices=GENRE_CHOICES)
     date_finished = models.DateField(null=True, blank=True)
     purchase_link = models.URLField(max_length=800, null=True, blank=True)
+    cover_status = models.CharField(max_length=10, choices=COVER_STATUS_CHOICES, default='ready')
+    # Google Books cover url kept so a failed upload can be tried again
+    cover_source_url = models.URLField(max_length=800, null=True, blank=True)
+    # Tiny blurred copy of the cover as a data uri and its average color, shown while the real cover loads
+    cover_placeholder = models.TextField(blank=True, default='')
+    cover_color = models.CharField(max_length=7, blank=True, default='')
     
     def __str__(self):
         return f'{self.title}'
@@ -48,6 +61,17 @@ class Book(models.Model):
     # Order by title
     class Meta:
         ordering = ['title']
+        
+        # Every page filters by user first so each index starts with user and then the column a page filters or sorts by.
+        # user, status, title covers the essential lists and statistics which filter on status and order by title
+        indexes = [
+            models.Index(fields=['user', 'status', 'title'], name='book_user_status_title_idx'),
+            models.Index(fields=['user', 'title'], name='book_user_title_idx'),
+            models.Index(fields=['user', 'author'], name='book_user_author_idx'),
+            models.Index(fields=['user', 'genre'], name='book_user_genre_idx'),
+            models.Index(fields=['user', 'date_finished'], name='book_user_date_finished_idx'),
+            models.Index(fields=['user', 'rating'], name='book_user_rating_idx'),
+        ]
      
     # Method that returns total stars filled/unfilled corresponding to the book rating
     def get_star_display(self):
@@ -59,4 +83,83 @@ class Book(models.Model):
         
         stars = filled_stars + empty_stars
         
-        return stars
\ No newline at end of file
+        return stars
+    
+    # Remember the values a book was loaded with so the reading stats can subtract the old values when it is saved
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        
+        # Deferred loads do not have every field so the stats signals will look the old values up instead
+        if all(field in field_names for field in STATS_FIELDS):
+            instance._stats_values = {field: value for field, value in zip(field_names, values) if field in STATS_FIELDS}
+        
+        return instance
+
+
+# One stored cover image shared by every book that uses it so the same cover is only uploaded once.
+# Search covers are found by the Google Books url and covers uploaded by hand by the sha256 of the file
+class CoverAsset(models.Model):
+    source_url = models.URLField(max_length=800, unique=True, null=True, blank=True)
+    content_hash = models.CharField(max_length=64, unique=True, null=True, blank=True)
+    # Name of the stored image that Book.image is set to
+    public_id = models.CharField(max_length=255)
+    created_date = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.public_id
+
+# Fields of a book that the reading stats are built from
+STATS_FIELDS = ['user_id', 'status', 'genre', 'rating', 'author', 'date_finished']
+
+
+# Running totals of a users finished books so the statistics page does not have to count every book.
+# The rows are kept up to date by the Book signals in books/signals.py and can be rebuilt with the rebuild_reading_stats command
+class ReadingStats(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE)
+    total_books = models.IntegerField(default=0)
+    # Sum of every rating and the number of books with a rating so the average ignores unrated books
+    rating_total = models.IntegerField(default=0)
+    rated_books = models.IntegerField(default=0)
+
+
+# Finished books per genre for each user
+class GenreStats(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    genre = models.CharField(max_length=50, choices=Book.GENRE_CHOICES)
+    total_books = models.IntegerField(default=0)
+    rating_total = models.IntegerField(default=0)
+    rated_books = models.IntegerField(default=0)
+    
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'genre'], name='unique_genre_stats')]
+
+
+# Finished books per year for each user, only counts books with a date finished
+class YearStats(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    year = models.IntegerField()
+    total_books = models.IntegerField(default=0)
+    
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'year'], name='unique_year_stats')]
+
+
+# Finished books per author for each user
+class AuthorStats(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    author = models.CharField(max_length=100)
+    total_books = models.IntegerField(default=0)
+    
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'author'], name='unique_author_stats')]
+        
+        # Used to get the top authors without sorting every author row
+        indexes = [models.Index(fields=['user', '-total_books'], name='author_stats_top_idx')]
+
+
+# The version of each users library that cached grids, facet counts and ETags are keyed by, see books/cache.py.
+# It is kept in the database so every worker sees a change straight away even when each one has its own memory cache
+class LibraryVersion(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    version = models.BigIntegerField()
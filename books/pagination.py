@@ -0,0 +1,132 @@
+import base64
+import json
+from datetime import date
+from django.db.models import F, Q
+
+
+# Number of book cards loaded on the home page at a time
+BOOKS_PAGE_SIZE = 24
+
+# Map each sort option to the field it orders by and whether it is descending
+# No sort selected uses the same title ordering as Book.Meta
+SORT_FIELDS = {
+    None: ('title', False),
+    'title_asc': ('title', False),
+    'author_asc': ('author', False),
+    'rating_desc': ('rating', True),
+    'rating_asc': ('rating', False),
+    'date_desc': ('date_finished', True),
+    'date_asc': ('date_finished', False),
+    # Only used with a search, search_rank is annotated by books.search.search_books
+    'relevance': ('search_rank', True),
+}
+
+
+# The type a cursor value must have for each sort field, dates are checked by parsing them
+CURSOR_VALUE_TYPES = {
+    'title': str,
+    'author': str,
+    'rating': int,
+    'search_rank': (int, float),
+}
+
+
+# Get the field and direction for a sort option, unknown sort values fall back to title ordering
+def get_sort_field(sort):
+    return SORT_FIELDS.get(sort, SORT_FIELDS[None])
+
+
+# Build the order_by arguments for a sort option
+# Books with no value always go last so both SQLite and PostgreSQL return the same order,
+# and id is added as a tiebreaker so books with the same title, rating or date have a stable position
+def get_sort_ordering(sort):
+    field, descending = get_sort_field(sort)
+
+    if descending:
+        return [F(field).desc(nulls_last=True), 'id']
+
+    return [F(field).asc(nulls_last=True), 'id']
+
+
+# Turn the sort value and id of the last book on a page into an opaque string for the url
+def encode_cursor(value, book_id):
+
+    # Dates are not json serializable so store them as an iso string which the date field lookups accept
+    if isinstance(value, date):
+        value = value.isoformat()
+
+    data = json.dumps([value, book_id]).encode()
+    return base64.urlsafe_b64encode(data).decode()
+
+
+# Turn a cursor string back into the sort value and book id, raises ValueError if the cursor was tampered with
+def decode_cursor(cursor):
+    try:
+        value, book_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+    if not isinstance(book_id, int):
+        raise ValueError('Invalid cursor')
+
+    return value, book_id
+
+
+# Check a cursor value fits the field it is compared with, a value of the wrong type would make the
+# database lookup fail instead of the cursor being rejected. Raises ValueError if it does not fit
+def get_cursor_value(field, value):
+    if value is None:
+        return None
+
+    if field == 'date_finished':
+        try:
+            return date.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise ValueError('Invalid cursor')
+
+    # bool is a subclass of int but is never a rating
+    if isinstance(value, bool) or not isinstance(value, CURSOR_VALUE_TYPES[field]):
+        raise ValueError('Invalid cursor')
+
+    return value
+
+
+# Only keep the books that come after the cursor in the current sort order
+# This compares against the last seen value instead of using OFFSET so the database can jump straight to the next page
+def apply_cursor(books, sort, cursor):
+    field, descending = get_sort_field(sort)
+    value, book_id = decode_cursor(cursor)
+    value = get_cursor_value(field, value)
+
+    # The cursor is inside the block of books with no value at the end, so only the later ids in that block are left
+    if value is None:
+        return books.filter(**{f'{field}__isnull': True, 'id__gt': book_id})
+
+    lookup = 'lt' if descending else 'gt'
+
+    # Books further along in the sort, books with the same value but a higher id, or books with no value which always come last
+    return books.filter(
+        Q(**{f'{field}__{lookup}': value}) |
+        Q(**{field: value, 'id__gt': book_id}) |
+        Q(**{f'{field}__isnull': True})
+    )
+
+
+# Get one page of books and the cursor for the next page, next cursor is None when there are no more books
+def get_books_page(books, sort, cursor=None, page_size=BOOKS_PAGE_SIZE):
+
+    if cursor:
+        books = apply_cursor(books, sort, cursor)
+
+    # Fetch one extra book so we know if there is another page without running a count query
+    page = list(books[:page_size + 1])
+
+    next_cursor = None
+
+    if len(page) > page_size:
+        page = page[:page_size]
+        field, _ = get_sort_field(sort)
+        last_book = page[-1]
+        next_cursor = encode_cursor(getattr(last_book, field), last_book.id)
+
+    return page, next_cursor
@@ -0,0 +1,158 @@
+import re
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+
+# Weights for title, author and review so matches in the title or author rank above matches in a review
+SQLITE_COLUMN_WEIGHTS = '10.0, 10.0, 1.0'
+
+# PostgreSQL keeps the search document in a generated tsvector column so it is always in sync with the row.
+# The simple configuration is used so author names are not stemmed and prefix searches match what the user typed
+POSTGRES_CREATE_SQL = [
+    '''
+    ALTER TABLE books_book ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(author, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(review, '')), 'B')
+    ) STORED
+    ''',
+    'CREATE INDEX IF NOT EXISTS books_book_search_idx ON books_book USING GIN (search_vector)',
+]
+
+POSTGRES_DROP_SQL = [
+    'DROP INDEX IF EXISTS books_book_search_idx',
+    'ALTER TABLE books_book DROP COLUMN IF EXISTS search_vector',
+]
+
+# SQLite keeps an FTS5 shadow table that points at books_book and triggers copy every change into it
+SQLITE_TABLE_SQL = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS books_book_fts USING fts5(
+        title, author, review, content='books_book', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )
+'''
+
+SQLITE_TRIGGER_SQL = [
+    '''
+    CREATE TRIGGER IF NOT EXISTS books_book_fts_insert AFTER INSERT ON books_book BEGIN
+        INSERT INTO books_book_fts(rowid, title, author, review) VALUES (new.id, new.title, new.author, new.review);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS books_book_fts_delete AFTER DELETE ON books_book BEGIN
+        INSERT INTO books_book_fts(books_book_fts, rowid, title, author, review) VALUES ('delete', old.id, old.title, old.author, old.review);
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS books_book_fts_update AFTER UPDATE ON books_book BEGIN
+        INSERT INTO books_book_fts(books_book_fts, rowid, title, author, review) VALUES ('delete', old.id, old.title, old.author, old.review);
+        INSERT INTO books_book_fts(rowid, title, author, review) VALUES (new.id, new.title, new.author, new.review);
+    END
+    ''',
+]
+
+SQLITE_DROP_SQL = [
+    'DROP TRIGGER IF EXISTS books_book_fts_insert',
+    'DROP TRIGGER IF EXISTS books_book_fts_delete',
+    'DROP TRIGGER IF EXISTS books_book_fts_update',
+    'DROP TABLE IF EXISTS books_book_fts',
+]
+
+
+# Create the full text search index for the database being used
+def create_search_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'postgresql':
+        for sql in POSTGRES_CREATE_SQL:
+            schema_editor.execute(sql)
+
+    elif vendor == 'sqlite':
+        schema_editor.execute(SQLITE_TABLE_SQL)
+        for sql in SQLITE_TRIGGER_SQL:
+            schema_editor.execute(sql)
+
+        # Fill the shadow table with the books that already exist
+        schema_editor.execute("INSERT INTO books_book_fts(books_book_fts) VALUES ('rebuild')")
+
+
+def drop_search_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+
+    if vendor == 'postgresql':
+        for sql in POSTGRES_DROP_SQL:
+            schema_editor.execute(sql)
+
+    elif vendor == 'sqlite':
+        for sql in SQLITE_DROP_SQL:
+            schema_editor.execute(sql)
+
+
+# SQLite migrations that alter books_book copy it into a new table and drop the old one, which also drops the triggers.
+# This runs after every migrate and puts the triggers back and resyncs the shadow table if they went missing
+def repair_search_index(using='default', **kwargs):
+    from django.db import connections
+
+    db = connections[using]
+
+    if db.vendor != 'sqlite':
+        return
+
+    with db.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'books_book_fts'")
+
+        # The search migration has not run yet
+        if cursor.fetchone() is None:
+            return
+
+        cursor.execute("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'books_book_fts_%'")
+
+        if cursor.fetchone()[0] == len(SQLITE_TRIGGER_SQL):
+            return
+
+        for sql in SQLITE_TRIGGER_SQL:
+            cursor.execute(sql)
+
+        cursor.execute("INSERT INTO books_book_fts(books_book_fts) VALUES ('rebuild')")
+
+
+# Split the search into words, punctuation is dropped so user input can never break the query syntax
+def get_search_terms(search):
+    return re.findall(r'[^\W_]+', search.lower())
+
+
+# Filter books to the ones matching the search and annotate each one with a search_rank where higher is more relevant
+def search_books(books, search):
+    terms = get_search_terms(search)
+
+    # Searches with no words like '!!!' can not use the index so fall back to a plain contains search
+    if not terms:
+        books = books.filter(Q(title__icontains=search) | Q(author__icontains=search) | Q(review__icontains=search))
+        return books.annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+    if connection.vendor == 'postgresql':
+
+        # Every word has to match and the last part of each word can be unfinished like 'hob' for 'hobbit'
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+
+        books = books.filter(RawSQL("books_book.search_vector @@ to_tsquery('simple', %s)", [tsquery], output_field=BooleanField()))
+
+        return books.annotate(search_rank=RawSQL("ts_rank(books_book.search_vector, to_tsquery('simple', %s))", [tsquery], output_field=FloatField()))
+
+    if connection.vendor == 'sqlite':
+
+        # Quote each word and mark it as a prefix, FTS5 requires every word to match
+        match = ' '.join(f'"{term}"*' for term in terms)
+
+        books = books.filter(id__in=RawSQL('SELECT rowid FROM books_book_fts WHERE books_book_fts MATCH %s', [match]))
+
+        # bm25 gives better matches a lower score so flip the sign to keep higher as more relevant
+        return books.annotate(search_rank=RawSQL(
+            f'SELECT -bm25(books_book_fts, {SQLITE_COLUMN_WEIGHTS}) FROM books_book_fts WHERE books_book_fts MATCH %s AND rowid = books_book.id',
+            [match],
+            output_field=FloatField(),
+        ))
+
+    # Other databases do not have a search index so use the contains search
+    books = books.filter(Q(title__icontains=search) | Q(author__icontains=search) | Q(review__icontains=search))
+    return books.annotate(search_rank=Value(0.0, output_field=FloatField()))
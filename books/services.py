@@ -1,11 +1,138 @@
 import os
+import orjson
+import threading
+import time
 import requests
 import cloudinary.uploader
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .cache import increment_counter
+from .google_books_cache import get_cached_search
+from .images import uses_cloudinary
+
+
+GOOGLE_BOOKS_URL = 'https://www.googleapis.com/books/v1/volumes'
+
+# Only ask Google for the fields the search results use instead of the full volumes with descriptions and identifiers
+GOOGLE_BOOKS_FIELDS = 'items(volumeInfo(title,authors,categories,imageLinks(thumbnail,smallThumbnail)),saleInfo(buyLink))'
+
+# Number of results the add book search shows, Google allows up to 40
+GOOGLE_BOOKS_MAX_RESULTS = 10
+
+# Seconds to wait to connect and then for each read, so a slow Google response can not hold a worker forever
+GOOGLE_BOOKS_TIMEOUT = (3.05, 5)
+
+# After this many failed calls in a row stop calling Google and fail fast until the reset time has passed
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30
+
+# Upper bounds in milliseconds of the latency buckets the calls are counted in, anything slower goes in the last bucket
+LATENCY_BUCKETS = [100, 250, 500, 1000, 2500]
+
+
+# Create the session used for every Google Books call so connections and TLS sessions are reused between searches
+def create_google_books_session():
+    
+    # Retry connection errors and server errors twice with a random jitter added to the backoff so workers do not retry together.
+    # Reads are not retried because a read that timed out already used the full timeout
+    retry = Retry(
+        total=2,
+        read=0,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=['GET'],
+        backoff_factor=0.2,
+        backoff_jitter=0.3,
+        respect_retry_after_header=False,
+        raise_on_status=False,
+    )
+    
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=10, max_retries=retry))
+    
+    return session
+
+
+google_books_session = create_google_books_session()
+
+# Circuit breaker state for this worker, opened_at is set while Google is treated as down
+breaker = {'failures': 0, 'opened_at': None}
+breaker_lock = threading.Lock()
+
+
+# Check if a call to Google is allowed.
+# Once the reset time has passed one call is let through to test Google and the rest keep failing fast until it finishes
+def breaker_allows_request():
+    with breaker_lock:
+        if breaker['opened_at'] is None:
+            return True
+        
+        if time.monotonic() - breaker['opened_at'] >= BREAKER_RESET_SECONDS:
+            breaker['opened_at'] = time.monotonic()
+            return True
+        
+        return False
+
+
+def record_breaker_result(failed):
+    with breaker_lock:
+        if not failed:
+            breaker['failures'] = 0
+            breaker['opened_at'] = None
+            return
+        
+        breaker['failures'] += 1
+        
+        if breaker['failures'] >= BREAKER_FAILURE_THRESHOLD:
+            breaker['opened_at'] = time.monotonic()
+
+
+def reset_google_books_breaker():
+    with breaker_lock:
+        breaker['failures'] = 0
+        breaker['opened_at'] = None
+
+
+# Record the result and latency of a call in the breaker and in the cache counters, they are only shared by every worker with REDIS_URL set
+def record_google_books_call(started, failed):
+    latency = int((time.perf_counter() - started) * 1000)
+    
+    record_breaker_result(failed)
+    
+    bucket = next((f'under_{limit}ms' for limit in LATENCY_BUCKETS if latency < limit), 'slower')
+    
+    increment_counter('google-books-stats:calls')
+    increment_counter('google-books-stats:latency_ms', latency)
+    increment_counter(f'google-books-stats:{bucket}')
+    
+    if failed:
+        increment_counter('google-books-stats:failures')
+
+
+# Names of every counter kept for Google Books calls
+def get_google_books_stat_names():
+    return (
+        ['calls', 'failures', 'rejected', 'latency_ms'] + [f'under_{limit}ms' for limit in LATENCY_BUCKETS] + ['slower'] +
+        ['cache_hits', 'cache_stale', 'cache_misses', 'coalesced']
+    )
+
+
+def get_google_books_stats():
+    return {name: cache.get(f'google-books-stats:{name}', 0) for name in get_google_books_stat_names()}
+
+
+def reset_google_books_stats():
+    cache.delete_many([f'google-books-stats:{name}' for name in get_google_books_stat_names()])
 
 def upload_image_to_cloudinary(image_url):
     
     # Try to use image url to upload to cloudinary
     try:
+        
+        # The local stand in for Cloudinary fetches the image itself so covers can be added offline
+        if not uses_cloudinary():
+            return default_storage.upload_from_url(image_url, 'images')
                 
         # Upload image to Cloudinary and store the public_id so backend can build url
         cloudinary_result = cloudinary.uploader.upload(image_url, folder='media/images')
@@ -17,20 +144,49 @@ def upload_image_to_cloudinary(image_url):
     
     return image
     
-def search_google_books(search):
+# Search Google Books through the in memory cache, identical searches share results and concurrent ones share one request.
+# Callers that only use the first result or two pass a smaller max_results so Google sends less
+def search_google_books(search, max_results=GOOGLE_BOOKS_MAX_RESULTS):
+    return get_cached_search(search, fetch_google_books, max_results)
+
+
+def fetch_google_books(search, max_results=GOOGLE_BOOKS_MAX_RESULTS):
     # Get the google api key used to connect to google books
     api_key = os.environ.get('GOOGLE_BOOKS_API_KEY')
     
+    # Google has been failing so return None straight away which shows the search unavailable message
+    if not breaker_allows_request():
+        increment_counter('google-books-stats:rejected')
+        return None
+    
+    started = time.perf_counter()
+    
     try:
-        # Make a GET Request book to the google books api using the api key and the users search query
-        response = requests.get(f'https://www.googleapis.com/books/v1/volumes?q={search}&key={api_key}')
+        # Make a GET Request book to the google books api using the api key and the users search query.
+        # Passing params lets requests url encode the search so characters like & or # can not break the url
+        params = {'q': search, 'key': api_key, 'maxResults': max_results, 'fields': GOOGLE_BOOKS_FIELDS}
+        response = google_books_session.get(GOOGLE_BOOKS_URL, params=params, timeout=GOOGLE_BOOKS_TIMEOUT)
     
-        # Convert the json formatted response string into a Python dictionary
-        data = response.json()
+        # Convert the json formatted response bytes into a Python dictionary, orjson parses straight from bytes and is faster than json
+        data = orjson.loads(response.content)
     
     except Exception:
+        record_google_books_call(started, failed=True)
+        return None
+    
+    # Rate limits and server errors count towards opening the breaker
+    failed = response.status_code == 429 or response.status_code >= 500
+    record_google_books_call(started, failed=failed)
+    
+    # The error response has no items, returning None shows the search unavailable message and keeps it out of the cache
+    if failed:
         return None
     
+    return get_search_results(data)
+
+
+# Turn a parsed Google Books response into the list of results the app uses
+def get_search_results(data):
     search_results = []
     
     for item in data.get('items', []):
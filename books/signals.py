@@ -0,0 +1,54 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Book, STATS_FIELDS
+from .cache import bump_library_version
+from .stats import get_stats_values, update_reading_stats
+
+
+# Listen for when a book is saved or deleted
+@receiver([post_save, post_delete], sender=Book)
+def book_changed(sender, instance, **kwargs):
+    
+    # Start a new library version for the books owner so their cached data is rebuilt
+    bump_library_version(instance.user_id)
+
+
+# Get the values the book had in the database before it is saved so the stats can take them away again
+@receiver(pre_save, sender=Book)
+def book_saving(sender, instance, **kwargs):
+    
+    if instance._state.adding:
+        instance._stats_old_values = None
+    
+    # Books loaded with every stats field already remember them, otherwise look them up
+    elif hasattr(instance, '_stats_values'):
+        instance._stats_old_values = instance._stats_values
+    else:
+        instance._stats_old_values = Book.objects.filter(pk=instance.pk).values(*STATS_FIELDS).first()
+
+
+# Move the book from its old values to its new values in the reading stats
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, **kwargs):
+    new_values = get_stats_values(instance)
+    
+    update_reading_stats(getattr(instance, '_stats_old_values', None), new_values)
+    
+    # The saved values are the old values for the next save of this instance
+    instance._stats_values = new_values
+
+
+# Take a deleted book out of the reading stats using the values it was saved with
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    old_values = getattr(instance, '_stats_values', None) or get_stats_values(instance)
+    
+    update_reading_stats(old_values, None)
+
+
+# Give new users a fresh library version so they never see cached data from a deleted user that had the same id.
+# Changes to an existing user also start a new version because every page shows the username
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    bump_library_version(instance.id)
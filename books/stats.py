@@ -0,0 +1,126 @@
+from datetime import date
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import ExtractYear
+from .models import Book, STATS_FIELDS, ReadingStats, GenreStats, YearStats, AuthorStats
+
+
+# Get the stats fields of a book as a dict like the one Book.from_db stores
+def get_stats_values(book):
+    return {field: getattr(book, field) for field in STATS_FIELDS}
+
+
+# Get what a book adds to its owners reading stats, books that are not finished do not add anything
+def get_stats_contribution(values):
+    if not values or values['status'] != 'finished':
+        return None
+
+    rating = values['rating']
+    date_finished = values['date_finished']
+
+    # Books created in code can still have the strings they were given instead of an int and a date
+    if rating in ('', None):
+        rating = None
+    else:
+        rating = int(rating)
+
+    if isinstance(date_finished, str):
+        date_finished = date.fromisoformat(date_finished) if date_finished else None
+
+    return {
+        'user_id': values['user_id'],
+        'genre': values['genre'],
+        'author': values['author'],
+        'rating': rating,
+        'year': date_finished.year if date_finished else None,
+    }
+
+
+# Add sign * a books contribution to every stats row it belongs to, each row is a single UPDATE by its unique key.
+# Rows are only created when adding, when removing a missing row means the user is being deleted so there is nothing to update.
+# A missing row is created empty with ignore_conflicts and then updated, so two saves creating the same row at once both count
+def apply_contribution(contribution, sign):
+    user_id = contribution['user_id']
+    rating = contribution['rating']
+
+    totals = {'total_books': F('total_books') + sign}
+    rating_totals = {
+        **totals,
+        'rating_total': F('rating_total') + sign * (rating or 0),
+        'rated_books': F('rated_books') + (sign if rating is not None else 0),
+    }
+
+    rows = [
+        (ReadingStats, {'user_id': user_id}, rating_totals),
+        (GenreStats, {'user_id': user_id, 'genre': contribution['genre']}, rating_totals),
+        (AuthorStats, {'user_id': user_id, 'author': contribution['author']}, totals),
+    ]
+
+    # Books without a date finished are not counted in any year
+    if contribution['year'] is not None:
+        rows.append((YearStats, {'user_id': user_id, 'year': contribution['year']}, totals))
+
+    for model, lookup, changes in rows:
+        updated = model.objects.filter(**lookup).update(**changes)
+
+        if not updated and sign > 0:
+            model.objects.bulk_create([model(**lookup)], ignore_conflicts=True)
+            model.objects.filter(**lookup).update(**changes)
+
+
+# Move a book from its old values to its new values in the reading stats, either side can be None for a new or deleted book
+def update_reading_stats(old_values, new_values):
+    old = get_stats_contribution(old_values)
+    new = get_stats_contribution(new_values)
+
+    # Edits to fields the stats do not use like the title or review do not touch the stats tables
+    if old == new:
+        return
+
+    if old:
+        apply_contribution(old, -1)
+
+    if new:
+        apply_contribution(new, 1)
+
+
+# Throw away the stats for the given users, or everyone, and count them again from their books.
+# It runs in one transaction so the statistics page never sees the tables empty and saves made meanwhile wait for it.
+# The models can be passed in so the data migration can use the historical versions
+@transaction.atomic
+def rebuild_reading_stats(user_ids=None, models=None):
+    if models is None:
+        models = {'Book': Book, 'ReadingStats': ReadingStats, 'GenreStats': GenreStats, 'YearStats': YearStats, 'AuthorStats': AuthorStats}
+
+    books = models['Book'].objects.filter(status='finished').order_by()
+
+    if user_ids is not None:
+        books = books.filter(user_id__in=user_ids)
+
+    for name in ['ReadingStats', 'GenreStats', 'YearStats', 'AuthorStats']:
+        rows = models[name].objects.all()
+
+        if user_ids is not None:
+            rows = rows.filter(user_id__in=user_ids)
+
+        rows.delete()
+
+    rating_totals = {
+        'total_books': Count('id'),
+        'rating_total': Sum('rating', default=0),
+        'rated_books': Count('id', filter=Q(rating__isnull=False)),
+    }
+
+    models['ReadingStats'].objects.bulk_create(
+        models['ReadingStats'](**row) for row in books.values('user_id').annotate(**rating_totals)
+    )
+    models['GenreStats'].objects.bulk_create(
+        models['GenreStats'](**row) for row in books.values('user_id', 'genre').annotate(**rating_totals)
+    )
+    models['AuthorStats'].objects.bulk_create(
+        models['AuthorStats'](**row) for row in books.values('user_id', 'author').annotate(total_books=Count('id'))
+    )
+    models['YearStats'].objects.bulk_create(
+        models['YearStats'](**row) for row in books.filter(date_finished__isnull=False)
+        .values('user_id', year=ExtractYear('date_finished')).annotate(total_books=Count('id'))
+    )
@@ -0,0 +1,82 @@
+import hashlib
+import os
+import random
+import time
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+import requests
+
+
+# Stand in for Cloudinary that keeps images on the local disk so image features can be run, benchmarked and load tested offline.
+# It works like Cloudinary where the code depends on it:
+#  - names are made from the content so the same image is only stored once, like a public_id
+#  - urls contain /upload/ so images.py can add transformations like c_scale,w_240 which the local_media view applies
+#  - upload_from_url fetches a remote image itself like cloudinary.uploader.upload
+#  - every call can wait latency seconds, plus up to jitter more, to act like a network round trip
+@deconstructible
+class LocalMediaStorage(FileSystemStorage):
+
+    # Tells images.py that resized copies come from transformation urls so no variant files are made
+    transformation_urls = True
+
+    def __init__(self, latency=0, jitter=0, **kwargs):
+        kwargs.setdefault('location', settings.MEDIA_ROOT)
+        kwargs.setdefault('base_url', f'{settings.MEDIA_URL}upload/')
+
+        # Names only change when the content does so a name never needs a suffix to be unique,
+        # and two requests storing the same image at once write the same bytes to the same name so either can win
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.jitter = jitter
+
+    def wait(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    # Store the file under a hash of its content in the same folder, 'images/dune.png' becomes 'images/3f7a...c2.png'.
+    # An image that is already stored is not written again and keeps its name
+    def _save(self, name, content):
+        self.wait()
+
+        digest = hashlib.sha256()
+
+        for chunk in content.chunks():
+            digest.update(chunk)
+
+        content.seek(0)
+
+        folder, filename = os.path.split(name)
+        _, extension = os.path.splitext(filename)
+        name = os.path.join(folder, digest.hexdigest()[:32] + extension.lower())
+
+        if self.exists(name):
+            return name
+
+        return super()._save(name, content)
+
+    def _open(self, name, mode='rb'):
+        self.wait()
+        return super()._open(name, mode)
+
+    # Fetch a remote image and store it in a folder the way cloudinary.uploader.upload does, returns its name.
+    # Only https urls are fetched so a posted url can never read a file on the server or reach a plain http service
+    def upload_from_url(self, source, folder):
+        if not source.startswith('https://'):
+            raise ValueError(f'Only https images can be uploaded from a url, got {source!r}')
+
+        self.wait()
+
+        response = requests.get(source, timeout=(3.05, 10))
+        response.raise_for_status()
+        content = response.content
+
+        # Google Books cover urls have no extension, they are always JPEGs
+        _, extension = os.path.splitext(source.split('?')[0])
+
+        if extension.lower() not in ('.jpg', '.jpeg', '.png', '.gif', '.webp'):
+            extension = '.jpg'
+
+        return self.save(f'{folder}/image{extension}', ContentFile(content))
@@ -0,0 +1,102 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connections, transaction
+from .models import Book
+from .cache import bump_library_version
+from .services import upload_image_to_cloudinary
+from .covers import get_cover_for_url, remember_cover
+from .images import create_cover_variants, get_cover_preview
+
+
+# Number of times a cover upload is tried and the seconds to wait before the first retry, the wait doubles after each failure
+COVER_UPLOAD_ATTEMPTS = 3
+COVER_UPLOAD_BACKOFF = 2
+
+# A couple of threads per worker is enough since each upload mostly waits on Cloudinary
+background_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='background-task')
+
+
+# Run a function on the background threads, the thread closes its database connection when done so connections are not left open.
+# Slow tasks like PDF exports pass their own executor so they can not hold up cover uploads
+def submit_task(func, *args, executor=background_executor):
+
+    def run():
+        try:
+            func(*args)
+        finally:
+            connections.close_all()
+
+    executor.submit(run)
+
+
+# Upload a books cover in the background once the book has been saved
+def queue_cover_upload(book):
+    book_id = book.id
+
+    # Wait for the transaction so the background thread can see the book
+    transaction.on_commit(lambda: submit_task(upload_cover, book_id))
+
+
+# Upload the Google Books cover for a pending book to Cloudinary and store it on the book, retrying with backoff if it fails
+def upload_cover(book_id, attempts=COVER_UPLOAD_ATTEMPTS):
+    book = Book.objects.filter(id=book_id, cover_status='pending').only('id', 'user', 'cover_source_url').first()
+
+    # The book was deleted or given another cover while it waited
+    if book is None:
+        return
+
+    # Another book with the same cover may have finished uploading it while this one waited
+    image = get_cover_for_url(book.cover_source_url)
+
+    for attempt in range(attempts if image is None else 0):
+        image = upload_image_to_cloudinary(book.cover_source_url)
+
+        if image:
+            break
+
+        # Add a random jitter so uploads that failed together do not all retry at the same moment
+        if attempt < attempts - 1:
+            time.sleep(COVER_UPLOAD_BACKOFF * 2 ** attempt + random.uniform(0, 1))
+
+    # update() is used so saving the cover does not count as an edit to the book, which would reset the users recommendations.
+    # Only pending books are updated so a cover the user uploaded while this ran is kept
+    if image:
+        Book.objects.filter(id=book_id, cover_status='pending').update(image=image, cover_status='ready', **(get_cover_preview(image) or {}))
+        remember_cover(image, source_url=book.cover_source_url)
+    else:
+        Book.objects.filter(id=book_id, cover_status='pending').update(cover_status='failed')
+
+    # Cached pages still show the placeholder so start a new library version
+    bump_library_version(book.user_id)
+
+
+# Make the resized files in the background once the cover is saved so the request does not wait for Pillow.
+# Pages rendered before the files existed are cached so the owner gets a new library version afterwards
+def queue_cover_variants(name, user_id):
+
+    def create_and_refresh():
+        create_cover_variants(name)
+        bump_library_version(user_id)
+
+    transaction.on_commit(lambda: submit_task(create_and_refresh))
+
+
+# Make the placeholder and color for a books cover in the background once the book is saved
+def queue_cover_preview(book):
+    book_id = book.id
+
+    transaction.on_commit(lambda: submit_task(update_cover_preview, book_id))
+
+
+def update_cover_preview(book_id):
+    book = Book.objects.filter(id=book_id).only('id', 'user', 'image').first()
+
+    if book is None or not book.image:
+        return
+
+    preview = get_cover_preview(book.image.name)
+
+    # Only update the book if it still has the same cover
+    if preview and Book.objects.filter(id=book_id, image=book.image.name).update(**preview):
+        bump_library_version(book.user_id)
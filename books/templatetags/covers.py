@@ -0,0 +1,51 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+from books.images import COVER_VARIANTS, get_variant_widths, get_variant_url
+from books.media_proxy import get_proxy_url
+
+
+register = template.Library()
+
+
+# Render an img tag for a cover at the size of a variant, for example {% cover_img book.image 'card' alt=book.title class='card-img-top' %}
+# placeholder and color take the books cover_placeholder and cover_color so the space is filled before the cover loads
+# The browser picks the smallest resized file from srcset and only loads covers when they are about to scroll into view
+@register.simple_tag
+def cover_img(image, variant, **attrs):
+    sources = []
+
+    for width in get_variant_widths(variant):
+        url = get_variant_url(image.name, width)
+
+        if url:
+            sources.append(f'{url} {width}w')
+
+    # Covers without resized files yet fall back to the original image
+    if sources:
+        attrs['srcset'] = ', '.join(sources)
+        attrs['sizes'] = COVER_VARIANTS[variant]['sizes']
+
+    # Show the blurred placeholder on the cover color until the image has loaded
+    placeholder = attrs.pop('placeholder', '')
+    color = attrs.pop('color', '')
+    background = []
+
+    if color:
+        background.append(f'background-color: {color};')
+
+    if placeholder:
+        background.append(f'background-image: url({placeholder}); background-size: cover; background-position: center;')
+
+    if background:
+        attrs['style'] = ' '.join([attrs.get('style', '')] + background).strip()
+
+    attrs.setdefault('loading', 'lazy')
+    attrs.setdefault('decoding', 'async')
+
+    return format_html('<img src="{}" {}>', image.url, format_html_join(' ', '{}="{}"', attrs.items()))
+
+
+# Serve a remote cover through the media proxy instead of linking to Google, for example {{ recommendation.cover_link|proxied_cover }}
+@register.filter
+def proxied_cover(url):
+    return get_proxy_url(url)
@@ -1,10 +1,37 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+import base64
+import json
 from django.contrib.auth.models import User
-from .models import Book
+from .models import Book, CoverAsset, GenreStats, LibraryVersion
+from .stats import rebuild_reading_stats
 from accounts.models import Profile
 from django.urls import reverse
-from .services import search_google_books
-from unittest.mock import patch
+from .services import search_google_books, upload_image_to_cloudinary, reset_google_books_breaker, GOOGLE_BOOKS_TIMEOUT, GOOGLE_BOOKS_FIELDS, BREAKER_FAILURE_THRESHOLD
+from unittest.mock import patch, MagicMock, call
+from django.db.models import F
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from .cache import get_grid_cache_stats, get_library_version, reset_grid_cache_stats
+from .google_books_cache import clear_google_books_cache
+from .tasks import upload_cover, COVER_UPLOAD_ATTEMPTS
+from .images import create_cover_variants, get_all_variant_widths, get_variant_name, get_variant_url, get_cover_preview, process_upload
+from .storage import LocalMediaStorage
+from .media_proxy import get_proxy_url, cache_cover, read_cached_cover
+import os
+import shutil
+import tempfile
+from django.core.exceptions import ValidationError
+from concurrent.futures import ThreadPoolExecutor
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.template import Context, Template
+from io import BytesIO
+from PIL import Image
+import threading
+import time
+from django.core.management import call_command, CommandError
+from io import StringIO
 
 
 class BookModelTests(TestCase):
@@ -121,8 +148,535 @@ class AddBookTests(TestCase):
         # Assert - Check that redirect to home happens and new book exists
         self.assertRedirects(response, '/books/')
         self.assertTrue(Book.objects.filter(title='New Book', user=self.user).exists())
+    
+    @patch('books.tasks.submit_task')
+    @patch('books.tasks.upload_image_to_cloudinary')
+    def test_add_book_uploads_search_cover_in_background(self, mock_upload, mock_submit):
+        # Arrange - Run the background task straight away once the transaction commits
+        mock_submit.side_effect = lambda func, *args: func(*args)
+        mock_upload.return_value = 'images/cover'
+        self.client.login(username='testuser', password='testpass123')
+        # Act
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.client.post(reverse('add-book'), {
+                'title': 'New Book',
+                'author': 'New Author',
+                'status': 'finished',
+                'genre': 'fiction',
+                'image_url': 'https://books.google.com/cover.jpg',
+            })
+        book = Book.objects.get(title='New Book')
+        # Assert - The book is saved with a pending cover before the upload runs
+        self.assertEqual(book.cover_status, 'pending')
+        self.assertContains(self.client.get(reverse('home')), 'Cover uploading')
+        mock_upload.assert_not_called()
+        for callback in callbacks:
+            callback()
+        book.refresh_from_db()
+        self.assertEqual(book.cover_status, 'ready')
+        self.assertEqual(book.image.name, 'images/cover')
+    
+    @patch('books.tasks.submit_task')
+    @patch('books.tasks.upload_image_to_cloudinary')
+    def test_add_book_reuses_known_search_cover(self, mock_upload, mock_submit):
+        # Arrange - Another user already added a book with this cover
+        CoverAsset.objects.create(source_url='https://books.google.com/cover.jpg', public_id='images/cover')
+        self.client.login(username='testuser', password='testpass123')
+        # Act
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('add-book'), {
+                'title': 'New Book',
+                'author': 'New Author',
+                'status': 'finished',
+                'genre': 'fiction',
+                'image_url': 'https://books.google.com/cover.jpg',
+            })
+        book = Book.objects.get(title='New Book')
+        # Assert - The stored cover is used straight away without an upload
+        self.assertEqual(book.cover_status, 'ready')
+        self.assertEqual(book.image.name, 'images/cover')
+        mock_upload.assert_not_called()
+        self.assertNotIn(upload_cover, [call.args[0] for call in mock_submit.call_args_list])
+    
+    @patch('books.tasks.submit_task')
+    def test_add_book_rejects_cover_url_not_from_google_books(self, mock_submit):
+        # Arrange
+        self.client.login(username='testuser', password='testpass123')
+        # Act
+        responses = [
+            self.client.post(reverse('add-book'), {'title': 'New Book', 'author': 'New Author', 'status': 'finished', 'genre': 'fiction', 'image_url': image_url})
+            for image_url in ['/etc/passwd', 'http://books.google.com/cover.jpg', 'https://internal.example.com/admin']
+        ]
+        # Assert - The form is shown again with an error and nothing is saved or fetched
+        for response in responses:
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, 'Pick a cover from the book search')
+        self.assertFalse(Book.objects.exists())
+        mock_submit.assert_not_called()
+    
+    @override_settings(STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    })
+    def test_add_book_reuses_same_uploaded_file(self):
+        # Arrange
+        self.client.login(username='testuser', password='testpass123')
+        data = {'author': 'New Author', 'status': 'finished', 'genre': 'fiction'}
+        buffer = BytesIO()
+        Image.new('RGB', (60, 90), 'navy').save(buffer, 'PNG')
+        # Act - Upload the same image for two books
+        for title in ['First Book', 'Second Book']:
+            cover = SimpleUploadedFile('cover.png', buffer.getvalue(), content_type='image/png')
+            self.client.post(reverse('add-book'), {**data, 'title': title, 'image': cover})
+        first = Book.objects.get(title='First Book')
+        second = Book.objects.get(title='Second Book')
+        # Assert - The second book points at the file stored for the first one
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(CoverAsset.objects.count(), 1)
+    
+    @patch('books.tasks.time.sleep')
+    @patch('books.tasks.upload_image_to_cloudinary')
+    def test_cover_upload_retries_then_marks_failed(self, mock_upload, mock_sleep):
+        # Arrange
+        mock_upload.return_value = None
+        book = Book.objects.create(user=self.user, title='New Book', author='New Author', genre='fiction', cover_status='pending', cover_source_url='https://books.google.com/cover.jpg')
+        # Act
+        upload_cover(book.id)
+        # Assert - Every attempt was made with a longer wait before each retry
+        book.refresh_from_db()
+        self.assertEqual(book.cover_status, 'failed')
+        self.assertEqual(mock_upload.call_count, COVER_UPLOAD_ATTEMPTS)
+        waits = [call.args[0] for call in mock_sleep.call_args_list]
+        self.assertEqual(len(waits), COVER_UPLOAD_ATTEMPTS - 1)
+        self.assertLess(waits[0], waits[1])
  
 
+
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+class CoverVariantTests(TestCase):
+    
+    def setUp(self):
+        # Store a large cover like the ones Google Books returns at zoom=0
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 1800), 'navy').save(buffer, 'PNG')
+        self.name = default_storage.save('images/cover.png', ContentFile(buffer.getvalue()))
+    
+    def test_variants_are_resized_from_the_cover(self):
+        # Act
+        create_cover_variants(self.name)
+        # Assert - Every variant width was made and none are as big as the original
+        for width in get_all_variant_widths():
+            with default_storage.open(get_variant_name(self.name, width)) as file:
+                self.assertEqual(Image.open(file).width, width)
+    
+    def test_cover_img_tag_renders_srcset_and_lazy_loading(self):
+        # Arrange
+        create_cover_variants(self.name)
+        book = Book(title='Dune', image=self.name)
+        # Act
+        html = Template("{% load covers %}{% cover_img book.image 'card' alt=book.title %}").render(Context({'book': book}))
+        # Assert
+        self.assertIn(f"{get_variant_name(self.name, 240)} 240w", html)
+        self.assertIn(f"{get_variant_name(self.name, 480)} 480w", html)
+        self.assertIn('sizes="240px"', html)
+        self.assertIn('loading="lazy"', html)
+    
+    def test_cover_preview_is_tiny_placeholder_and_average_color(self):
+        # Act
+        preview = get_cover_preview(self.name)
+        # Assert - The cover is all navy so the color is navy
+        self.assertTrue(preview['cover_placeholder'].startswith('data:image/png;base64,'))
+        self.assertLess(len(preview['cover_placeholder']), 1000)
+        self.assertEqual(preview['cover_color'], '#000080')
+    
+    @patch('books.management.commands.backfill_cover_previews.ProcessPoolExecutor', ThreadPoolExecutor)
+    def test_backfill_command_fills_existing_covers(self):
+        # Arrange - Threads stand in for the process pool so they share the in memory storage
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        book = Book.objects.create(user=user, title='Dune', author='Frank Herbert', genre='scifi', image=self.name)
+        # Act
+        call_command('backfill_cover_previews', batch_size=1, workers=1, stdout=StringIO())
+        # Assert
+        book.refresh_from_db()
+        self.assertEqual(book.cover_color, '#000080')
+        self.assertIn(book.cover_color, Template("{% load covers %}{% cover_img book.image 'card' color=book.cover_color %}").render(Context({'book': book})))
+    
+    def test_cover_img_tag_uses_original_without_variants(self):
+        # Arrange
+        book = Book(title='Dune', image=self.name)
+        # Act
+        html = Template("{% load covers %}{% cover_img book.image 'card' %}").render(Context({'book': book}))
+        # Assert
+        self.assertNotIn('srcset', html)
+        self.assertIn(self.name, html)
+
+
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+class DirectUploadTests(TestCase):
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+        buffer = BytesIO()
+        Image.new('RGB', (60, 90), 'navy').save(buffer, 'PNG')
+        self.image = buffer.getvalue()
+    
+    # Upload an image the way the browser does, straight to the local stand in with the fields from the signature
+    def upload(self, kind):
+        signature = self.client.get(reverse('upload-signature'), {'kind': kind}).json()
+        file = SimpleUploadedFile('photo.png', self.image, content_type='image/png')
+        response = self.client.post(signature['upload_url'], {**signature['fields'], 'file': file})
+        uploaded = response.json()
+        return {'uploaded_image': uploaded['public_id'], 'uploaded_version': uploaded['version'], 'uploaded_signature': uploaded['signature']}
+    
+    def test_add_book_records_image_uploaded_straight_to_storage(self):
+        # Arrange
+        uploaded = self.upload('cover')
+        # Act - Only the name of the uploaded image is posted with the form
+        self.client.post(reverse('add-book'), {'title': 'Dune', 'author': 'Frank Herbert', 'status': 'finished', 'genre': 'scifi', **uploaded})
+        # Assert
+        book = Book.objects.get(title='Dune')
+        self.assertEqual(book.image.name, uploaded['uploaded_image'])
+        self.assertTrue(book.image.name.startswith('images/'))
+        self.assertTrue(default_storage.exists(book.image.name))
+    
+    def test_edit_book_records_image_uploaded_straight_to_storage(self):
+        # Arrange
+        book = Book.objects.create(user=self.user, title='Dune', author='Frank Herbert', genre='scifi', status='finished', cover_status='failed')
+        uploaded = self.upload('cover')
+        # Act
+        self.client.post(reverse('edit-book', args=[book.uuid]), {'title': 'Dune', 'author': 'Frank Herbert', 'status': 'finished', 'genre': 'scifi', **uploaded})
+        # Assert
+        book.refresh_from_db()
+        self.assertEqual(book.image.name, uploaded['uploaded_image'])
+        self.assertEqual(book.cover_status, 'ready')
+    
+    def test_unsigned_image_name_is_ignored(self):
+        # Arrange - A stored file the user did not upload, like another users cover
+        default_storage.save('images/someone-else.png', ContentFile(self.image))
+        uploaded = {'uploaded_image': 'images/someone-else.png', 'uploaded_version': '1', 'uploaded_signature': 'forged'}
+        # Act
+        self.client.post(reverse('add-book'), {'title': 'Dune', 'author': 'Frank Herbert', 'status': 'finished', 'genre': 'scifi', **uploaded})
+        # Assert
+        self.assertFalse(Book.objects.get(title='Dune').image)
+    
+    def test_profile_picture_upload_can_not_be_used_as_cover(self):
+        # Arrange
+        uploaded = self.upload('profile')
+        # Act
+        self.client.post(reverse('add-book'), {'title': 'Dune', 'author': 'Frank Herbert', 'status': 'finished', 'genre': 'scifi', **uploaded})
+        # Assert
+        self.assertTrue(uploaded['uploaded_image'].startswith('profile_pics/'))
+        self.assertFalse(Book.objects.get(title='Dune').image)
+    
+    def test_direct_upload_rejects_invalid_token_and_files_that_are_not_images(self):
+        # Arrange
+        signature = self.client.get(reverse('upload-signature'), {'kind': 'cover'}).json()
+        # Act
+        forged = self.client.post(reverse('direct-upload'), {'token': 'forged', 'file': SimpleUploadedFile('photo.png', self.image)})
+        not_image = self.client.post(reverse('direct-upload'), {**signature['fields'], 'file': SimpleUploadedFile('photo.png', b'not an image')})
+        # Assert
+        self.assertEqual(forged.status_code, 403)
+        self.assertEqual(not_image.status_code, 400)
+    
+    def test_direct_upload_rejects_expired_token(self):
+        # Arrange
+        signature = self.client.get(reverse('upload-signature'), {'kind': 'cover'}).json()
+        # Act - Send the upload eleven minutes after the signature was made
+        with patch('django.core.signing.time.time', return_value=time.time() + 60 * 11):
+            response = self.client.post(reverse('direct-upload'), {**signature['fields'], 'file': SimpleUploadedFile('photo.png', self.image)})
+        # Assert
+        self.assertEqual(response.status_code, 403)
+
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+class UploadProcessingTests(TestCase):
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+    
+    # Make a phone photo, 4000x3000 pixels with the camera turned sideways and a GPS location in its EXIF
+    def make_photo(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x8825] = {2: (51.0, 30.0, 0.0)}
+        buffer = BytesIO()
+        Image.new('RGB', (4000, 3000), 'navy').save(buffer, 'JPEG', exif=exif)
+        return SimpleUploadedFile('IMG_0001.jpeg', buffer.getvalue(), content_type='image/jpeg')
+    
+    def test_photo_is_turned_shrunk_and_metadata_removed(self):
+        # Act
+        processed = process_upload(self.make_photo(), 'cover')
+        image = Image.open(processed)
+        # Assert - The sideways photo is stored upright, no bigger than a cover needs and without EXIF
+        self.assertEqual(image.format, 'JPEG')
+        self.assertEqual(image.size, (800, 1067))
+        self.assertEqual(len(image.getexif()), 0)
+        self.assertEqual(processed.name, 'IMG_0001.jpg')
+    
+    def test_transparent_image_is_kept_transparent(self):
+        # Arrange
+        buffer = BytesIO()
+        Image.new('RGBA', (1000, 1500), (0, 0, 0, 0)).save(buffer, 'PNG')
+        # Act
+        image = Image.open(process_upload(SimpleUploadedFile('cover.png', buffer.getvalue()), 'cover'))
+        # Assert
+        self.assertEqual(image.format, 'WEBP')
+        self.assertEqual(image.mode, 'RGBA')
+    
+    def test_add_book_stores_shrunk_cover(self):
+        # Act
+        self.client.post(reverse('add-book'), {'title': 'Dune', 'author': 'Frank Herbert', 'status': 'finished', 'genre': 'scifi', 'image': self.make_photo()})
+        # Assert
+        with default_storage.open(Book.objects.get(title='Dune').image.name) as file:
+            self.assertEqual(Image.open(file).size, (800, 1067))
+    
+    def test_edit_book_stores_shrunk_cover(self):
+        # Arrange
+        book = Book.objects.create(user=self.user, title='Dune', author='Frank Herbert', genre='scifi', status='finished')
+        # Act
+        self.client.post(reverse('edit-book', args=[book.uuid]), {'title': 'Dune', 'author': 'Frank Herbert', 'status': 'finished', 'genre': 'scifi', 'image': self.make_photo()})
+        # Assert
+        book.refresh_from_db()
+        with default_storage.open(book.image.name) as file:
+            self.assertEqual(Image.open(file).size, (800, 1067))
+    
+    def test_add_book_rejects_file_that_is_not_an_image(self):
+        # Act
+        response = self.client.post(reverse('add-book'), {
+            'title': 'Dune', 'author': 'Frank Herbert', 'status': 'finished', 'genre': 'scifi',
+            'image': SimpleUploadedFile('cover.png', b'not an image'),
+        })
+        # Assert - The form is shown again with the error and no book is made
+        self.assertContains(response, 'Upload a valid image')
+        self.assertFalse(Book.objects.exists())
+    
+    @patch('books.images.MAX_UPLOAD_PIXELS', 1000)
+    def test_image_with_too_many_pixels_is_refused(self):
+        # Act + Assert
+        with self.assertRaises(ValidationError):
+            process_upload(self.make_photo(), 'cover')
+
+
+class LocalMediaStorageTests(TestCase):
+    
+    def setUp(self):
+        # Use the local stand in for Cloudinary in a folder that is removed after the test
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        settings = override_settings(STORAGES={
+            'default': {'BACKEND': 'books.storage.LocalMediaStorage', 'OPTIONS': {'location': location}},
+            'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+        })
+        settings.enable()
+        self.addCleanup(settings.disable)
+        buffer = BytesIO()
+        Image.new('RGB', (600, 900), 'navy').save(buffer, 'PNG')
+        self.image = buffer.getvalue()
+    
+    def test_same_image_is_stored_once_under_its_content_hash(self):
+        # Act
+        first = default_storage.save('images/dune.png', ContentFile(self.image))
+        second = default_storage.save('images/other-name.png', ContentFile(self.image))
+        # Assert - Both saves give the same public id in the images folder
+        self.assertEqual(first, second)
+        self.assertRegex(first, r'^images/[0-9a-f]{32}\.png$')
+        self.assertEqual(len(default_storage.listdir('images')[1]), 1)
+    
+    def test_transformation_url_serves_resized_image(self):
+        # Arrange
+        name = default_storage.save('images/dune.png', ContentFile(self.image))
+        # Act - The cover_img tag uses transformation urls like it does for Cloudinary
+        url = get_variant_url(name, 240)
+        response = self.client.get(url)
+        # Assert
+        self.assertIn('/upload/c_scale,w_240,f_auto,q_auto/', url)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(Image.open(BytesIO(response.content)).size, (240, 360))
+        self.assertEqual(self.client.get(default_storage.url(name)).content, self.image)
+    
+    def test_unknown_transformation_and_missing_image_are_not_found(self):
+        # Arrange
+        name = default_storage.save('images/dune.png', ContentFile(self.image))
+        # Act + Assert
+        self.assertEqual(self.client.get(default_storage.url(name).replace('/upload/', '/upload/e_blur/')).status_code, 404)
+        self.assertEqual(self.client.get(default_storage.url('images/missing.png')).status_code, 404)
+    
+    def test_oversized_or_invalid_transformations_are_not_found(self):
+        # Arrange
+        name = default_storage.save('images/dune.png', ContentFile(self.image))
+        url = default_storage.url(name)
+        # Act + Assert - Sizes past the largest cover variant would make the server build a huge image
+        for transformation in ['c_scale,w_60000', 'c_scale,h_60000', 'c_scale,w_0', 'c_scale,w_-5', 'f_gif', 'q_500']:
+            self.assertEqual(self.client.get(url.replace('/upload/', f'/upload/{transformation}/')).status_code, 404)
+        self.assertEqual(self.client.get(url.replace('/upload/', f'/upload/c_scale,w_{get_all_variant_widths()[-1]}/')).status_code, 200)
+    
+    @patch('books.storage.requests.get')
+    def test_search_cover_is_fetched_and_stored_without_cloudinary(self, mock_get):
+        # Arrange
+        mock_get.return_value.content = self.image
+        # Act
+        name = upload_image_to_cloudinary('https://books.google.com/books/content?id=abc&img=1')
+        # Assert
+        self.assertTrue(name.startswith('images/'))
+        with default_storage.open(name) as file:
+            self.assertEqual(file.read(), self.image)
+    
+    @patch('books.storage.requests.get')
+    def test_only_https_urls_are_uploaded(self, mock_get):
+        # Act + Assert - Server files and plain http urls are never read or fetched
+        for source in ['/etc/passwd', '.env', 'file:///etc/passwd', 'http://169.254.169.254/latest/meta-data']:
+            with self.assertRaises(ValueError):
+                default_storage.upload_from_url(source, 'images')
+            self.assertIsNone(upload_image_to_cloudinary(source))
+        mock_get.assert_not_called()
+    
+    @patch('books.storage.time.sleep')
+    def test_latency_is_added_to_every_storage_call(self, mock_sleep):
+        # Arrange
+        storage = LocalMediaStorage(location=default_storage.location, latency=0.2)
+        # Act
+        name = storage.save('images/dune.png', ContentFile(self.image))
+        storage.open(name).close()
+        # Assert
+        self.assertEqual(mock_sleep.call_args_list, [call(0.2), call(0.2)])
+
+
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+class OrphanedMediaTests(TestCase):
+    
+    def setUp(self):
+        # The in memory storage is shared by the tests in this class so start from an empty one
+        for folder in ['images', 'profile_pics']:
+            if default_storage.exists(folder):
+                for filename in default_storage.listdir(folder)[1]:
+                    default_storage.delete(f'{folder}/{filename}')
+        # A cover in use with its resized copy, a profile picture in use, and a replaced cover with its resized copy
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        self.kept = default_storage.save('images/kept.png', ContentFile(b'kept'))
+        self.kept_variant = default_storage.save(get_variant_name(self.kept, 240), ContentFile(b'kept'))
+        self.picture = default_storage.save('profile_pics/me.png', ContentFile(b'me'))
+        self.orphan = default_storage.save('images/replaced.png', ContentFile(b'replaced'))
+        self.orphan_variant = default_storage.save(get_variant_name(self.orphan, 240), ContentFile(b'replaced'))
+        Book.objects.create(user=user, title='Dune', author='Frank Herbert', genre='scifi', image=self.kept)
+        Profile.objects.create(user=user, image=self.picture)
+        CoverAsset.objects.create(public_id=self.orphan, content_hash='abc')
+    
+    def test_dry_run_lists_orphans_without_deleting(self):
+        # Act
+        output = StringIO()
+        call_command('collect_orphaned_media', dry_run=True, min_age_hours=0, stdout=output)
+        # Assert
+        self.assertIn('3 stored images, 2 in use, 0 too new to delete, 1 orphaned (2 files', output.getvalue())
+        self.assertIn(f'would delete {self.orphan_variant}', output.getvalue())
+        self.assertTrue(default_storage.exists(self.orphan))
+    
+    @patch('books.management.commands.collect_orphaned_media.time.sleep')
+    def test_orphans_deleted_in_batches_and_used_images_kept(self, mock_sleep):
+        # Act
+        call_command('collect_orphaned_media', min_age_hours=0, batch_size=1, pause=2, page_size=2, stdout=StringIO())
+        # Assert - The replaced cover and its resized copy are gone with a pause between the two deletes
+        self.assertFalse(default_storage.exists(self.orphan))
+        self.assertFalse(default_storage.exists(self.orphan_variant))
+        self.assertFalse(CoverAsset.objects.exists())
+        for name in [self.kept, self.kept_variant, self.picture]:
+            self.assertTrue(default_storage.exists(name))
+        mock_sleep.assert_called_once_with(2)
+    
+    def test_recent_uploads_are_kept(self):
+        # Act - Every image was just stored so they may belong to uploads that are still being saved
+        call_command('collect_orphaned_media', stdout=StringIO())
+        # Assert
+        self.assertTrue(default_storage.exists(self.orphan))
+
+
+class MediaProxyTests(TestCase):
+    
+    def setUp(self):
+        # Keep the disk cache in a folder that is removed after the test
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        settings = override_settings(MEDIA_PROXY_CACHE_DIR=self.cache_dir, MEDIA_PROXY_CACHE_BYTES=10 * 1024 * 1024)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        buffer = BytesIO()
+        Image.new('RGB', (1000, 1500), 'navy').save(buffer, 'JPEG')
+        self.cover = buffer.getvalue()
+        self.url = get_proxy_url('http://books.google.com/books/content?id=abc&zoom=0')
+    
+    def mock_response(self, mock_get, content):
+        mock_get.return_value.__enter__.return_value.raw.read.return_value = content
+    
+    @patch('books.media_proxy.requests.get')
+    def test_cover_fetched_once_shrunk_and_cached(self, mock_get):
+        # Arrange
+        self.mock_response(mock_get, self.cover)
+        # Act
+        first = self.client.get(self.url)
+        second = self.client.get(self.url)
+        # Assert - Google was called once over https and both responses are the shrunk cover
+        mock_get.assert_called_once()
+        self.assertEqual(mock_get.call_args.args[0], 'https://books.google.com/books/content?id=abc&zoom=0')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(Image.open(BytesIO(second.content)).size, (500, 750))
+        self.assertEqual(second['Cache-Control'], 'public, max-age=31536000, immutable')
+    
+    @patch('books.media_proxy.requests.get')
+    def test_conditional_request_returns_304(self, mock_get):
+        # Arrange
+        self.mock_response(mock_get, self.cover)
+        etag = self.client.get(self.url)['ETag']
+        # Act
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        # Assert
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+    
+    def test_changed_token_is_not_found(self):
+        # Act
+        response = self.client.get(self.url.replace('/media-proxy/', '/media-proxy/x'))
+        # Assert
+        self.assertEqual(response.status_code, 404)
+    
+    @patch('books.media_proxy.requests.get')
+    def test_broken_cover_redirects_to_placeholder_briefly(self, mock_get):
+        # Arrange
+        self.mock_response(mock_get, b'not an image')
+        # Act
+        response = self.client.get(self.url)
+        # Assert - The placeholder is only cached for a few minutes so the cover is tried again
+        self.assertRedirects(response, '/static/images/placeholder.png', fetch_redirect_response=False)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=300')
+        self.assertEqual(os.listdir(self.cache_dir), [])
+    
+    def test_least_recently_used_covers_evicted_over_size_limit(self):
+        # Arrange - Three 1000 byte covers with room for two, the first is read again so the second is the least recently used
+        with override_settings(MEDIA_PROXY_CACHE_BYTES=2500):
+            cache_cover('first', b'1' * 1000)
+            os.utime(os.path.join(self.cache_dir, 'first.jpg'), (1, 1))
+            cache_cover('second', b'2' * 1000)
+            os.utime(os.path.join(self.cache_dir, 'second.jpg'), (2, 2))
+            read_cached_cover('first')
+            # Act
+            cache_cover('third', b'3' * 1000)
+        # Assert
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ['first.jpg', 'third.jpg'])
+
+
 class DeleteBookTests(TestCase):
     
     def setUp(self):
@@ -262,6 +816,44 @@ class SearchTests(TestCase):
         # Assert
         self.assertNotContains(response, 'The Hobbit')
         self.assertNotContains(response, 'Atomic Habits')
+    
+    def test_search_matches_review(self):
+        # Arrange
+        self.book2.review = 'Small changes add up over time'
+        self.book2.save()
+        self.client.login(username='testuser', password='testpass123')
+        # Act
+        response = self.client.get(reverse('home'), {'search': 'changes'})
+        # Assert
+        self.assertContains(response, 'Atomic Habits')
+        self.assertNotContains(response, 'The Hobbit')
+    
+    def test_search_matches_start_of_word(self):
+        # Arrange
+        self.client.login(username='testuser', password='testpass123')
+        # Act
+        response = self.client.get(reverse('home'), {'search': 'hob'})
+        # Assert
+        self.assertContains(response, 'The Hobbit')
+    
+    def test_search_orders_title_matches_before_review_matches(self):
+        # Arrange - The word habits is only in the review of the hobbit
+        self.book1.review = 'Tolkien had great writing habits'
+        self.book1.save()
+        self.client.login(username='testuser', password='testpass123')
+        # Act
+        response = self.client.get(reverse('book-feed'), {'search': 'habits'})
+        # Assert
+        titles = [book.title for book in response.context['books']]
+        self.assertEqual(titles, ['Atomic Habits', 'The Hobbit'])
+    
+    def test_search_with_only_punctuation_does_not_error(self):
+        # Arrange
+        self.client.login(username='testuser', password='testpass123')
+        # Act
+        response = self.client.get(reverse('home'), {'search': '"*!'})
+        # Assert
+        self.assertEqual(response.status_code, 200)
         
 
 class FilterTests(TestCase):
@@ -332,8 +924,163 @@ class FilterTests(TestCase):
         # Assert
         self.assertContains(response, 'The Hobbit')
         self.assertNotContains(response, 'Atomic Habits')
+
+    def test_filter_by_year_ignores_invalid_year(self):
+        # Arrange
+        self.client.login(username='testuser', password='testpass123')
+        # Act
+        response = self.client.get(reverse('home'), {'year': 'abc'})
+        # Assert - The filter is skipped and every book is shown
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'The Hobbit')
+        self.assertContains(response, 'Atomic Habits')
         
         
+class FacetTests(TestCase):
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        Book.objects.create(user=self.user, title='The Hobbit', author='J.R.R. Tolkien', status='finished', genre='fantasy', rating=5, date_finished='2024-01-01')
+        Book.objects.create(user=self.user, title='The Silmarillion', author='J.R.R. Tolkien', status='finished', genre='fantasy', rating=3, date_finished='2023-01-01')
+        Book.objects.create(user=self.user, title='Atomic Habits', author='James Clear', status='finished', genre='selfhelp', rating=5, date_finished='2024-05-01')
+        Book.objects.create(user=self.user, title='Dune', author='Frank Herbert', status='want_to_read', genre='scifi')
+    
+    # Get the count for one option of a facet from the home page context
+    def get_count(self, response, facet, value):
+        return next(option['count'] for option in response.context['facets'][facet] if option['value'] == value)
+    
+    def test_facets_count_every_option(self):
+        # Arrange
+        self.client.login(username='testuser', password='testpass123')
+        # Act
+        response = self.client.get(reverse('home'))
+        # Assert
+        self.assertEqual(response.context['total_books'], 4)
+        self.assertEqual(self.get_count(response, 'genre', 'fantasy'), 2)
+        self.assertEqual(self.get_count(response, 'status', 'want_to_read'), 1)
+        self.assertEqual(self.get_count(response, 'rating', '5'), 2)
+        self.assertEqual([option['value'] for option in response.context['facets']['year']], ['2024', '2023'])
+    
+    def test_facets_respect_other_active_filters(self):
+        # Arrange
+        self.client.login(username='testuser', password='testpass123')
+        # Act
+        response = self.client.get(reverse('home'), {'genre': 'fantasy'})
+        # Assert - Other facets only count fantasy books but the genre facet still counts every genre
+        self.assertEqual(self.get_count(response, 'rating', '5'), 1)
+        self.assertEqual(self.get_count(response, 'year', '2023'), 1)
+        self.assertEqual(self.get_count(response, 'genre', 'selfhelp'), 1)
+    
+    def test_facets_are_cached_until_a_book_changes(self):
+        # Arrange - Load the page once so the facets are cached
+        self.client.login(username='testuser', password='testpass123')
+        self.client.get(reverse('home'))
+        # Act
+        Book.objects.create(user=self.user, title='Emma', author='Jane Austen', status='finished', genre='romance', rating=4)
+        response = self.client.get(reverse('home'))
+        # Assert
+        self.assertEqual(response.context['total_books'], 5)
+        self.assertEqual(self.get_count(response, 'genre', 'romance'), 1)
+
+
+class GridCacheTests(TestCase):
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.book = Book.objects.create(user=self.user, title='The Hobbit', author='J.R.R. Tolkien', status='finished', genre='fantasy')
+        reset_grid_cache_stats()
+    
+    def test_repeat_view_skips_books_query(self):
+        # Arrange - First visit renders and caches the grid
+        self.client.login(username='testuser', password='testpass123')
+        self.client.get(reverse('home'))
+        # Act
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('home'))
+        # Assert - The grid still shows but no query touched the books table
+        self.assertContains(response, 'The Hobbit')
+        self.assertFalse(any('books_book' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(get_grid_cache_stats(), {'hits': 1, 'misses': 1})
+    
+    def test_stats_command_needs_shared_cache(self):
+        # Act + Assert - The memory cache of the command's own process would always show 0 hits and 0 misses
+        with self.assertRaisesMessage(CommandError, 'REDIS_URL'):
+            call_command('grid_cache_stats', stdout=StringIO())
+    
+    def test_editing_a_book_refreshes_grid(self):
+        # Arrange
+        self.client.login(username='testuser', password='testpass123')
+        self.client.get(reverse('home'))
+        # Act
+        self.book.title = 'The Silmarillion'
+        self.book.save()
+        response = self.client.get(reverse('home'))
+        # Assert
+        self.assertContains(response, 'The Silmarillion')
+        self.assertNotContains(response, 'The Hobbit')
+    
+    def test_different_filters_are_cached_separately(self):
+        # Arrange
+        self.client.login(username='testuser', password='testpass123')
+        self.client.get(reverse('home'))
+        # Act
+        response = self.client.get(reverse('home'), {'genre': 'fiction'})
+        # Assert
+        self.assertNotContains(response, 'The Hobbit')
+
+
+class ConditionalGetTests(TestCase):
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.book = Book.objects.create(user=self.user, title='The Hobbit', author='J.R.R. Tolkien', status='finished', genre='fantasy')
+        self.client.login(username='testuser', password='testpass123')
+        # The first page sets the csrf cookie which is part of the ETag
+        self.client.get(reverse('home'))
+    
+    def test_unchanged_page_returns_304_without_queries(self):
+        # Arrange
+        etag = self.client.get(reverse('home'))['ETag']
+        # Act
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag)
+        # Assert - Only the session and user lookups for login ran
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(any('books_book' in query['sql'] for query in queries.captured_queries))
+        self.assertIn('private', response['Cache-Control'])
+    
+    def test_editing_a_book_changes_etag(self):
+        # Arrange
+        etag = self.client.get(reverse('home'))['ETag']
+        # Act
+        self.book.title = 'The Silmarillion'
+        self.book.save()
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag)
+        # Assert
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'The Silmarillion')
+    
+    def test_library_version_is_shared_by_every_worker(self):
+        # Arrange
+        etag = self.client.get(reverse('home'))['ETag']
+        # Act - Another worker with its own memory cache changes a book
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'other-worker'}}):
+            self.book.title = 'The Silmarillion'
+            self.book.save()
+        response = self.client.get(reverse('home'), HTTP_IF_NONE_MATCH=etag)
+        # Assert - The version comes from the database so this worker sees the change
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'The Silmarillion')
+        self.assertEqual(LibraryVersion.objects.get(user=self.user).version, get_library_version(self.user.id))
+    
+    def test_page_is_gzipped_when_accepted(self):
+        # Act
+        response = self.client.get(reverse('home'), HTTP_ACCEPT_ENCODING='gzip')
+        # Assert
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn('Cookie', response['Vary'])
+
 class StatisticsTests(TestCase):
     
     def setUp(self):
@@ -481,10 +1228,99 @@ class StatisticsTests(TestCase):
         self.assertNotIn(fave_book_without_date, top3)
         self.assertNotIn(book_with_4stars, top3)
         
+    def test_statistics_update_when_book_is_edited(self):
+        # Arrange - Move a fiction book to history with a lower rating
+        self.client.login(username='testuser', password='testpass123')
+        self.book1.genre = 'history'
+        self.book1.rating = 1
+        self.book1.save()
+        # Act
+        response = self.client.get(reverse('statistics'))
+        genres = {row['genre']: row for row in response.context['genre_stats']}
+        # Assert
+        self.assertEqual(genres['fiction']['count'], 2)
+        self.assertEqual(genres['history']['count'], 1)
+        self.assertEqual(genres['history']['avg_rating'], 1)
+        self.assertEqual(response.context['avg_rating'], 3.8)
+        
+    def test_statistics_update_when_book_is_deleted_or_unfinished(self):
+        # Arrange - Delete a 2024 book and move the 2023 book back to want to read
+        self.client.login(username='testuser', password='testpass123')
+        self.book1.delete()
+        self.book5.status = 'want_to_read'
+        self.book5.save()
+        # Act
+        response = self.client.get(reverse('statistics'))
+        # Assert - 2023 has no books left so it is not shown
+        self.assertEqual(response.context['total_books'], 3)
+        self.assertEqual(response.context['year_stats'], [{'year': 2024, 'count': 3}])
+        self.assertNotIn('Cal Newport', [row['author'] for row in response.context['author_stats']])
+        
+    def test_statistics_page_does_not_count_books(self):
+        # Arrange
+        self.client.login(username='testuser', password='testpass123')
+        # Act
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('statistics'))
+        # Assert - Only the top 3 query reads from the books table
+        book_queries = [query['sql'] for query in queries if 'FROM "books_book"' in query['sql']]
+        self.assertEqual(len(book_queries), 1)
+        self.assertNotIn('COUNT', book_queries[0])
+        
+    def test_rebuild_reading_stats_matches_incremental_stats(self):
+        # Arrange - Change the stats behind the signals back with a queryset update
+        Book.objects.filter(pk=self.book1.pk).update(genre='romance')
+        self.client.login(username='testuser', password='testpass123')
+        # Act
+        call_command('rebuild_reading_stats', stdout=StringIO())
+        response = self.client.get(reverse('statistics'))
+        genres = {row['genre']: row['count'] for row in response.context['genre_stats']}
+        # Assert
+        self.assertEqual(genres, {'fiction': 2, 'nonfiction': 1, 'romance': 1, 'selfhelp': 1})
+        self.assertEqual(response.context['total_books'], 5)
+        
+    def test_failed_rebuild_keeps_old_stats(self):
+        # Arrange - Counting the totals fails after the old rows were deleted
+        self.client.login(username='testuser', password='testpass123')
+        # Act
+        with patch('books.stats.ReadingStats.objects.bulk_create', side_effect=RuntimeError('Database went away')):
+            with self.assertRaises(RuntimeError):
+                rebuild_reading_stats()
+        response = self.client.get(reverse('statistics'))
+        # Assert - The delete was rolled back so the stats are still there
+        self.assertEqual(response.context['total_books'], 5)
+        self.assertEqual(len(response.context['genre_stats']), 3)
+        
+    def test_book_added_while_another_save_creates_stats_row(self):
+        # Arrange - Another save creates the history row between this save's update and create
+        GenreStats.objects.filter(user=self.user, genre='history').delete()
+        update = type(GenreStats.objects.all()).update
+        calls = []
+        
+        def racing_update(queryset, **changes):
+            if queryset.model is GenreStats and not calls:
+                calls.append(changes)
+                GenreStats.objects.create(user=self.user, genre='history', total_books=1, rating_total=4, rated_books=1)
+                return 0
+            return update(queryset, **changes)
+        
+        # Act
+        with patch('django.db.models.query.QuerySet.update', racing_update):
+            Book.objects.create(user=self.user, title='SPQR', author='Mary Beard', genre='history', status='finished', rating=5)
+        # Assert - Both books are counted instead of the second save failing on the unique row
+        history = GenreStats.objects.get(user=self.user, genre='history')
+        self.assertEqual((history.total_books, history.rating_total, history.rated_books), (2, 9, 2))
+        
 
 class SearchGoogleBooksTests(TestCase):
     
-    @patch('books.services.requests.get')
+    def setUp(self):
+        # The circuit breaker is shared by the whole worker so start and end every test with it closed
+        reset_google_books_breaker()
+        self.addCleanup(reset_google_books_breaker)
+        clear_google_books_cache()
+    
+    @patch('books.services.google_books_session.get')
     def test_search_google_books_returns_results(self, mock_get):
         # Arrange - Set up the mock response data
         mock_response_data = {
@@ -505,8 +1341,9 @@ class SearchGoogleBooksTests(TestCase):
                 }
             ]
         }
-        # @patch replaces requests.get with mock_get for this test, and configures .json() to return our fake data
-        mock_get.return_value.json.return_value = mock_response_data
+        # @patch replaces the session get with mock_get for this test, and sets the response body to our fake data as json
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.content = json.dumps(mock_response_data).encode()
         
         # Act 
         results = search_google_books('test')
@@ -520,7 +1357,7 @@ class SearchGoogleBooksTests(TestCase):
         self.assertEqual(results[0]['small_image'], 'http://example.com/small_thumbnail.jpg')
         self.assertEqual(results[0]['purchase_link'], 'http://example.com/buy')
     
-    @patch('books.services.requests.get')
+    @patch('books.services.google_books_session.get')
     def test_search_google_books_handles_no_title(self, mock_get):
         # Arrange - Set up the mock response data with no title
         mock_response_data = {
@@ -555,7 +1392,8 @@ class SearchGoogleBooksTests(TestCase):
             ]      
         }
         
-        mock_get.return_value.json.return_value = mock_response_data
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.content = json.dumps(mock_response_data).encode()
             
         # Act 
         results = search_google_books('test')
@@ -564,7 +1402,7 @@ class SearchGoogleBooksTests(TestCase):
         self.assertEqual(len(results), 1)
         self.assertEqual(results[0]['title'], 'Test Book')
            
-    @patch('books.services.requests.get')
+    @patch('books.services.google_books_session.get')
     def test_search_google_books_handles_api_error(self, mock_get):
         # Arrange - Configure the mock to raise an exception when called
         mock_get.side_effect = Exception('API error')
@@ -575,20 +1413,20 @@ class SearchGoogleBooksTests(TestCase):
         # Assert - The function should return None if there was an error with the API request
         self.assertIsNone(results)
         
-    @patch('books.services.requests.get')
+    @patch('books.services.google_books_session.get')
     def test_search_google_books_handles_rate_limit(self, mock_get):
         
         # Arrange - set up mock data that simulates hitting the google books api rate limit
         mock_get.return_value.status_code = 429
-        mock_get.return_value.json.return_value = {'error': {'code': 429, 'message': 'Rate limit exceeded'}}
+        mock_get.return_value.content = json.dumps({'error': {'code': 429, 'message': 'Rate limit exceeded'}}).encode()
     
         # Act
         results = search_google_books('test')
         
-        # Assert - verify that the search google books function returns empty list when rate limit reached
-        self.assertEqual(results, [])
+        # Assert - verify that the search google books function returns None when rate limit reached so the unavailable message shows
+        self.assertIsNone(results)
         
-    @patch('books.services.requests.get')
+    @patch('books.services.google_books_session.get')
     def test_search_google_books_handles_no_thumbnail(self, mock_get):
         
         # Arrange - set up mock data with no image value
@@ -604,7 +1442,8 @@ class SearchGoogleBooksTests(TestCase):
             ]
         }
         
-        mock_get.return_value.json.return_value = mock_response_data
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.content = json.dumps(mock_response_data).encode()
         
         # Act
         results = search_google_books('test')
@@ -612,4 +1451,208 @@ class SearchGoogleBooksTests(TestCase):
         # Assert - that the image is assigned None if no image
         self.assertEqual(results[0]['image'], None)
         
-        
\ No newline at end of file
+    @patch('books.services.google_books_session.get')
+    def test_search_google_books_encodes_query_and_sets_timeout(self, mock_get):
+        # Arrange
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.content = json.dumps({}).encode()
+        # Act
+        search_google_books('Pride & Prejudice #1')
+        # Assert - The search is passed as a param so requests url encodes it
+        args, kwargs = mock_get.call_args
+        self.assertEqual(kwargs['params']['q'], 'Pride & Prejudice #1')
+        self.assertEqual(kwargs['timeout'], GOOGLE_BOOKS_TIMEOUT)
+        
+    @patch('books.services.google_books_session.get')
+    def test_search_google_books_requests_only_needed_fields(self, mock_get):
+        # Arrange
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.content = b'{}'
+        # Act
+        search_google_books('test', max_results=2)
+        # Assert - Google is asked for a partial response with only 2 volumes
+        args, kwargs = mock_get.call_args
+        self.assertEqual(kwargs['params']['maxResults'], 2)
+        self.assertEqual(kwargs['params']['fields'], GOOGLE_BOOKS_FIELDS)
+        
+    @patch('books.services.google_books_session.get')
+    def test_circuit_breaker_fails_fast_after_repeated_errors(self, mock_get):
+        # Arrange - Google fails enough times in a row to open the breaker
+        User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+        mock_get.side_effect = Exception('API error')
+        for _ in range(BREAKER_FAILURE_THRESHOLD):
+            search_google_books('test')
+        mock_get.reset_mock()
+        # Act
+        response = self.client.get(reverse('search-google-books'), {'search': 'test'})
+        # Assert - The view shows the unavailable message without calling Google
+        self.assertEqual(response.status_code, 503)
+        mock_get.assert_not_called()
+        
+    @patch('books.services.google_books_session.get')
+    def test_search_google_books_caches_normalized_query(self, mock_get):
+        # Arrange
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.content = json.dumps({'items': [{'volumeInfo': {'title': 'Mistborn'}}]}).encode()
+        search_google_books('Brandon Sanderson')
+        # Act
+        results = search_google_books('  brandon   SANDERSON! ')
+        # Assert - Case, spaces and punctuation do not change the cache key so Google is only called once
+        self.assertEqual(results[0]['title'], 'Mistborn')
+        self.assertEqual(mock_get.call_count, 1)
+        
+    def test_stats_command_needs_shared_cache(self):
+        # Act + Assert - The memory cache of the command's own process would always show no calls
+        with self.assertRaisesMessage(CommandError, 'REDIS_URL'):
+            call_command('google_books_stats', stdout=StringIO())
+        
+    @patch('books.services.google_books_session.get')
+    def test_rate_limited_search_is_not_cached(self, mock_get):
+        # Arrange - Google turns the first search away
+        mock_get.return_value.status_code = 429
+        mock_get.return_value.content = json.dumps({'error': {'code': 429}}).encode()
+        first = search_google_books('Dune')
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.content = json.dumps({'items': [{'volumeInfo': {'title': 'Dune'}}]}).encode()
+        # Act
+        results = search_google_books('Dune')
+        # Assert - The failed search was not cached so the next one calls Google again
+        self.assertIsNone(first)
+        self.assertEqual(results[0]['title'], 'Dune')
+        self.assertEqual(mock_get.call_count, 2)
+        
+    @patch('books.services.google_books_session.get')
+    def test_concurrent_searches_share_one_request(self, mock_get):
+        # Arrange - Google takes a moment to answer so every thread asks while the first request is in flight
+        def slow_get(*args, **kwargs):
+            time.sleep(0.2)
+            return MagicMock(status_code=200, content=json.dumps({'items': [{'volumeInfo': {'title': 'Dune'}}]}).encode())
+        
+        mock_get.side_effect = slow_get
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(search_google_books('frank herbert'))) for _ in range(5)]
+        # Act
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Assert
+        self.assertEqual(mock_get.call_count, 1)
+        self.assertEqual([result[0]['title'] for result in results], ['Dune'] * 5)
+        
+    @patch('books.google_books_cache.GOOGLE_BOOKS_CACHE_TTL', 0)
+    @patch('books.services.google_books_session.get')
+    def test_stale_results_are_returned_while_refreshing(self, mock_get):
+        # Arrange - With no ttl the first results are stale straight away
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.content = json.dumps({'items': [{'volumeInfo': {'title': 'Old Title'}}]}).encode()
+        search_google_books('test')
+        mock_get.return_value.content = json.dumps({'items': [{'volumeInfo': {'title': 'New Title'}}]}).encode()
+        # Act
+        results = search_google_books('test')
+        # Assert - The stale results come back straight away and the refresh runs in the background
+        self.assertEqual(results[0]['title'], 'Old Title')
+        for _ in range(50):
+            if mock_get.call_count == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(mock_get.call_count, 2)
+        
+        
+
+class PaginationTests(TestCase):
+    
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        
+        # Create more books than fit on one page, some with matching ratings and some with no rating
+        for i in range(30):
+            Book.objects.create(
+                user=self.user,
+                title=f'Book {i:02d}',
+                author='Test Author',
+                status='finished',
+                genre='fiction',
+                rating=(i % 3) + 1 if i % 4 else None
+            )
+    
+    # Follow the feed cursors until the last page and return every title seen
+    def get_all_titles(self, params):
+        response = self.client.get(reverse('book-feed'), params)
+        titles = [book.title for book in response.context['books']]
+        cursor = response.json()['next_cursor']
+        
+        while cursor:
+            response = self.client.get(reverse('book-feed'), {**params, 'cursor': cursor})
+            titles += [book.title for book in response.context['books']]
+            cursor = response.json()['next_cursor']
+        
+        return titles
+    
+    def test_home_only_loads_first_page(self):
+        # Arrange
+        self.client.login(username='testuser', password='testpass123')
+        # Act
+        response = self.client.get(reverse('home'))
+        # Assert
+        self.assertEqual(response.content.decode().count('class="col-md-3"'), 24)
+        self.assertIsNotNone(response.context['next_cursor'])
+    
+    def test_feed_returns_every_book_once_for_each_sort(self):
+        # Arrange
+        self.client.login(username='testuser', password='testpass123')
+        
+        for sort in ['title_asc', 'author_asc', 'rating_desc', 'rating_asc', 'date_desc', 'date_asc']:
+            # Act
+            titles = self.get_all_titles({'sort': sort})
+            # Assert - No book is skipped or repeated across the page boundary
+            self.assertEqual(len(titles), 30)
+            self.assertEqual(len(set(titles)), 30)
+    
+    def test_feed_matches_sort_order(self):
+        # Arrange
+        self.client.login(username='testuser', password='testpass123')
+        # Act
+        titles = self.get_all_titles({'sort': 'rating_desc'})
+        # Assert - Pages join up in the same order as one unpaginated query
+        expected = list(Book.objects.filter(user=self.user).order_by(F('rating').desc(nulls_last=True), 'id').values_list('title', flat=True))
+        self.assertEqual(titles, expected)
+    
+    @override_settings(STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    })
+    def test_feed_cards_match_first_page_cards(self):
+        # Arrange - The last books in title order have a cover and a cover still uploading
+        Book.objects.create(user=self.user, title='Book 98', author='Test Author', genre='fiction', cover_status='pending')
+        Book.objects.create(user=self.user, title='Book 99', author='Test Author', genre='fiction', image='images/cover.jpg', cover_color='#336699')
+        self.client.login(username='testuser', password='testpass123')
+        cursor = self.client.get(reverse('book-feed'), {'sort': 'title_asc'}).json()['next_cursor']
+        # Act
+        html = self.client.get(reverse('book-feed'), {'sort': 'title_asc', 'cursor': cursor}).json()['html']
+        # Assert - Later pages use the card template so covers load lazily on their color and pending covers show the badge
+        self.assertEqual(html.count('class="col-md-3"'), 8)
+        self.assertIn('loading="lazy"', html)
+        self.assertIn('background-color: #336699;', html)
+        self.assertIn('Cover uploading', html)
+    
+    def test_cursor_value_of_wrong_type_rejected(self):
+        # Arrange - A cursor that decodes but holds text where the sort needs a date
+        self.client.login(username='testuser', password='testpass123')
+        cursor = base64.urlsafe_b64encode(json.dumps(['garbage', 1]).encode()).decode()
+        # Act
+        feed = self.client.get(reverse('book-feed'), {'sort': 'date_desc', 'cursor': cursor})
+        home = self.client.get(reverse('home'), {'sort': 'date_desc', 'cursor': cursor})
+        # Assert - The feed rejects the cursor and home falls back to the first page
+        self.assertEqual(feed.status_code, 400)
+        self.assertEqual(home.status_code, 200)
+        self.assertEqual(home.content.decode().count('class="col-md-3"'), 24)
+    
+    def test_feed_rejects_invalid_cursor(self):
+        # Arrange
+        self.client.login(username='testuser', password='testpass123')
+        # Act
+        response = self.client.get(reverse('book-feed'), {'cursor': 'not-a-cursor'})
+        # Assert
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,88 @@
+import time
+import cloudinary
+import cloudinary.utils
+from django.core import signing
+from django.urls import reverse
+from django.utils.crypto import constant_time_compare, salted_hmac
+from .images import UPLOAD_MAX_SIZES, uses_cloudinary
+
+
+# Folder each kind of image is uploaded to, the same folders the ImageFields use
+UPLOAD_FOLDERS = {
+    'cover': 'images',
+    'profile': 'profile_pics',
+}
+
+# How long the browser has to start an upload after getting its signature.
+# Cloudinary refuses signatures older than an hour whatever this is set to
+UPLOAD_SIGNATURE_MAX_AGE = 60 * 10
+
+# Only images can be uploaded
+UPLOAD_FORMATS = 'jpg,jpeg,png,gif,webp,heic'
+
+UPLOAD_SALT = 'books.uploads'
+
+
+# Get the url and form fields the browser sends an image to so it goes straight to storage instead of through a Django worker.
+# For Cloudinary the fields are signed with the api secret, which never leaves the server, so only this folder can be uploaded to
+def get_upload_signature(kind, user):
+    folder = UPLOAD_FOLDERS[kind]
+
+    if uses_cloudinary():
+        config = cloudinary.config()
+        width, height = UPLOAD_MAX_SIZES[kind]
+
+        # The incoming transformation makes Cloudinary shrink the photo before storing it, the same as uploads Django processes
+        params = {
+            'folder': f'media/{folder}',
+            'timestamp': int(time.time()),
+            'allowed_formats': UPLOAD_FORMATS,
+            'transformation': f'c_limit,w_{width},h_{height}',
+        }
+
+        return {
+            'upload_url': f'https://api.cloudinary.com/v1_1/{config.cloud_name}/image/upload',
+            'fields': {**params, 'api_key': config.api_key, 'signature': cloudinary.utils.api_sign_request(params, config.api_secret)},
+        }
+
+    # Local storage has no upload service so the direct upload view stands in for Cloudinary with a token signed by Django
+    return {
+        'upload_url': reverse('direct-upload'),
+        'fields': {'token': signing.dumps({'kind': kind, 'user': user.id}, salt=UPLOAD_SALT)},
+    }
+
+
+# Get the kind of image a local upload token allows, raises signing.BadSignature if the token was changed or is too old
+def read_upload_token(token):
+    return signing.loads(token, salt=UPLOAD_SALT, max_age=UPLOAD_SIGNATURE_MAX_AGE)['kind']
+
+
+# Sign what the local stand in sends back the same way Cloudinary signs its upload responses
+def get_local_response_signature(public_id, version):
+    return salted_hmac(UPLOAD_SALT, f'{public_id}:{version}').hexdigest()
+
+
+# Get the name of an image the browser uploaded straight to storage from the fields the form posted.
+# Returns None if nothing was uploaded or the response was not signed by storage, so a user can not claim any file they like
+def get_uploaded_image(data, kind):
+    public_id = data.get('uploaded_image')
+    version = data.get('uploaded_version')
+    signature = data.get('uploaded_signature')
+
+    if not (public_id and version and signature):
+        return None
+
+    if uses_cloudinary():
+        valid = cloudinary.utils.verify_api_response_signature(public_id, version, signature)
+
+        # The storage names leave out the media folder like upload_image_to_cloudinary does
+        name = public_id.removeprefix('media/')
+    else:
+        valid = constant_time_compare(signature, get_local_response_signature(public_id, version))
+        name = public_id
+
+    # A signed upload of a profile picture can not be used as a cover or the other way around
+    if not valid or not name.startswith(UPLOAD_FOLDERS[kind] + '/'):
+        return None
+
+    return name
@@ -9,5 +9,8 @@ urlpatterns = [
     path('edit-book/<uuid:id>/', views.edit_book, name='edit-book'),
     path('delete-book/<uuid:id>/', views.delete_book, name='delete-book'),
     path('statistics/', views.statistics, name='statistics'),
+    path('api/books/', views.book_feed, name='book-feed'),
     path('api/search-google-books/', views.search_google_books, name='search-google-books'),
+    path('api/upload-signature/', views.upload_signature, name='upload-signature'),
+    path('api/direct-upload/', views.direct_upload, name='direct-upload'),
 ]
\ No newline at end of file
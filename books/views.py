@@ -1,12 +1,38 @@
+import mimetypes
+import re
+import time
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
-from .models import Book
+from django.http import JsonResponse, HttpResponse, Http404
+from django import forms
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.conf import settings
+from django.utils.cache import get_conditional_response
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from .models import Book, ReadingStats, GenreStats, YearStats, AuthorStats
 from .forms import EditBookForm, AddBookForm
-from django.db.models import Count, Avg, Case, When, Value, CharField, Q
-from django.db.models.functions import ExtractYear
 from django.contrib.auth.decorators import login_required
 from datetime import date
-from .services import search_google_books as google_books_search, upload_image_to_cloudinary
+from .services import search_google_books as google_books_search
+from .tasks import queue_cover_upload, queue_cover_variants, queue_cover_preview
+from .covers import get_cover_for_url, get_cover_for_file, remember_cover
+from .pagination import get_books_page, get_sort_ordering
+from .search import search_books
+from .facets import get_facets
+from .cache import get_grid_cache_key, get_cached_grid, cache_grid
+from .conditional import library_page
+from .media_proxy import MEDIA_PROXY_CACHE_CONTROL, read_proxy_token, get_cache_key, read_cached_cover, fetch_cover, cache_cover
+from .images import process_upload, transform_image
+from .uploads import UPLOAD_FOLDERS, get_upload_signature, read_upload_token, get_local_response_signature, get_uploaded_image
+
+
+# Get the first day of a year and the first day of the next year to filter dates with
+def get_year_range(year):
+    return date(year, 1, 1), date(year + 1, 1, 1)
 
 
 # Function used to apply filters and sorting to the books in the home view
@@ -15,12 +41,10 @@ def apply_filters_and_sort(books, request):
     # Get search value if one was entered
     search = request.GET.get('search')
     
-    # If there is a search value use filter and Q objects to find titles or authors that contains the search input.
-    # icontains checks if the attributes contain the search and is case insensitive.
-    # Q objects allows us to filter using and, or, and not instead of just and
+    # If there is a search value use the full text search index to find books whose title, author or review match the search.
+    # Each match gets a search_rank so results can be ordered by relevance
     if search:
-        books = books.filter(
-            Q(title__icontains=search) | Q(author__icontains=search))
+        books = search_books(books, search)
     
     # Filter by a certain genre if selected by user
     genre = request.GET.get('genre')
@@ -33,57 +57,109 @@ def apply_filters_and_sort(books, request):
         books = books.filter(rating=rating)
     
     # Filter by a certain year if selected by user
+    # Use a date range instead of date_finished__year so the database can use the user, date_finished index
     year = request.GET.get('year')
     if year:
-        books = books.filter(date_finished__year=year)
+        try:
+            year_start, year_end = get_year_range(int(year))
+            books = books.filter(date_finished__gte=year_start, date_finished__lt=year_end)
+        
+        # Ignore years that are not numbers or are out of range
+        except ValueError:
+            pass
     
     # Filter by a certain status if selected by user
     status = request.GET.get('status')
     if status:
         books = books.filter(status=status)
     
-    # Apply the specific sort selected by user if chosen
+    # Apply the specific sort selected by user if chosen, with id as a tiebreaker so pagination is stable
     sort = request.GET.get('sort')
-    match sort:
-        case 'title_asc':
-            books = books.order_by('title')
-        case 'author_asc':
-            books = books.order_by('author')
-        case 'rating_desc':
-            books = books.order_by('-rating')
-        case 'rating_asc':
-            books = books.order_by('rating')
-        case 'date_desc':
-            books = books.order_by('-date_finished')
-        case 'date_asc':
-            books = books.order_by('date_finished')
+    
+    # Order searches by relevance unless the user picked another sort, relevance means nothing without a search
+    if search and sort in (None, '', 'relevance'):
+        sort = 'relevance'
+    elif sort == 'relevance':
+        sort = None
+    
+    books = books.order_by(*get_sort_ordering(sort))
             
     return books, genre, status, rating, year, search, sort
 
 
 # Display books
 @login_required
+@library_page
 def home(request):
     
     # Retrieve all books from database that belong to the logged in user
     books = Book.objects.filter(user=request.user)
     
-    # Get the total number of books that belong to the user
-    total_books = books.count()
-    
-    # Get all unique years for the filter dropdown
-    years = books.dates('date_finished', 'year', order='DESC')
-    
     # Apply filters and sorting to the books based on the users selections
     books, genre, status, rating, year, search, sort = apply_filters_and_sort(books, request)
+    
+    # Get the counts for every filter option and the total number of books in one cached query
+    facets, total_books = get_facets(request.user, search, genre, status, rating, year)
+    
+    # Use the cached card grid for these filters if the library has not changed since it was rendered,
+    # the books queryset is lazy so on a hit no books query is ever run
+    grid_key = get_grid_cache_key(request.user.id, 'home', request.GET)
+    grid = get_cached_grid(grid_key)
+    
+    if grid is None:
+        
+        # Skip the review and purchase link since the cards never display them
+        books = books.defer('review', 'purchase_link')
+        
+        # Only load the first page of books, or the page after the cursor if the user clicked load more without javascript
+        try:
+            books, next_cursor = get_books_page(books, sort, request.GET.get('cursor'))
+        except ValueError:
+            books, next_cursor = get_books_page(books, sort)
+        
+        grid = {
+            'html': render_to_string('books/home-grid.html', {'books': books, 'total_books': total_books}),
+            'next_cursor': next_cursor,
+        }
+        cache_grid(grid_key, grid)
+    
+    # Keep the current filters without the cursor so the next page urls can add their own cursor
+    query = request.GET.copy()
+    query.pop('cursor', None)
             
     # Include these variables that will be used in the templates
-    context = {'books': books, 'total_books': total_books, 'years': years, 'genre': genre, 'status': status, 'rating': rating, 'year': year, 'search': search, 'sort': sort}
+    context = {'grid_html': mark_safe(grid['html']), 'total_books': total_books, 'facets': facets, 'genre': genre, 'status': status, 'rating': rating, 'year': year, 'search': search, 'sort': sort, 'next_cursor': grid['next_cursor'], 'query': query.urlencode()}
     return render(request, 'books/home.html', context)
 
 
+# Return the next page of home page cards so the page can keep scrolling, the cards are rendered
+# from the same template as the first page so they get the same resized covers and placeholders
+@login_required
+@library_page
+def book_feed(request):
+    
+    books = Book.objects.filter(user=request.user)
+    
+    # Use the same filters and sorting as the home page so the pages line up
+    books, genre, status, rating, year, search, sort = apply_filters_and_sort(books, request)
+    
+    # Skip the review and purchase link since the cards never display them
+    books = books.defer('review', 'purchase_link')
+    
+    # If the cursor was changed or is not valid return an error response instead of guessing where to start
+    try:
+        books, next_cursor = get_books_page(books, sort, request.GET.get('cursor'))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    
+    html = render_to_string('books/book-cards.html', {'books': books})
+    
+    return JsonResponse({'html': html, 'next_cursor': next_cursor})
+
+
 # List a single book and take a books id as an argument
 @login_required
+@library_page
 def book_detail(request, id):
     
     # Get the next parameter from url to use for go back button otherwise set it to home
@@ -109,20 +185,53 @@ def add_book(request):
             
             book = form.save(commit=False)
             
+            content_hash = None
+            uploaded_image = None
+            
             # If user is using a search to upload an image
             if request.POST.get('image_url'):
+                book.cover_source_url = request.POST.get('image_url')
+                
+                # Reuse the cover if any user already added a book with this image
+                image = get_cover_for_url(book.cover_source_url)
                 
-                # Upload image to cloudinary otherwise image variable is assigned none
-                image = upload_image_to_cloudinary(request.POST.get('image_url'))
+                # Otherwise save the book with a pending cover and upload it in the background
+                # so the user does not wait for Cloudinary to fetch and store the image
+                if image is None:
+                    book.cover_status = 'pending'
                 
             # If the user uploaded photo manually   
             else:
-                image = request.FILES.get('image')
+                # The browser uploads the photo straight to storage when it can and only sends its name
+                uploaded_image = get_uploaded_image(request.POST, 'cover')
+                image = uploaded_image or form.cleaned_data.get('image')
+                
+                # Reuse the stored image if this exact file was uploaded before
+                if image and not uploaded_image:
+                    stored_image, content_hash = get_cover_for_file(image)
+                    
+                    if stored_image:
+                        image, content_hash = stored_image, None
             
             book.user = request.user
             book.image = image
             
             book.save()
+            
+            if book.cover_status == 'pending':
+                queue_cover_upload(book)
+            
+            # Make the placeholder shown while the cover loads
+            elif book.image:
+                queue_cover_preview(book)
+            
+            # Remember the newly uploaded file so the next upload of it is reused and make its resized copies
+            if content_hash:
+                remember_cover(book.image.name, content_hash=content_hash)
+            
+            if content_hash or uploaded_image:
+                queue_cover_variants(book.image.name, request.user.id)
+            
             return redirect('home')
     
     context = {'form': form}
@@ -143,8 +252,42 @@ def edit_book(request, id):
         form = EditBookForm(request.POST, request.FILES, instance=book)
         
         if form.is_valid():
+            
+            # A photo the browser uploaded straight to storage takes the place of the file field
+            uploaded_image = get_uploaded_image(request.POST, 'cover')
+            image_changed = 'image' in form.changed_data or uploaded_image is not None
+            
+            if uploaded_image:
+                book.image = uploaded_image
+            
+            # A cover uploaded by hand replaces a search cover that is still uploading and the placeholder of the old cover
+            if image_changed:
+                book.cover_status = 'ready'
+                book.cover_placeholder = ''
+                book.cover_color = ''
+            
+            image = form.cleaned_data.get('image')
+            content_hash = None
+            
+            # Reuse the stored image if this exact file was uploaded before, the image is False when it is being cleared
+            if 'image' in form.changed_data and image and not uploaded_image:
+                stored_image, content_hash = get_cover_for_file(image)
+                
+                if stored_image:
+                    book.image, content_hash = stored_image, None
+            
             # Save data to database
-            form.save()
+            book.save()
+            
+            if content_hash:
+                remember_cover(book.image.name, content_hash=content_hash)
+            
+            if content_hash or uploaded_image:
+                queue_cover_variants(book.image.name, request.user.id)
+            
+            if image_changed and book.image:
+                queue_cover_preview(book)
+            
             # Redirect to the book detail page for the book just updated
             return redirect('book-detail', id=book.uuid)
         
@@ -169,25 +312,31 @@ def delete_book(request, id):
 
 # Displays statistics
 @login_required
+@library_page
 def statistics(request):
     
-    #  Get all the finished books that belong to the current logged in user
-    books = Book.objects.filter(user=request.user).filter(status='finished')
+    # Read the running totals that the Book signals keep up to date instead of counting every finished book.
+    # A user with no finished books does not have a stats row yet so use an empty one
+    stats = ReadingStats.objects.filter(user=request.user).first() or ReadingStats(user=request.user)
     
     # Get the number of total books read
-    total_books = books.count()
-    
-    # Get the average rating of all finished books
-    avg_rating = books.aggregate(Avg('rating'))['rating__avg']
+    total_books = stats.total_books
     
-    # Verify that there were ratings to average and if not set it to 0
-    if avg_rating:
-        avg_rating = round(avg_rating, 1)
+    # Get the average rating of all finished books, verify that there were ratings to average and if not set it to 0
+    if stats.rated_books:
+        avg_rating = round(stats.rating_total / stats.rated_books, 1)
     else:
         avg_rating = 0
     
-    # Get the amount of books read this year
-    curr_year_book_count = books.filter(date_finished__year=date.today().year).count()
+    # Get the books read for each year that has finished books, most recent years first
+    year_stats = [
+        {'year': row.year, 'count': row.total_books}
+        for row in YearStats.objects.filter(user=request.user, total_books__gt=0).order_by('-year')
+    ]
+    
+    # Get the amount of books read this year from the year rows
+    curr_year = date.today().year
+    curr_year_book_count = next((row['count'] for row in year_stats if row['year'] == curr_year), 0)
     
     # Get user current reading goal
     curr_reading_goal = request.user.profile.reading_goal
@@ -200,32 +349,25 @@ def statistics(request):
     else:
         goal_progress = 0
     
-    # Groups the books by each of their genres using .values() 
-    # Use Case to create a new key/value pair for each genre name so we can display correct one in html later
-    # then uses annotate and Count() to count the amount of id's seen for each book in each genre
-    # uses Avg() to calculate the average rating for books in that genre
-    # use order_by('-count') to sort by count, highest first
-    genre_stats = books.values('genre').annotate(
-        genre_name=Case(
-            When(genre='fiction', then=Value('Fiction')),
-            When(genre='nonfiction', then=Value('Non-Fiction')),
-            When(genre='mystery', then=Value('Mystery')),
-            When(genre='scifi', then=Value('Science Fiction')),
-            When(genre='fantasy', then=Value('Fantasy')),
-            When(genre='thriller', then=Value('Thriller')),
-            When(genre='romance', then=Value('Romance')),
-            When(genre='biography', then=Value('Biography')),
-            When(genre='history', then=Value('History')),
-            When(genre='selfhelp', then=Value('Self-Help')),
-            output_field=CharField(),
-        ), count = Count('id'), avg_rating = Avg('rating')).order_by('-count')
-    
-    # Group all of the authors and count how many books user has read for them. Order authors by authors with most books read and only store top 5
-    author_stats = books.values('author').annotate(count = Count('id')).order_by('-count')[:5]
-    
-    # Filter out the books that do not have dates then use annotate and ExtractYear() to get the years from the date_finished attribute
-    # Once that is done group the years by year and count how many books are associated with each year. Then order them by most recent years to least recent
-    year_stats = books.filter(date_finished__isnull = False).annotate(year = ExtractYear('date_finished')).values('year').annotate(count = Count('id')).order_by('-year')
+    # Get the books read and average rating for each genre with the display name of the genre, highest count first
+    genre_stats = [
+        {
+            'genre': row.genre,
+            'genre_name': row.get_genre_display(),
+            'count': row.total_books,
+            'avg_rating': row.rating_total / row.rated_books if row.rated_books else None,
+        }
+        for row in GenreStats.objects.filter(user=request.user, total_books__gt=0).order_by('-total_books', 'genre')
+    ]
+    
+    # Get the top 5 authors the user has read the most books for
+    author_stats = [
+        {'author': row.author, 'count': row.total_books}
+        for row in AuthorStats.objects.filter(user=request.user, total_books__gt=0).order_by('-total_books', 'author')[:5]
+    ]
+    
+    # The top 3 still comes from the books table since it needs the books themselves, the user and status index keeps it small
+    books = Book.objects.filter(user=request.user, status='finished')
     
     # Filter books to get the books that have a 5 star rating and a date_finished then order them by most recently finished and get top 3
     top3_recent_books = books.filter(rating=5, date_finished__isnull = False).order_by('-date_finished')[:3]
@@ -266,4 +408,112 @@ def search_google_books(request):
         return JsonResponse({'error': 'Search is unavailable, try manually adding a book'}, status=503)
     
     # Return Json repsonse as a dictionary containing all of the book data grabbed from google api response
-    return JsonResponse({'results': search_results})
\ No newline at end of file
+    return JsonResponse({'results': search_results})
+
+# Get the signature the browser needs to upload a cover or profile picture straight to storage
+@login_required
+def upload_signature(request):
+    
+    kind = request.GET.get('kind')
+    
+    if kind not in UPLOAD_FOLDERS:
+        return JsonResponse({'error': 'Unknown upload'}, status=400)
+    
+    # Profile features are turned off for the demo account
+    if kind == 'profile' and request.user.username == 'demo':
+        return JsonResponse({'error': 'Profile features are disabled in demo mode.'}, status=403)
+    
+    return JsonResponse(get_upload_signature(kind, request.user))
+
+
+# Stand in for Cloudinary's upload api when images are stored locally, used in development and tests.
+# Like Cloudinary it is called by the browser with a signed token instead of the session so it does not need a csrf token
+@csrf_exempt
+@require_POST
+def direct_upload(request):
+    
+    try:
+        kind = read_upload_token(request.POST.get('token', ''))
+    except signing.BadSignature:
+        return JsonResponse({'error': 'Upload signature is invalid or expired'}, status=403)
+    
+    # Check the file really is an image with Pillow, the same check an ImageField makes, then shrink it like Cloudinary would
+    try:
+        file = process_upload(forms.ImageField().clean(request.FILES.get('file')), kind)
+    except ValidationError as error:
+        return JsonResponse({'error': error.messages[0]}, status=400)
+    
+    public_id = default_storage.save(f'{UPLOAD_FOLDERS[kind]}/{file.name}', file)
+    version = int(time.time())
+    
+    return JsonResponse({'public_id': public_id, 'version': version, 'signature': get_local_response_signature(public_id, version)})
+
+
+# Serve images for the local stand in for Cloudinary, the path is the name with an optional transformation in front of it
+# like Cloudinary urls, '/media/upload/c_scale,w_240,f_auto,q_auto/images/3f7a.jpg' is images/3f7a.jpg 240 pixels wide
+def local_media(request, path):
+    
+    if not getattr(default_storage, 'transformation_urls', False):
+        raise Http404
+    
+    transformation, _, name = path.partition('/')
+    
+    # Transformations are single letter options like w_240 joined by commas, the folder of a name never looks like one
+    if not re.fullmatch(r'[a-z]_[^,]+(,[a-z]_[^,]+)*', transformation) or not name:
+        transformation, name = None, path
+    
+    if not default_storage.exists(name):
+        raise Http404
+    
+    with default_storage.open(name) as file:
+        data = file.read()
+    
+    if transformation:
+        try:
+            data, content_type = transform_image(data, transformation)
+        except ValueError:
+            raise Http404
+    else:
+        content_type = mimetypes.guess_type(name)[0]
+    
+    return HttpResponse(data, content_type=content_type)
+
+
+# Serve a remote cover, like the Google Books covers on the recommendations page, from the disk cache.
+# The cover is fetched and shrunk the first time it is asked for, after that browsers keep it for a year and revalidate with the ETag
+def media_proxy(request, token):
+    
+    try:
+        url = read_proxy_token(token)
+    except signing.BadSignature:
+        raise Http404
+    
+    key = get_cache_key(token)
+    etag = f'"{key}"'
+    
+    # The cover for a url never changes so a browser that has it gets a 304 without the cache being read.
+    # The 304 carries the same validator and caching headers as the full response so the browser keeps the cover for another year
+    not_modified = get_conditional_response(request, etag=etag)
+    
+    if not_modified is not None:
+        not_modified['ETag'] = etag
+        not_modified['Cache-Control'] = MEDIA_PROXY_CACHE_CONTROL
+        return not_modified
+    
+    data = read_cached_cover(key)
+    
+    if data is None:
+        data = fetch_cover(url)
+        
+        # Show the placeholder for broken covers and try again in a few minutes
+        if data is None:
+            response = redirect(f'{settings.STATIC_URL}images/placeholder.png')
+            response['Cache-Control'] = 'public, max-age=300'
+            return response
+        
+        cache_cover(key, data)
+    
+    response = HttpResponse(data, content_type='image/jpeg')
+    response['ETag'] = etag
+    response['Cache-Control'] = MEDIA_PROXY_CACHE_CONTROL
+    return response
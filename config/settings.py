@@ -74,6 +74,9 @@ MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     # Whitenoise handles static files like CSS or images directly so django does not have to
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    # Compress pages and JSON after WhiteNoise so static files keep using the compressed files WhiteNoise already serves.
+    # Browsers that do not send Accept-Encoding gzip get the plain response and Vary: Accept-Encoding is added for caches
+    'django.middleware.gzip.GZipMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -157,6 +160,22 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 # Media files
 MEDIA_URL = '/media/'
 
+# Where images are kept when MEDIA_STORAGE=local
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Disk cache for remote covers served through /media-proxy/, the least recently used covers are removed once it is bigger than the limit
+MEDIA_PROXY_CACHE_DIR = os.environ.get('MEDIA_PROXY_CACHE_DIR', BASE_DIR / 'media_proxy_cache')
+MEDIA_PROXY_CACHE_BYTES = int(os.environ.get('MEDIA_PROXY_CACHE_MB', 200)) * 1024 * 1024
+
+# Finished PDF exports, named by a hash of what they show so an unchanged list is not drawn again
+EXPORT_CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR', BASE_DIR / 'export_cache')
+
+# Threads that draw PDF exports in each worker
+EXPORT_THREADS = int(os.environ.get('EXPORT_THREADS', 2))
+
+# Number of PDF exports one user can have waiting or running at once, always fewer than the threads so one user can not take them all
+EXPORT_JOBS_PER_USER = max(1, min(int(os.environ.get('EXPORT_JOBS_PER_USER', 1)), EXPORT_THREADS - 1))
+
 # Tell Django to use Cloudinary for all user uploaded media files instead of local file system
 STORAGES = {
     "default": {
@@ -167,7 +186,37 @@ STORAGES = {
     },
 }
 
-
+# Set MEDIA_STORAGE=local to keep images on disk with a stand in for Cloudinary so image features work offline.
+# MEDIA_LATENCY and MEDIA_JITTER add seconds to every storage call to act like the network when benchmarking or load testing
+if os.environ.get('MEDIA_STORAGE') == 'local':
+    STORAGES['default'] = {
+        "BACKEND": "books.storage.LocalMediaStorage",
+        "OPTIONS": {
+            "latency": float(os.environ.get('MEDIA_LATENCY', 0)),
+            "jitter": float(os.environ.get('MEDIA_JITTER', 0)),
+        },
+    }
+
+
+
+
+# Cache used for the home page filter counts
+# The memory cache is separate for every gunicorn worker, so set REDIS_URL to share one cache when running more than one worker
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'bookshelf',
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        }
+    }
 
 
 # Redirect to home books page when a user logs in
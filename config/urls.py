@@ -23,6 +23,7 @@ from django.conf.urls.static import static
 from django.contrib.auth import views as auth_views
 from django.contrib.auth.decorators import login_required
 from demo.decorators import demo_restricted
+from books.views import local_media, media_proxy
 
 urlpatterns = [
     # Override the login URL to redirect authenticated users
@@ -38,6 +39,10 @@ urlpatterns = [
     path('lists/', include('lists.urls')),
     path('', include('demo.urls')),
     path('recommendations/', include('recommendations.urls')),
+    # Images and their transformations when MEDIA_STORAGE=local stands in for Cloudinary
+    path(f"{settings.MEDIA_URL.strip('/')}/upload/<path:path>", local_media, name='local-media'),
+    # Remote covers fetched once, shrunk and kept in a disk cache
+    path('media-proxy/<str:token>/', media_proxy, name='media-proxy'),
 ]
 
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
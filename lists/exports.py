@@ -0,0 +1,197 @@
+import hashlib
+import logging
+import os
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+import requests
+from books.images import COVER_VARIANTS, transform_image, uses_cloudinary
+from books.media_proxy import cache_cover, get_cache_key, read_cached_cover
+from books.models import Book
+from books.tasks import submit_task
+from .models import ExportJob
+from .pdf import RENDERER_VERSION, render_list_pdf
+
+
+# Fields of a book that the PDF shows, they are also what the content hash is made from
+PDF_FIELDS = ['title', 'author', 'genre', 'rating', 'review', 'purchase_link', 'image']
+
+# One book of an export, render_list_pdf reads these like books but they skip building model instances
+ExportRow = namedtuple('ExportRow', PDF_FIELDS)
+
+# Number of books fetched from the database at a time while a list is exported
+EXPORT_CHUNK_SIZE = 2000
+
+# A job still waiting or running after this long was lost when its worker restarted, it no longer counts toward the users limit
+EXPORT_JOB_TIMEOUT = timedelta(minutes=10)
+
+ACTIVE_STATUSES = ['queued', 'running']
+
+logger = logging.getLogger(__name__)
+
+# Covers in a PDF are the size of the card variant
+COVER_EXPORT_WIDTH = COVER_VARIANTS['card']['width']
+
+# Covers are fetched this many at a time, each fetch mostly waits on Cloudinary so threads overlap the waiting
+COVER_FETCH_THREADS = 8
+
+COVER_FETCH_TIMEOUT = (3.05, 10)
+
+# Exports have their own threads so a big list does not hold up cover uploads, each user can have fewer exports
+# at once than there are threads so there is always one free for someone else
+export_executor = ThreadPoolExecutor(max_workers=settings.EXPORT_THREADS, thread_name_prefix='export-pdf')
+
+# Shared by every export so the number of cover downloads at once stays the same however many exports run
+cover_executor = ThreadPoolExecutor(max_workers=COVER_FETCH_THREADS, thread_name_prefix='export-cover')
+
+
+def get_cache_dir():
+    return Path(settings.EXPORT_CACHE_DIR)
+
+
+def get_artifact_path(content_hash):
+    return get_cache_dir() / f'{content_hash}.pdf'
+
+
+# Books of a custom list, or of an essential list when there is no custom list, in alphabetical order
+def get_list_books(user, book_list=None, status=None):
+    if book_list is not None:
+        books = book_list.books.all()
+    else:
+        books = Book.objects.filter(status=status, user=user)
+
+    return books.order_by('title')
+
+
+def get_export_rows(books):
+    for values in books.values_list(*PDF_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield ExportRow(*values)
+
+
+# Hash everything the PDF shows along with the renderer version, so a changed book or a new layout gives a new hash.
+# The user is part of it so two users never share a file
+def get_content_hash(user_id, list_name, rows, covers=False):
+    digest = hashlib.sha256(f'{RENDERER_VERSION}\n{user_id}\n{list_name}\n{covers}\n'.encode())
+
+    for row in rows:
+        digest.update(repr(tuple(row)).encode())
+        digest.update(b'\n')
+
+    return digest.hexdigest()
+
+
+# Get the card size JPEG of a stored cover. Cloudinary resizes it from the url, local covers are resized with Pillow
+def download_cover(name):
+    if uses_cloudinary():
+        url = default_storage.url(name).replace('/upload/', f'/upload/c_scale,w_{COVER_EXPORT_WIDTH},f_jpg,q_auto/', 1)
+        response = requests.get(url, timeout=COVER_FETCH_TIMEOUT)
+        response.raise_for_status()
+        return response.content
+
+    with default_storage.open(name) as file:
+        data, _ = transform_image(file.read(), f'c_scale,w_{COVER_EXPORT_WIDTH},f_jpg')
+
+    return data
+
+
+# Covers are kept in the media proxy's disk cache so exporting a list again, or another list with the same books, does not fetch them again.
+# Stored names change whenever the image does so a cached cover never goes stale. Returns None if the cover can not be fetched
+def fetch_cover(name):
+    key = get_cache_key(f'export-cover:{COVER_EXPORT_WIDTH}:{name}')
+    data = read_cached_cover(key)
+
+    if data is None:
+        try:
+            data = download_cover(name)
+        except Exception:
+            return None
+
+        cache_cover(key, data)
+
+    return data
+
+
+# Fetch the covers of every book at once on the cover threads, each image is only fetched once even if several books use it
+def fetch_covers(rows):
+    names = sorted({row.image for row in rows if row.image})
+    return dict(zip(names, cover_executor.map(fetch_cover, names)))
+
+
+# Write to a temporary file and rename it so a download never reads half a file
+def store_artifact(content_hash, data):
+    cache_dir = get_cache_dir()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    with tempfile.NamedTemporaryFile(dir=cache_dir, suffix='.tmp', delete=False) as file:
+        file.write(data)
+
+    os.replace(file.name, get_artifact_path(content_hash))
+
+
+# The users exports that are waiting or running, jobs older than the timeout were lost and are left out
+def get_active_jobs(user):
+    return ExportJob.objects.filter(user=user, status__in=ACTIVE_STATUSES, created_date__gt=timezone.now() - EXPORT_JOB_TIMEOUT)
+
+
+def count_active_jobs(user):
+    return get_active_jobs(user).count()
+
+
+# Mark the users lost jobs failed so their status pages stop waiting and the user can export again
+def fail_lost_jobs(user):
+    ExportJob.objects.filter(
+        user=user, status__in=ACTIVE_STATUSES, created_date__lte=timezone.now() - EXPORT_JOB_TIMEOUT,
+    ).update(status='failed')
+
+
+# Run the job once the request that made it has committed so the background thread can see it
+def queue_export_job(job):
+    job_id = job.id
+    transaction.on_commit(lambda: submit_task(run_export_job, job_id, executor=export_executor))
+
+
+# Draw the PDF for a job and store it under the hash of what it shows
+def run_export_job(job_id):
+
+    # Only a queued job is started so a job is never run twice
+    if not ExportJob.objects.filter(id=job_id, status='queued').update(status='running'):
+        return
+
+    job = ExportJob.objects.select_related('book_list').get(id=job_id)
+
+    try:
+        rows = list(get_export_rows(get_list_books(job.user_id, job.book_list, job.list_status)))
+
+        # The list may have changed since the job was queued so the hash is made again from the books being drawn
+        content_hash = get_content_hash(job.user_id, job.list_name, rows, job.covers)
+
+        if not get_artifact_path(content_hash).exists():
+            covers = fetch_covers(rows) if job.covers else None
+            store_artifact(content_hash, render_list_pdf(job.list_name, rows, covers))
+    except Exception:
+        ExportJob.objects.filter(id=job_id).update(status='failed')
+
+        # Nothing reads the result of a background task so log the error here or it is lost
+        logger.exception('PDF export job %s failed', job_id)
+        return
+
+    ExportJob.objects.filter(id=job_id).update(status='ready', content_hash=content_hash)
+    remove_old_artifacts(job, content_hash)
+
+
+# Delete the files of earlier exports of the same list, they show books as they were before and will not be asked for again
+def remove_old_artifacts(job, content_hash):
+    old_jobs = ExportJob.objects.filter(
+        user_id=job.user_id, book_list_id=job.book_list_id, list_status=job.list_status, covers=job.covers, status__in=['ready', 'failed'],
+    ).exclude(content_hash=content_hash)
+
+    for old_hash in set(old_jobs.values_list('content_hash', flat=True)):
+        get_artifact_path(old_hash).unlink(missing_ok=True)
+
+    old_jobs.delete()
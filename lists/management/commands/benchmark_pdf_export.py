@@ -0,0 +1,65 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from books.models import Book
+from lists.pdf import render_list_pdf, render_list_pdf_platypus
+
+
+WORDS = ('the quick story of a long journey through dark woods where every reader finds something new to love about '
+         'its characters and the world they live in although the ending felt rushed and the middle dragged').split()
+
+RENDERERS = [('platypus', render_list_pdf_platypus), ('canvas', render_list_pdf)]
+
+
+# Create Django management command that inherits from BaseCommand
+class Command(BaseCommand):
+    help = 'Times the platypus and canvas PDF renderers on generated lists of different sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help='Number of books in each list (default 100 1000 10000)')
+        parser.add_argument('--repeat', type=int, default=3, help='Times each renderer is run on each list, the fastest run is shown (default 3)')
+        parser.add_argument('--seed', type=int, default=1, help='Seed for the generated books so runs can be compared (default 1)')
+
+    # Make unsaved books like a real list, most with a review of a few sentences and some with a purchase link
+    def get_books(self, count, seed):
+        generator = random.Random(seed)
+        genres = [genre for genre, _ in Book.GENRE_CHOICES]
+        books = []
+
+        for number in range(count):
+            review = ' '.join(generator.choices(WORDS, k=generator.randint(10, 120))) if generator.random() < 0.7 else ''
+            link = f'https://example.com/books/{number}' if generator.random() < 0.4 else ''
+
+            books.append(Book(
+                title=' '.join(generator.choices(WORDS, k=generator.randint(1, 6))).title(),
+                author=f'Author {number}',
+                genre=generator.choice(genres),
+                rating=generator.choice([None, 1, 2, 3, 4, 5]),
+                review=review,
+                purchase_link=link,
+            ))
+
+        return books
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'books':>8}{'platypus s':>12}{'canvas s':>12}{'speedup':>10}{'platypus KB':>14}{'canvas KB':>12}")
+
+        for size in options['sizes']:
+            books = self.get_books(size, options['seed'])
+            results = {}
+
+            for name, render in RENDERERS:
+                times = []
+
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    pdf = render('Benchmark List', books)
+                    times.append(time.perf_counter() - started)
+
+                results[name] = (min(times), len(pdf))
+
+            platypus_time, platypus_size = results['platypus']
+            canvas_time, canvas_size = results['canvas']
+
+            self.stdout.write(f'{size:>8}{platypus_time:>12.2f}{canvas_time:>12.2f}{platypus_time / canvas_time:>9.1f}x'
+                              f'{platypus_size / 1024:>14.0f}{canvas_size / 1024:>12.0f}')
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:03
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lists', '0002_booklist_uuid'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('list_status', models.CharField(blank=True, max_length=20)),
+                ('list_name', models.CharField(max_length=100)),
+                ('content_hash', models.CharField(max_length=64)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('ready', 'Ready'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('created_date', models.DateTimeField(auto_now_add=True)),
+                ('book_list', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='lists.booklist')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'content_hash'], name='exportjob_user_hash_idx')],
+            },
+        ),
+    ]
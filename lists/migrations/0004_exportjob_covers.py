@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lists', '0003_exportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportjob',
+            name='covers',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -25,7 +25,35 @@ class BookList(models.Model):
     # Display newly created lists first
     class Meta:
         ordering = ['-created_date']
+
+
+# A PDF export of a list made on a background thread. The finished PDF is stored under content_hash so an unchanged list
+# is served from the stored file instead of being drawn again, see lists/exports.py
+class ExportJob(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
     
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # The custom list being exported, or blank with the reading status set for an essential list
+    book_list = models.ForeignKey(BookList, on_delete=models.CASCADE, null=True, blank=True)
+    list_status = models.CharField(max_length=20, blank=True)
+    list_name = models.CharField(max_length=100)
+    # Whether the PDF shows each book's cover
+    covers = models.BooleanField(default=False)
+    # Hash of the user, renderer version, covers setting and everything the PDF shows
+    content_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    created_date = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'content_hash'], name='exportjob_user_hash_idx'),
+        ]
     
-    
+    def __str__(self):
+        return f'{self.list_name} ({self.status})'
@@ -0,0 +1,430 @@
+from functools import lru_cache
+from io import BytesIO
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, KeepTogether, Table, TableStyle, HRFlowable
+from books.models import Book
+
+
+# Stored PDF exports are named by a hash that includes this, change it when the layout changes so lists are drawn again
+RENDERER_VERSION = 1
+
+# getSampleStyleSheet gives us pre-built styles like Title, Heading2, Normal
+# Both renderers take their fonts and sizes from it so the two PDFs look the same
+STYLES = getSampleStyleSheet()
+TITLE_STYLE = STYLES['Title']
+HEADING_STYLE = STYLES['Heading2']
+NORMAL_STYLE = STYLES['Normal']
+
+BOLD_FONT = 'Helvetica-Bold'
+ITALIC_FONT = 'Helvetica-Oblique'
+
+REVIEW_BACKGROUND = colors.HexColor('#f5f5f5')
+LABEL_COLOR = colors.HexColor('#555555')
+
+PAGE_WIDTH, PAGE_HEIGHT = letter
+
+# SimpleDocTemplate pads its frame by 6 points inside the 1 inch margins, the canvas renderer draws in the same box
+FRAME_PADDING = 6
+LEFT = inch + FRAME_PADDING
+TOP = PAGE_HEIGHT - inch - FRAME_PADDING
+BOTTOM = inch + FRAME_PADDING
+CONTENT_WIDTH = PAGE_WIDTH - 2 * LEFT
+
+# The review table was given a fixed width a little wider than the frame and platypus centres it
+REVIEW_WIDTH = 6.5 * inch
+REVIEW_X = (CONTENT_WIDTH - REVIEW_WIDTH) / 2
+REVIEW_PADDING_X = 10
+REVIEW_PADDING_Y = 8
+
+# Looking up display names in a dict is quicker than calling get_genre_display for every book
+GENRE_NAMES = dict(Book.GENRE_CHOICES)
+
+# Covers are drawn at the size of a small paperback thumbnail with the book's text to the right of them.
+# The card variant is 240 pixels wide so they print sharply
+COVER_WIDTH = 60
+COVER_HEIGHT = 90
+COVER_INDENT = COVER_WIDTH + 14
+COVER_PLACEHOLDER = 'cover-placeholder'
+
+LINK_LABEL = 'Purchase: '
+LINK_TEXT = 'Check it out here'
+
+
+# Build the PDF with ReportLab's platypus layout engine, this was the only renderer before render_list_pdf and is kept to compare against
+def render_list_pdf_platypus(list_name, books):
+
+    # BytesIO creates an in-memory buffer to hold the PDF data
+    # This is better than saving to disk because it's faster and doesn't require file cleanup
+    buffer = BytesIO()
+
+    # SimpleDocTemplate is ReportLab's PDF document builder
+    # Set the page size to normal letter page size and set margins on all sides
+    doc = SimpleDocTemplate(buffer, pagesize=letter, rightMargin=inch, leftMargin=inch, topMargin=inch, bottomMargin=inch)
+
+    # Clone the Normal style to create a custom link style
+    # clone() copies all existing properties
+    link_style = NORMAL_STYLE.clone('LinkStyle')
+    link_style.textColor = colors.blue
+    link_style.underline = True
+
+    # elements is a list of content blocks that ReportLab will stack vertically in the PDF
+    # Everything gets added to this list and then built into the PDF at the end
+    elements = []
+
+    # Add the list name as a large centered title at the top of the PDF
+    elements.append(Paragraph(list_name, TITLE_STYLE))
+
+    # Draw a line under title
+    elements.append(HRFlowable(width="100%", thickness=1, color=colors.black))
+
+    # Spacer to add vertical whitespace
+    elements.append(Spacer(1, 0.3 * inch))
+
+    # Loop through each book and add its information as a block of content
+    for book in books:
+
+        book_elements = []
+
+        # Book title as a bold heading
+        book_elements.append(Paragraph(book.title, HEADING_STYLE))
+
+        # Author in normal text
+        book_elements.append(Paragraph(f"by {book.author}", NORMAL_STYLE))
+        book_elements.append(Spacer(1, 0.10 * inch))
+
+        # Show rating as the rating out of 5 if one exists, otherwise show "Not rated"
+        rating_text = f"{book.rating}/5" if book.rating else "Not rated"
+        book_elements.append(Paragraph(f"<b>Genre:</b> {book.get_genre_display()}  |  <b>Rating:</b> {rating_text}", NORMAL_STYLE))
+        book_elements.append(Spacer(1, 0.10 * inch))
+
+        # Only add review if the user wrote one and use a grey background with it
+        if book.review:
+            review_data = [[Paragraph(f"<i>\"{book.review}\"</i>", NORMAL_STYLE)]]
+            review_table = Table(review_data, colWidths=[6.5 * inch])
+            review_table.setStyle(TableStyle([
+                ('BACKGROUND', (0, 0), (-1, -1), REVIEW_BACKGROUND),
+                ('LEFTPADDING', (0, 0), (-1, -1), 10),
+                ('RIGHTPADDING', (0, 0), (-1, -1), 10),
+                ('TOPPADDING', (0, 0), (-1, -1), 8),
+                ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+            ]))
+
+            book_elements.append(review_table)
+            book_elements.append(Spacer(1, 0.05 * inch))
+
+        # Only add purchase link if one exists
+        if book.purchase_link:
+            book_elements.append(Spacer(1, 0.05 * inch))
+            book_elements.append(Paragraph(f'<font color="#555555">Purchase:</font> <link href="{book.purchase_link}"><u>Check it out here</u></link>', link_style))
+
+        book_elements.append(Spacer(1, 0.1 * inch))
+
+        # Divider line between books
+        book_elements.append(HRFlowable(width="100%", thickness=0.5, color=colors.grey))
+        book_elements.append(Spacer(1, 0.15 * inch))
+
+        # Use KeepTogether prevent one book's info from being split across 2 pages
+        elements.append(KeepTogether(book_elements))
+
+    # Build converts the elements list into the actual PDF and writes it to the buffer
+    doc.build(elements)
+
+    return buffer.getvalue()
+
+
+# Width of a word in points. Reviews and titles repeat the same words so each width is only measured once
+@lru_cache(maxsize=20000)
+def get_text_width(text, font, size):
+    return stringWidth(text, font, size)
+
+
+# Split text into lines that fit the width, breaking between words like a Paragraph does
+def wrap_text(text, font, size, width):
+    space = get_text_width(' ', font, size)
+    lines = []
+    line = []
+    line_width = 0
+
+    for word in text.split():
+        word_width = get_text_width(word, font, size)
+
+        if line and line_width + space + word_width > width:
+            lines.append(' '.join(line))
+            line = []
+            line_width = 0
+
+        line_width += word_width + (space if line else 0)
+        line.append(word)
+
+    if line:
+        lines.append(' '.join(line))
+
+    return lines or ['']
+
+
+# A book is laid out as rows before anything is drawn so its height is known and the page can be changed first.
+# Every row is (height, kind, data) and is drawn by draw_row from the top of the row.
+# Text rows hold (x, leading, segments) where each segment is (font, size, color, text) and starts where the one before it ends
+def get_text_rows(text, style, x=0, width=CONTENT_WIDTH):
+    return [(style.leading, 'text', (x, style.leading, [(style.fontName, style.fontSize, colors.black, line)]))
+            for line in wrap_text(text, style.fontName, style.fontSize, width)]
+
+
+# With a cover the book's text moves right of it, cover is the name of the form the cover image was drawn into
+def get_book_rows(book, cover=None):
+    font = NORMAL_STYLE.fontName
+    size = NORMAL_STYLE.fontSize
+    leading = NORMAL_STYLE.leading
+    x = COVER_INDENT if cover else 0
+    width = CONTENT_WIDTH - x
+    rows = [(HEADING_STYLE.spaceBefore, 'space', None)]
+
+    if cover:
+        rows.append((0, 'cover', cover))
+
+    # Book title as a bold heading
+    rows.extend(get_text_rows(book.title, HEADING_STYLE, x, width))
+    rows.append((HEADING_STYLE.spaceAfter, 'space', None))
+
+    # Author in normal text
+    rows.extend(get_text_rows(f'by {book.author}', NORMAL_STYLE, x, width))
+    rows.append((0.10 * inch, 'space', None))
+
+    # Genre and rating on one line with bold labels
+    rating_text = f'{book.rating}/5' if book.rating else 'Not rated'
+    rows.append((leading, 'text', (x, leading, [
+        (BOLD_FONT, size, colors.black, 'Genre:'),
+        (font, size, colors.black, f' {GENRE_NAMES.get(book.genre, book.genre)} | '),
+        (BOLD_FONT, size, colors.black, 'Rating:'),
+        (font, size, colors.black, f' {rating_text}'),
+    ])))
+    rows.append((0.10 * inch, 'space', None))
+
+    # Review in italics on a grey background, padded like the table the platypus renderer used.
+    # Background rows hold (x, width) of the background and the text row drawn on it
+    if book.review:
+        box_x, box_width = (x, width) if cover else (REVIEW_X, REVIEW_WIDTH)
+        rows.append((REVIEW_PADDING_Y, 'background', (box_x, box_width, None)))
+
+        for line in wrap_text(f'"{book.review}"', ITALIC_FONT, size, box_width - 2 * REVIEW_PADDING_X):
+            rows.append((leading, 'background', (box_x, box_width, (box_x + REVIEW_PADDING_X, leading, [(ITALIC_FONT, size, colors.black, line)]))))
+
+        rows.append((REVIEW_PADDING_Y, 'background', (box_x, box_width, None)))
+        rows.append((0.05 * inch, 'space', None))
+
+    # Purchase link with a grey label and the link text underlined in blue
+    if book.purchase_link:
+        rows.append((0.05 * inch, 'space', None))
+        rows.append((leading, 'link', (x, book.purchase_link)))
+
+    # Leave room for the whole cover when the text is shorter than it
+    if cover:
+        text_height = sum(row[0] for row in rows[2:])
+
+        if text_height < COVER_HEIGHT:
+            rows.append((COVER_HEIGHT - text_height, 'space', None))
+
+    rows.append((0.1 * inch, 'space', None))
+
+    # Divider line between books
+    rows.append((0.5 + 2, 'rule', None))
+    rows.append((0.15 * inch, 'space', None))
+
+    return rows
+
+
+# Text goes into one text object per page. The font and colour are only set when they change and a line that
+# starts right under the one before it moves down with T* instead of a new position, so little is written per line.
+# Colours are always the same few objects so they are compared by identity, which is much quicker than Color.__eq__
+def draw_text(page, top, x, leading, segments):
+    text = page['text']
+    baseline = top - segments[0][1]
+    cursor = page['cursor']
+
+    if not cursor or cursor[0] != x or abs(cursor[1] - baseline) > 0.01:
+        text.setTextOrigin(LEFT + x, baseline)
+
+    for index, (font, size, color, line) in enumerate(segments):
+        if page['font'] != (font, size, leading):
+            text.setFont(font, size, leading)
+            page['font'] = (font, size, leading)
+
+        if page['color'] is not color:
+            text.setFillColor(color)
+            page['color'] = color
+
+        if index == len(segments) - 1:
+            text.textLine(line)
+        else:
+            text.textOut(line)
+
+    page['cursor'] = (x, baseline - leading)
+
+
+def set_stroke(pdf, page, color):
+    if page['stroke'] is not color:
+        pdf.setStrokeColor(color)
+        page['stroke'] = color
+
+
+# Fill the review background rows drawn so far with one rectangle
+def draw_background(pdf, page):
+    if page['background']:
+        top, bottom, x, width = page['background']
+        pdf.rect(LEFT + x, bottom, width, top - bottom, stroke=0, fill=1)
+        page['background'] = None
+
+
+def draw_row(pdf, page, top, row):
+    height, kind, data = row
+
+    if kind == 'background':
+        x, width, text = data
+
+        # Rows of the same review touch, so they are joined into one background until a row of something else
+        if page['background'] and abs(page['background'][1] - top) < 0.01:
+            page['background'] = (page['background'][0], top - height, x, width)
+        else:
+            draw_background(pdf, page)
+            page['background'] = (top, top - height, x, width)
+
+        if text:
+            draw_text(page, top, *text)
+
+        return
+
+    draw_background(pdf, page)
+
+    if kind == 'text':
+        draw_text(page, top, *data)
+
+    elif kind == 'rule':
+        set_stroke(pdf, page, colors.grey)
+        pdf.line(LEFT, top - height / 2, LEFT + CONTENT_WIDTH, top - height / 2)
+
+    elif kind == 'cover':
+        # Every use of a cover draws the same form so its image is only stored in the PDF once
+        pdf.saveState()
+        pdf.translate(LEFT, top - COVER_HEIGHT)
+        pdf.doForm(data)
+        pdf.restoreState()
+
+    elif kind == 'link':
+        x, url = data
+        font = NORMAL_STYLE.fontName
+        size = NORMAL_STYLE.fontSize
+        baseline = top - size
+        label_width = get_text_width(LINK_LABEL, font, size)
+        link_width = get_text_width(LINK_TEXT, font, size)
+
+        start = LEFT + x + label_width
+
+        draw_text(page, top, x, NORMAL_STYLE.leading, [(font, size, LABEL_COLOR, LINK_LABEL), (font, size, colors.blue, LINK_TEXT)])
+
+        # Underline the link text and make it clickable
+        set_stroke(pdf, page, colors.blue)
+        pdf.line(start, baseline - 1.5, start + link_width, baseline - 1.5)
+        pdf.linkURL(url, (start, baseline - 2, start + link_width, baseline + size), relative=0)
+
+
+# Start a page. Only review backgrounds are filled and every line is half a point wide except the one under the title,
+# so both are set once per page. The text is drawn over the backgrounds when the page ends
+def begin_page(pdf):
+    pdf.setFillColor(REVIEW_BACKGROUND)
+    pdf.setLineWidth(0.5)
+    return {'text': pdf.beginText(), 'font': None, 'color': None, 'cursor': None, 'stroke': None, 'background': None}
+
+
+def end_page(pdf, page):
+    draw_background(pdf, page)
+    pdf.drawText(page['text'])
+    pdf.showPage()
+
+
+# Draw each cover once into a form, which the PDF stores once however many times it is shown, and a grey box for books without one.
+# covers maps image names to the JPEG of their card variant, or None when it could not be fetched. Returns the form name of each image
+def draw_cover_forms(pdf, covers):
+    pdf.beginForm(COVER_PLACEHOLDER, 0, 0, COVER_WIDTH, COVER_HEIGHT)
+    pdf.setFillColor(REVIEW_BACKGROUND)
+    pdf.rect(0, 0, COVER_WIDTH, COVER_HEIGHT, stroke=0, fill=1)
+    pdf.endForm()
+
+    forms = {}
+
+    for name, data in covers.items():
+        try:
+            image = ImageReader(BytesIO(data))
+            image.getSize()
+        except Exception:
+            continue
+
+        forms[name] = f'cover-{len(forms)}'
+        pdf.beginForm(forms[name], 0, 0, COVER_WIDTH, COVER_HEIGHT)
+        pdf.drawImage(image, 0, 0, COVER_WIDTH, COVER_HEIGHT, preserveAspectRatio=True, anchor='n')
+        pdf.endForm()
+
+    return forms
+
+
+# Build the same PDF by drawing straight onto a canvas. Text is measured once and wrapped by hand and pages are changed
+# by comparing heights, so the cost of each book stays the same however long the list is
+def render_list_pdf(list_name, books, covers=None):
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=letter)
+    forms = draw_cover_forms(pdf, covers) if covers is not None else None
+    page = begin_page(pdf)
+    y = TOP
+
+    # Add the list name as a large centered title at the top of the PDF
+    title_font = TITLE_STYLE.fontName
+    title_size = TITLE_STYLE.fontSize
+
+    for line in wrap_text(list_name, title_font, title_size, CONTENT_WIDTH):
+        x = (CONTENT_WIDTH - get_text_width(line, title_font, title_size)) / 2
+        draw_text(page, y, x, TITLE_STYLE.leading, [(title_font, title_size, colors.black, line)])
+        y -= TITLE_STYLE.leading
+
+    # Draw a line under title then add vertical whitespace
+    y -= TITLE_STYLE.spaceAfter + 1
+    pdf.setLineWidth(1)
+    set_stroke(pdf, page, colors.black)
+    pdf.line(LEFT, y, LEFT + CONTENT_WIDTH, y)
+    pdf.setLineWidth(0.5)
+    y -= 1 + 0.3 * inch
+
+    for book in books:
+        rows = get_book_rows(book, forms.get(book.image, COVER_PLACEHOLDER) if forms is not None else None)
+        height = sum(row[0] for row in rows)
+
+        # Keep a book together by starting a new page when it does not fit on this one,
+        # a book taller than a whole page is split between rows instead
+        if y - height < BOTTOM and y < TOP:
+            end_page(pdf, page)
+            page = begin_page(pdf)
+            y = TOP
+
+        for row in rows:
+            if y - (COVER_HEIGHT if row[1] == 'cover' else row[0]) < BOTTOM:
+                end_page(pdf, page)
+                page = begin_page(pdf)
+                y = TOP
+
+            # Space only moves down the page, at the top of a page it is left out like platypus does
+            if row[1] == 'space':
+                if y != TOP:
+                    y -= row[0]
+                continue
+
+            draw_row(pdf, page, y, row)
+            y -= row[0]
+
+    end_page(pdf, page)
+    pdf.save()
+
+    return buffer.getvalue()
@@ -0,0 +1,20 @@
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+from books.cache import bump_library_version
+from .models import BookList
+
+
+# Listen for when books are added to or removed from a list
+@receiver(m2m_changed, sender=BookList.books.through)
+def list_books_changed(sender, instance, action, **kwargs):
+    
+    # Start a new library version once the change is saved so cached list pages are rebuilt.
+    # instance is the list or the book depending on which side the change was made from, both belong to the same user
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_library_version(instance.user_id)
+
+
+# Listen for when a list is created, renamed or deleted so the my lists page and the list pages are not reused from a browser cache
+@receiver([post_save, post_delete], sender=BookList)
+def list_changed(sender, instance, **kwargs):
+    bump_library_version(instance.user_id)
@@ -1,8 +1,32 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth.models import User
 from django.urls import reverse
-from .models import BookList
+from .models import BookList, ExportJob
+from .exports import EXPORT_JOB_TIMEOUT, ExportRow, download_cover, fetch_cover, fetch_covers
+from .pdf import render_list_pdf, render_list_pdf_platypus
 from books.models import Book
+from books.cache import get_library_version
+from django.contrib.messages import get_messages
+import csv
+import uuid
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from io import BytesIO
+from PIL import Image
+from unittest.mock import patch
+from pathlib import Path
+import shutil
+import tempfile
+
+
+# Keep stored covers in memory instead of on Cloudinary
+LOCAL_STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
 
 
 class CreateListTests(TestCase):
@@ -78,6 +102,37 @@ class AddRemoveBooksTests(TestCase):
         self.assertRedirects(response, reverse('list-detail', kwargs={'id': self.user_list.uuid}))
         self.assertNotIn(self.book, self.user_list.books.all())
 
+    def test_add_many_books_in_constant_queries_and_report_missing(self):
+        # Arrange - Twenty books, one already in the list, plus ids that are unknown, not a uuid or another users book
+        self.client.login(username='testuser', password='testpass123')
+        books = [Book.objects.create(user=self.user, title=f'Book {number}', author='Author', genre='fiction') for number in range(20)]
+        self.user_list.books.add(books[0])
+        other_user = User.objects.create_user(username='other', password='testpass123')
+        other_book = Book.objects.create(user=other_user, title='Other', author='Author', genre='fiction')
+        book_ids = [book.uuid for book in books] + [uuid.uuid4(), 'not-a-uuid', other_book.uuid]
+        # Act - Session, user, list, selected books, one insert inside a savepoint, then the new library version
+        with self.assertNumQueries(8):
+            response = self.client.post(reverse('add-books', kwargs={'id': self.user_list.uuid}), {'book_ids': book_ids})
+        # Assert
+        self.assertEqual(self.user_list.books.count(), 20)
+        self.assertNotIn(other_book, self.user_list.books.all())
+        messages = [str(message) for message in get_messages(response.wsgi_request)]
+        self.assertEqual(messages, ['3 selected books could not be found and were skipped.'])
+
+    def test_remove_many_books_refreshes_cached_list(self):
+        # Arrange
+        self.client.login(username='testuser', password='testpass123')
+        books = [Book.objects.create(user=self.user, title=f'Book {number}', author='Author', genre='fiction') for number in range(5)]
+        self.user_list.books.add(*books)
+        self.client.get(reverse('list-detail', kwargs={'id': self.user_list.uuid}))
+        # Act
+        self.client.post(reverse('remove-books', kwargs={'id': self.user_list.uuid}), {'book_ids': [book.uuid for book in books[:4]]})
+        response = self.client.get(reverse('list-detail', kwargs={'id': self.user_list.uuid}))
+        # Assert - The cached grid was rebuilt without the removed books
+        self.assertEqual(list(self.user_list.books.all()), [books[4]])
+        self.assertNotContains(response, 'Book 0')
+        self.assertContains(response, 'Book 4')
+
 
 class ExportListTests(TestCase):
 
@@ -93,6 +148,18 @@ class ExportListTests(TestCase):
             rating=5,
         )
         self.user_list.books.add(self.book)
+        # Keep stored PDFs in a folder that is removed after the test
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        settings = override_settings(EXPORT_CACHE_DIR=self.cache_dir, EXPORT_JOBS_PER_USER=1)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    # Request a PDF export and run the background job it queues straight away
+    def export_pdf(self, url):
+        with patch('lists.exports.submit_task', side_effect=lambda func, *args, **kwargs: func(*args)):
+            with self.captureOnCommitCallbacks(execute=True):
+                return self.client.get(url)
 
     def test_export_list_csv_returns_csv_file(self):
         # Arrange
@@ -102,18 +169,256 @@ class ExportListTests(TestCase):
         # Assert - Check correct content type, book title is in file, and file is named correctly
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['Content-Type'], 'text/csv')
-        self.assertIn('The Hobbit', response.content.decode())
+        self.assertIn('The Hobbit', b''.join(response.streaming_content).decode())
         self.assertIn('my_list.csv', response['Content-Disposition'])
 
+    def test_export_finished_csv_streams_rows(self):
+        # Arrange
+        self.client.login(username='testuser', password='testpass123')
+        Book.objects.create(user=self.user, title='Dune', author='Frank Herbert', status='finished', genre='scifi', review='Spice')
+        # Act
+        response = self.client.get(reverse('export-finished', kwargs={'format': 'csv'}))
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        # Assert - Response streams, books are queried while streaming without image fields and rows match the old export
+        self.assertTrue(response.streaming)
+        self.assertIn('finished.csv', response['Content-Disposition'])
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('image', queries[0]['sql'])
+        self.assertEqual(rows, [
+            ['Title', 'Author', 'Genre', 'Rating', 'Review', 'Purchase Link'],
+            ['Dune', 'Frank Herbert', 'Science Fiction', '', 'Spice', ''],
+            ['The Hobbit', 'J.R.R. Tolkien', 'Fiction', '5/5', '', ''],
+        ])
+
     def test_export_list_pdf_returns_pdf_file(self):
         # Arrange
         self.client.login(username='testuser', password='testpass123')
+        # Act - The export is made in the background and the user waits on its status page
+        response = self.export_pdf(reverse('export-list', kwargs={'id': self.user_list.uuid, 'format': 'pdf'}))
+        job = ExportJob.objects.get()
+        status = self.client.get(response.url, HTTP_ACCEPT='application/json').json()
+        download = self.client.get(status['download_url'])
+        # Assert - Check the job finished, correct content type and file is named correctly
+        self.assertRedirects(response, reverse('export-status', args=[job.uuid]))
+        self.assertEqual(status['status'], 'ready')
+        self.assertEqual(download.status_code, 200)
+        self.assertEqual(download['Content-Type'], 'application/pdf')
+        self.assertIn('my_list.pdf', download['Content-Disposition'])
+        self.assertTrue(b''.join(download.streaming_content).startswith(b'%PDF'))
+
+    @patch('lists.exports.render_list_pdf', return_value=b'%PDF-cached')
+    def test_unchanged_list_pdf_served_from_cache(self, mock_render):
+        # Arrange - Export the list once
+        self.client.login(username='testuser', password='testpass123')
+        url = reverse('export-list', kwargs={'id': self.user_list.uuid, 'format': 'pdf'})
+        self.export_pdf(url)
+        # Act
+        response = self.export_pdf(url)
+        # Assert - The second export is the stored PDF sent straight away without drawing it again
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF-cached')
+        mock_render.assert_called_once()
+
+    @patch('lists.exports.render_list_pdf', return_value=b'%PDF')
+    def test_changed_list_pdf_made_again(self, mock_render):
+        # Arrange - Export the list, then change a book in it
+        self.client.login(username='testuser', password='testpass123')
+        url = reverse('export-list', kwargs={'id': self.user_list.uuid, 'format': 'pdf'})
+        self.export_pdf(url)
+        first_hash = ExportJob.objects.get().content_hash
+        Book.objects.filter(id=self.book.id).update(review='Even better the second time')
+        # Act
+        response = self.export_pdf(url)
+        # Assert - A new job drew the PDF again and the old file and job were removed
+        job = ExportJob.objects.get()
+        self.assertRedirects(response, reverse('export-status', args=[job.uuid]), fetch_redirect_response=False)
+        self.assertEqual(mock_render.call_count, 2)
+        self.assertNotEqual(job.content_hash, first_hash)
+        self.assertEqual(len(list(Path(self.cache_dir).iterdir())), 1)
+
+    def test_export_jobs_limited_per_user(self):
+        # Arrange - An export is already waiting
+        self.client.login(username='testuser', password='testpass123')
+        ExportJob.objects.create(user=self.user, list_name='Other', content_hash='0' * 64)
+        # Act - Queue the export without running it
+        with patch('lists.exports.submit_task') as mock_submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.get(reverse('export-list', kwargs={'id': self.user_list.uuid, 'format': 'pdf'}))
+        # Assert - No job is made and the user is sent back with a message
+        self.assertRedirects(response, reverse('list-detail', args=[self.user_list.uuid]))
+        self.assertEqual(ExportJob.objects.count(), 1)
+        mock_submit.assert_not_called()
+        self.assertIn('already have exports', str(list(get_messages(response.wsgi_request))[0]))
+
+    @patch('lists.exports.render_list_pdf', side_effect=RuntimeError('Bad font'))
+    def test_failed_export_job_is_logged(self, mock_render):
+        # Arrange
+        self.client.login(username='testuser', password='testpass123')
+        # Act - The job runs on a thread nobody waits on so the error has to be logged
+        with self.assertLogs('lists.exports', level='ERROR') as logs:
+            self.export_pdf(reverse('export-list', kwargs={'id': self.user_list.uuid, 'format': 'pdf'}))
+        # Assert
+        self.assertEqual(ExportJob.objects.get().status, 'failed')
+        self.assertIn('Bad font', logs.output[0])
+
+    def test_download_of_missing_file_respects_export_limit(self):
+        # Arrange - A finished export whose file was removed while another export is waiting
+        self.client.login(username='testuser', password='testpass123')
+        job = ExportJob.objects.create(user=self.user, book_list=self.user_list, list_name='My List', content_hash='a' * 64, status='ready')
+        ExportJob.objects.create(user=self.user, list_name='Other', content_hash='b' * 64)
+        # Act
+        with patch('lists.exports.submit_task') as mock_submit:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.get(reverse('export-download', args=[job.uuid]))
+        # Assert - The job is not queued again and the user is sent back with a message
+        job.refresh_from_db()
+        self.assertRedirects(response, reverse('list-detail', args=[self.user_list.uuid]))
+        self.assertEqual(job.status, 'ready')
+        mock_submit.assert_not_called()
+        self.assertIn('already have exports', str(list(get_messages(response.wsgi_request))[0]))
+
+    def test_lost_export_job_not_reused(self):
+        # Arrange - An export of the list was left running when its worker restarted
+        self.client.login(username='testuser', password='testpass123')
+        url = reverse('export-list', kwargs={'id': self.user_list.uuid, 'format': 'pdf'})
+        with patch('lists.exports.submit_task'):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.get(url)
+        lost = ExportJob.objects.get()
+        ExportJob.objects.filter(id=lost.id).update(status='running', created_date=timezone.now() - EXPORT_JOB_TIMEOUT)
+        # Act
+        response = self.export_pdf(url)
+        # Assert - The lost job is marked failed and a new job makes the PDF
+        job = ExportJob.objects.exclude(id=lost.id).get()
+        self.assertRedirects(response, reverse('export-status', args=[job.uuid]), fetch_redirect_response=False)
+        self.assertEqual(job.status, 'ready')
+        self.assertEqual(self.client.get(reverse('export-status', args=[lost.uuid]), HTTP_ACCEPT='application/json').json()['status'], 'failed')
+
+    @override_settings(STORAGES=LOCAL_STORAGES)
+    def test_export_pdf_with_covers_embeds_each_cover_once(self):
+        # Arrange - Two books share a cover and the media proxy cache is a temporary folder
+        self.client.login(username='testuser', password='testpass123')
+        proxy_settings = override_settings(MEDIA_PROXY_CACHE_DIR=self.cache_dir + '/covers')
+        proxy_settings.enable()
+        self.addCleanup(proxy_settings.disable)
+        buffer = BytesIO()
+        Image.new('RGB', (800, 1200), 'teal').save(buffer, 'JPEG')
+        name = default_storage.save('images/hobbit.jpg', ContentFile(buffer.getvalue()))
+        Book.objects.filter(id=self.book.id).update(image=name)
+        self.user_list.books.add(Book.objects.create(user=self.user, title='The Hobbit Again', author='J.R.R. Tolkien', genre='fiction', status='finished', image=name))
+        # Act
+        with patch('lists.exports.download_cover', wraps=download_cover) as mock_download:
+            response = self.export_pdf(reverse('export-list', kwargs={'id': self.user_list.uuid, 'format': 'pdf'}) + '?covers=1')
+        job = ExportJob.objects.get()
+        pdf = b''.join(self.client.get(reverse('export-download', args=[job.uuid])).streaming_content)
+        # Assert - The cover was fetched once at card size and stored in the PDF once for both books
+        self.assertRedirects(response, reverse('export-status', args=[job.uuid]), fetch_redirect_response=False)
+        self.assertTrue(job.covers)
+        mock_download.assert_called_once_with(name)
+        self.assertEqual(pdf.count(b'/Subtype /Image'), 1)
+        self.assertEqual(pdf.count(b'/Width 240'), 1)
+
+    @override_settings(STORAGES=LOCAL_STORAGES)
+    def test_export_covers_fetched_from_cache(self):
+        # Arrange - A cover already fetched by an earlier export
+        proxy_settings = override_settings(MEDIA_PROXY_CACHE_DIR=self.cache_dir + '/covers')
+        proxy_settings.enable()
+        self.addCleanup(proxy_settings.disable)
+        buffer = BytesIO()
+        Image.new('RGB', (800, 1200), 'teal').save(buffer, 'JPEG')
+        name = default_storage.save('images/cached.jpg', ContentFile(buffer.getvalue()))
+        fetch_cover(name)
+        # Act
+        with patch('lists.exports.download_cover') as mock_download:
+            covers = fetch_covers([ExportRow('Dune', 'Frank Herbert', 'scifi', None, '', '', name), ExportRow('Emma', 'Jane Austen', 'romance', None, '', '', '')])
+        # Assert - The cover came from the disk cache and books without a cover are skipped
+        mock_download.assert_not_called()
+        self.assertEqual(list(covers), [name])
+        self.assertTrue(covers[name].startswith(b'\xff\xd8'))
+
+    def test_export_job_of_another_user_not_found(self):
+        # Arrange
+        other = User.objects.create_user(username='other', password='testpass123')
+        job = ExportJob.objects.create(user=other, list_name='Theirs', content_hash='a' * 64, status='ready')
+        self.client.login(username='testuser', password='testpass123')
         # Act
-        response = self.client.get(reverse('export-list', kwargs={'id': self.user_list.uuid, 'format': 'pdf'}))
-        # Assert - Check correct content type and file is named correctly
+        status = self.client.get(reverse('export-status', args=[job.uuid]))
+        download = self.client.get(reverse('export-download', args=[job.uuid]))
+        # Assert
+        self.assertEqual(status.status_code, 404)
+        self.assertEqual(download.status_code, 404)
+
+    def test_canvas_pdf_pages_like_platypus(self):
+        # Arrange - Enough books with reviews and links to fill several pages
+        books = [
+            Book(title=f'Book {number}', author='Author', genre='fantasy', rating=number % 6 or None,
+                 review='A long review of the book. ' * (number % 8), purchase_link='https://example.com' if number % 3 else '')
+            for number in range(60)
+        ]
+        # Act
+        canvas_pdf = render_list_pdf('My List', books)
+        platypus_pdf = render_list_pdf_platypus('My List', books)
+        # Assert - Both renderers keep each book together so they need the same number of pages and have the same links
+        self.assertTrue(canvas_pdf.startswith(b'%PDF'))
+        self.assertGreater(canvas_pdf.count(b'/Type /Page\n'), 1)
+        self.assertEqual(canvas_pdf.count(b'/Type /Page\n'), platypus_pdf.count(b'/Type /Page\n'))
+        self.assertEqual(canvas_pdf.count(b'/S /URI'), 40)
+
+    def test_canvas_pdf_splits_book_taller_than_a_page(self):
+        # Arrange
+        books = [Book(title='Long', author='Author', genre='fiction', review='word ' * 3000)]
+        # Act
+        pdf = render_list_pdf('My List', books)
+        # Assert - The review carries on over the next pages instead of running off the bottom
+        self.assertGreater(pdf.count(b'/Type /Page\n'), 2)
+
+
+class MyListsTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+
+    # Make a list with some books in it and some books in every reading status
+    def add_list(self, number, book_count):
+        book_list = BookList.objects.create(user=self.user, name=f'List {number}')
+        for index in range(book_count):
+            status = ['finished', 'currently_reading', 'want_to_read'][index % 3]
+            book = Book.objects.create(user=self.user, title=f'Book {number}-{index}', author='Author', genre='fiction', status=status)
+            book_list.books.add(book)
+        return book_list
+
+    def test_query_count_does_not_grow_with_lists(self):
+        # Arrange - One list, then nine more lists of different sizes. The library version is started first like any earlier visit would
+        self.add_list(0, 5)
+        get_library_version(self.user.id)
+        with CaptureQueriesContext(connection) as one_list:
+            self.client.get(reverse('my-lists'))
+        for number in range(1, 10):
+            self.add_list(number, number)
+        # Act + Assert - Session, user, library version, lists with counts, list covers, status counts and status covers
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse('my-lists'))
+        self.assertEqual(len(one_list), 7)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response['Content-Type'], 'application/pdf')
-        self.assertIn('my_list.pdf', response['Content-Disposition'])
+
+    def test_counts_and_first_covers_shown_for_each_list(self):
+        # Arrange
+        self.add_list(1, 6)
+        self.add_list(2, 1)
+        # Act
+        response = self.client.get(reverse('my-lists'))
+        lists = {book_list.name: book_list for book_list in response.context['lists']}
+        # Assert - Every list has its count and at most four covers, every status has its count and first covers in title order
+        self.assertEqual(lists['List 1'].book_count, 6)
+        self.assertEqual([book.title for book in lists['List 1'].preview_books], ['Book 1-0', 'Book 1-1', 'Book 1-2', 'Book 1-3'])
+        self.assertEqual(lists['List 2'].book_count, 1)
+        self.assertContains(response, '6 books')
+        self.assertContains(response, '1 book<')
+        self.assertEqual(response.context['finished_count'], 3)
+        self.assertEqual(response.context['want_to_read_count'], 2)
+        self.assertEqual([book.title for book in response.context['finished_books']], ['Book 1-0', 'Book 1-3', 'Book 2-0'])
 
 
 class ListDetailTests(TestCase):
@@ -140,6 +445,17 @@ class ListDetailTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'The Hobbit')
 
+    
+    def test_list_detail_refreshes_after_removing_book(self):
+        # Arrange - Load the page once so the grid is cached
+        self.client.login(username='testuser', password='testpass123')
+        self.client.get(reverse('list-detail', kwargs={'id': self.user_list.uuid}))
+        # Act
+        self.user_list.books.remove(self.book)
+        response = self.client.get(reverse('list-detail', kwargs={'id': self.user_list.uuid}))
+        # Assert - The cached grid is not reused after the list changed
+        self.assertNotContains(response, 'The Hobbit')
+
 
 class EditListTests(TestCase):
 
@@ -17,6 +17,8 @@ urlpatterns = [
     path('my-lists/<uuid:id>/edit/', views.edit_list, name='edit-list'),
     path('my-lists/<uuid:id>/delete/', views.delete_list, name='delete-list'),
     path('my-lists/<uuid:id>/export/<str:format>/', views.export_list, name='export-list'),
+    path('exports/<uuid:id>/', views.export_status, name='export-status'),
+    path('exports/<uuid:id>/download/', views.export_download, name='export-download'),
     
 ]
 
@@ -1,50 +1,78 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import response, HttpResponse
-from .models import BookList
+from django.http import response, FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from django.urls import reverse
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django.utils import timezone
+from django.db.models import Count, F, Prefetch, Q, Window
+from django.db.models.functions import RowNumber
+from django.contrib import messages
+from django.db import transaction
+from django.template.defaultfilters import pluralize
+from .models import BookList, ExportJob
 from books.models import Book
+from books.cache import get_grid_cache_key, get_cached_grid, cache_grid, bump_library_version
+from books.conditional import library_page
 from django.contrib.auth.decorators import login_required
 from .forms import CreateListForm, EditListForm
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib import colors
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, KeepTogether, Table, TableStyle, HRFlowable
-from reportlab.lib.units import inch
-from io import BytesIO
+from .pdf import GENRE_NAMES
+from .exports import EXPORT_CHUNK_SIZE, count_active_jobs, fail_lost_jobs, get_active_jobs, get_artifact_path, get_content_hash, get_export_rows, get_list_books, queue_export_job
 import csv
+import uuid
 
 
-# Display all users lists
+# Rows of the table that joins lists and books
+BookListBook = BookList.books.through
+
+
+# Fields the list covers need, the rest of each book is not loaded
+COVER_FIELDS = ['id', 'uuid', 'title', 'image', 'cover_placeholder', 'cover_color']
+
+# Number of covers shown on each list, 2x2 when there are 4 or more books
+PREVIEW_SIZE = 4
+
+ESSENTIAL_STATUSES = ['finished', 'currently_reading', 'want_to_read']
+
+# Columns of the CSV export and the book fields they are filled from
+CSV_HEADER = ['Title', 'Author', 'Genre', 'Rating', 'Review', 'Purchase Link']
+CSV_FIELDS = ['title', 'author', 'genre', 'rating', 'review', 'purchase_link']
+
+
+# Display all users lists.
+# The page runs the same few queries however many lists and books the user has
 @login_required
+@library_page
 def my_lists(request):
     
-    # Get all lists that belong to the current user
-    lists = BookList.objects.filter(user=request.user)
+    # Get all lists that belong to the current user with their number of books counted by the database.
+    # A sliced Prefetch gets the first covers of every list in one query using a window function partitioned by list
+    lists = BookList.objects.filter(user=request.user).annotate(book_count=Count('books')).prefetch_related(
+        Prefetch('books', queryset=Book.objects.only(*COVER_FIELDS)[:PREVIEW_SIZE], to_attr='preview_books')
+    )
     
     # Get all books that belong to the current user
     books = Book.objects.filter(user=request.user)
     
-    # Get the number of users finished books
-    finished_count = books.filter(status='finished').count()
-    
-    # Get number of users currently reading books
-    currently_reading_count = books.filter(status='currently_reading').count()
+    # Count the books in each reading status in one query instead of one count per status
+    counts = books.aggregate(**{
+        f'{status}_count': Count('id', filter=Q(status=status)) for status in ESSENTIAL_STATUSES
+    })
     
-    # Get number of users want to read books
-    want_to_read_count = books.filter(status='want_to_read').count()
+    # Get the first books of every status for the list images in one query by numbering the books within each status
+    preview_books = {status: [] for status in ESSENTIAL_STATUSES}
     
-    # Get the books to use for the list images
-    finished_books = books.filter(status='finished')[:4]
-    currently_reading_books = books.filter(status='currently_reading')[:4]
-    want_to_read_books = books.filter(status='want_to_read')[:4]
+    for book in books.filter(status__in=ESSENTIAL_STATUSES).only('status', *COVER_FIELDS).annotate(
+        position=Window(RowNumber(), partition_by=F('status'), order_by=[F('title').asc(), F('id').asc()])
+    ).filter(position__lte=PREVIEW_SIZE):
+        preview_books[book.status].append(book)
       
     context = {
         'lists': lists, 
-        'finished_count': finished_count, 
-        'currently_reading_count': currently_reading_count, 
-        'want_to_read_count': want_to_read_count,
-        'finished_books': finished_books,
-        'currently_reading_books': currently_reading_books,
-        'want_to_read_books': want_to_read_books
+        **counts,
+        'finished_books': preview_books['finished'],
+        'currently_reading_books': preview_books['currently_reading'],
+        'want_to_read_books': preview_books['want_to_read']
     }
     
     return render(request, 'lists/my-lists.html', context)
@@ -83,18 +111,51 @@ def create_list(request):
 
 # List detail page
 @login_required
+@library_page
 def list_detail(request, id):
     
     # Get the user list that matches the id
     user_list = get_object_or_404(BookList, uuid=id, user=request.user)
     
-    # Get all books from that list
-    books = user_list.books.all()
+    # Use the cached card grid if the library has not changed since it was rendered, otherwise get the books and render it
+    grid_key = get_grid_cache_key(request.user.id, f'list:{user_list.uuid}')
+    grid_html = get_cached_grid(grid_key)
+    
+    if grid_html is None:
+        
+        # Get all books from that list
+        books = user_list.books.all()
+        
+        grid_html = render_to_string('lists/list-detail-grid.html', {'user_list': user_list, 'books': books})
+        cache_grid(grid_key, grid_html)
     
-    context = {'user_list': user_list, 'books': books}      
+    context = {'user_list': user_list, 'grid_html': mark_safe(grid_html)}
     return render(request, 'lists/list-detail.html', context)
     
   
+# Get the ids of the users books from the book uuids a form posted with one query, and the posted ids that did not match one.
+# Ids that are not uuids, were deleted or belong to someone else are reported instead of stopping the whole change with a 404
+def get_selected_books(request):
+    selected = {}
+    
+    for value in request.POST.getlist('book_ids'):
+        try:
+            selected[value] = uuid.UUID(value)
+        except ValueError:
+            selected[value] = None
+    
+    found = dict(Book.objects.filter(uuid__in=[book_uuid for book_uuid in selected.values() if book_uuid], user=request.user).order_by().values_list('uuid', 'id'))
+    missing = [value for value, book_uuid in selected.items() if book_uuid not in found]
+    
+    return list(found.values()), missing
+
+
+# Tell the user about selected books that could not be found
+def report_missing_books(request, missing):
+    if missing:
+        messages.warning(request, f"{len(missing)} selected book{pluralize(len(missing))} could not be found and {pluralize(len(missing), 'was,were')} skipped.")
+
+
 @login_required  
 def add_books(request, id):
     
@@ -103,17 +164,18 @@ def add_books(request, id):
     
     if request.method == 'POST':
         
-        # Get the list of book ids from the form the user submitted
-        selected_books = request.POST.getlist('book_ids')
+        # Get the books the user selected to add
+        book_ids, missing = get_selected_books(request)
         
-        # Iterate through the book ids selected to add by the user
-        for book in selected_books:
-            
-            # Get the book that matches the primary key taken from book_ids
-            book_to_add = get_object_or_404(Book, uuid=book, user=request.user)
-            
-            # Add the book to the users list
-            user_list.books.add(book_to_add)
+        # Write every list membership in one insert, books already in the list are skipped by the unique constraint
+        with transaction.atomic():
+            BookListBook.objects.bulk_create(
+                [BookListBook(booklist_id=user_list.id, book_id=book_id) for book_id in book_ids], ignore_conflicts=True
+            )
+        
+        # bulk_create does not send m2m_changed so start the new library version here
+        bump_library_version(request.user.id)
+        report_missing_books(request, missing)
     
         # Redirect to list detail page
         return redirect('list-detail', id=id)
@@ -139,17 +201,16 @@ def remove_books(request, id):
     
     if request.method == 'POST':
         
-        # Get the list of book ids from the form the user submitted
-        selected_books = request.POST.getlist('book_ids')
+        # Get the books the user selected to remove
+        book_ids, missing = get_selected_books(request)
         
-        # Iterate through the book ids selected to remove by the user
-        for book in selected_books:
-            
-            # Get the book that matches the primary key taken from book_ids
-            book_to_remove = get_object_or_404(Book, uuid=book, user=request.user)
-            
-            # Remove the book from the users list
-            user_list.books.remove(book_to_remove)
+        # Remove every list membership in one delete
+        with transaction.atomic():
+            BookListBook.objects.filter(booklist=user_list, book_id__in=book_ids).delete()
+        
+        # A queryset delete does not send m2m_changed so start the new library version here
+        bump_library_version(request.user.id)
+        report_missing_books(request, missing)
     
         # Redirect to list detail page
         return redirect('list-detail', id=id)
@@ -209,6 +270,7 @@ def delete_list(request, id):
 
 
 @login_required
+@library_page
 def essential_list(request, status):
     
     books = Book.objects.filter(status=status, user=request.user)
@@ -224,11 +286,53 @@ def essential_list(request, status):
     
     books = books.order_by('title')
     
-    context = {'books': books, 'list_name': list_name, 'status': status, 'current_path': request.path}
+    # Use the cached card grid if the library has not changed since it was rendered, the books query only runs on a miss
+    grid_key = get_grid_cache_key(request.user.id, f'essential:{status}')
+    grid_html = get_cached_grid(grid_key)
+    
+    if grid_html is None:
+        grid_html = render_to_string('lists/essential-list-grid.html', {'books': books, 'current_path': request.path})
+        cache_grid(grid_key, grid_html)
+    
+    context = {'grid_html': mark_safe(grid_html), 'list_name': list_name, 'status': status}
     
     return render(request, 'lists/essential-list.html', context)
 
 
+# csv.writer needs a file to write to, this one hands each written row straight back so it can be streamed
+class Echo:
+
+    def write(self, value):
+        return value
+
+
+# Yield the CSV a row at a time. Only the exported columns are loaded and iterator() fetches them in chunks,
+# on PostgreSQL through a server side cursor, so memory stays the same however many books the list has
+def get_csv_rows(books):
+    writer = csv.writer(Echo())
+    
+    # Write header row for the column names
+    yield writer.writerow(CSV_HEADER)
+    
+    # Fill out each following row with the info from each book
+    for title, author, genre, rating, review, purchase_link in books.values_list(*CSV_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield writer.writerow([
+            title,
+            author,
+            # Display the Display names for genre
+            GENRE_NAMES.get(genre, genre),
+            f"{rating}/5" if rating else '',
+            review or '',
+            purchase_link or '',
+        ])
+
+
+# Send the user back to the list they exported with a message that they have to wait for their other exports
+def export_limit_reached(request, book_list, status):
+    messages.error(request, 'You already have exports being made. Please wait for them to finish and try again.')
+    return redirect('list-detail', book_list.uuid) if book_list else redirect(f"{status.replace('_', '-')}-list")
+
+
 # Create view that takes format parameter as well as list_id and status as optional parameters
 @login_required
 def export_list(request, format, id=None, status=None):
@@ -239,23 +343,13 @@ def export_list(request, format, id=None, status=None):
         # Get the current user list
         user_list = get_object_or_404(BookList, uuid=id, user = request.user)
         
-        # Get all the books from that list
-        books = user_list.books.all()
-        
-        # Order the books in alphabetical order
-        books = books.order_by('title')
-        
         # Get list name for the filename
         list_name = user_list.name
     
     # If user is trying to export a essential list
     else:
         
-        # Get all books for the user filtered by the status value
-        books = Book.objects.filter(status=status, user=request.user)
-        
-        # Order the books in alhabetical order
-        books = books.order_by('title')
+        user_list = None
         
         status_names = {
             'finished': 'Finished',
@@ -265,164 +359,89 @@ def export_list(request, format, id=None, status=None):
         
         # Assign the list name the value of the status for the filename
         list_name = status_names[status]
+    
+    # Get all the books from the list in alphabetical order
+    books = get_list_books(request.user, user_list, status)
            
     if format == 'csv':
         
-        # Create a CSV response
-        response = HttpResponse(content_type='text/csv')
-        
         # Create a file name by replacing spaces with underscores and making it lowercase
         filename = list_name.replace(' ', '_').lower() + '.csv'
         
+        # Stream the rows as they are written so a large list starts downloading straight away and is never held in memory
+        response = StreamingHttpResponse(get_csv_rows(books), content_type='text/csv')
+        
         # Tell browser to download file with the filename
         response['Content-Disposition'] = f'attachment; filename="{filename}"'
         
-        # Create a CSV writer to write to the response
-        writer = csv.writer(response)
-        
-        # Write header row for the column names
-        writer.writerow(['Title', 'Author', 'Genre', 'Rating', 'Review', 'Purchase Link'])
-        
-        # Fill out each following row with the info from each book
-        for book in books:
-            writer.writerow([
-                book.title,
-                book.author,
-                # Display the Display names for genre
-                book.get_genre_display(),
-                f"{book.rating}/5" if book.rating else '',
-                book.review or '',
-                book.purchase_link or '',
-            ])
-        
-        # Return the HttpResponse that tells the browser to download the newly created csv file
+        # Return the response that tells the browser to download the newly created csv file
         return response
     
     elif format == 'pdf':
         
-        filename = list_name.replace(' ', '_').lower() + '.pdf'
-    
-        # BytesIO creates an in-memory buffer to hold the PDF data
-        # This is better than saving to disk because it's faster and doesn't require file cleanup
-        buffer = BytesIO()
-    
-        # SimpleDocTemplate is ReportLab's PDF document builder
-        # Set the page size to normal letter page size and set margins on all sides
-        doc = SimpleDocTemplate(buffer, pagesize=letter, rightMargin=inch, leftMargin=inch, topMargin=inch, bottomMargin=inch)
-    
-        # getSampleStyleSheet gives us pre-built styles like Title, Heading2, Normal
-        # These control font size, weight, spacing, etc.
-        styles = getSampleStyleSheet()
-    
-        # Clone the Normal style to create a custom link style
-        # clone() copies all existing properties
-        link_style = styles['Normal'].clone('LinkStyle')
-        link_style.textColor = colors.blue
-        link_style.underline = True
-    
-        # elements is a list of content blocks that ReportLab will stack vertically in the PDF
-        # Everything gets added to this list and then built into the PDF at the end
-        elements = []
-    
-        # Add the list name as a large centered title at the top of the PDF
-        elements.append(Paragraph(list_name, styles['Title']))
+        # ?covers=1 adds each book's cover to the PDF
+        covers = request.GET.get('covers') == '1'
         
-        # Draw a line under title
-        elements.append(HRFlowable(width="100%", thickness=1, color=colors.black))
+        # Hashing the books is one quick query, if the list has not changed since it was last exported the stored PDF is sent straight away
+        content_hash = get_content_hash(request.user.id, list_name, get_export_rows(books), covers)
         
-        # Spacer to add vertical whitespace
-        elements.append(Spacer(1, 0.3 * inch))
-    
-        # Loop through each book and add its information as a block of content
-        for book in books:
-            
-            book_elements = []
-
-            # Book title as a bold heading
-            book_elements.append(Paragraph(book.title, styles['Heading2']))
+        if get_artifact_path(content_hash).exists():
+            return get_pdf_response(content_hash, list_name)
+        
+        # Drawing the PDF is left to a background thread so the worker is free, an export of this list already on its way is reused
+        fail_lost_jobs(request.user)
+        job = get_active_jobs(request.user).filter(content_hash=content_hash).first()
+        
+        if job is None:
             
-            # Author in normal text
-            book_elements.append(Paragraph(f"by {book.author}", styles['Normal']))
-            book_elements.append(Spacer(1, 0.10 * inch))
-
-            # Show rating as the rating out of 5 if one exists, otherwise show "Not rated"
-            rating_text = f"{book.rating}/5" if book.rating else "Not rated"
-            book_elements.append(Paragraph(f"<b>Genre:</b> {book.get_genre_display()}  |  <b>Rating:</b> {rating_text}", styles['Normal']))
-            book_elements.append(Spacer(1, 0.10 * inch))
-
-            # Only add review if the user wrote one and use a grey background with it
-            if book.review:
-                review_data = [[Paragraph(f"<i>\"{book.review}\"</i>", styles['Normal'])]]
-                review_table = Table(review_data, colWidths=[6.5 * inch])
-                review_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#f5f5f5')),
-                    ('LEFTPADDING', (0, 0), (-1, -1), 10),
-                    ('RIGHTPADDING', (0, 0), (-1, -1), 10),
-                    ('TOPPADDING', (0, 0), (-1, -1), 8),
-                    ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
-                ]))
-                
-                book_elements.append(review_table)
-                book_elements.append(Spacer(1, 0.05 * inch))
-
-            # Only add purchase link if one exists
-            if book.purchase_link:
-                book_elements.append(Spacer(1, 0.05 * inch))
-                book_elements.append(Paragraph(f'<font color="#555555">Purchase:</font> <link href="{book.purchase_link}"><u>Check it out here</u></link>', link_style))
-
-            book_elements.append(Spacer(1, 0.1 * inch))
+            # Each user can only have a few exports waiting at once so one user can not keep the export threads busy
+            if count_active_jobs(request.user) >= settings.EXPORT_JOBS_PER_USER:
+                return export_limit_reached(request, user_list, status)
             
-            # Divider line between books
-            book_elements.append(HRFlowable(width="100%", thickness=0.5, color=colors.grey))
-            book_elements.append(Spacer(1, 0.15 * inch))
-
-            # Use KeepTogether prevent one book's info from being split across 2 pages
-            elements.append(KeepTogether(book_elements))
-    
-        # Build converts the elements list into the actual PDF and writes it to the buffer
-        doc.build(elements)
-    
-        # Get the PDF bytes from the buffer and close it to free memory
-        pdf = buffer.getvalue()
-        buffer.close()
-    
-        # Return the PDF as a downloadable file response
-        response = HttpResponse(pdf, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+            job = ExportJob.objects.create(user=request.user, book_list=user_list, list_status=status or '', list_name=list_name, covers=covers, content_hash=content_hash)
+            queue_export_job(job)
         
-        return response    
+        return redirect('export-status', job.uuid)
     
     else:
         
         return HttpResponse("Invalid format. Use 'csv' or 'pdf'.", status=400)
-        
-        
-        
-        
-        
-    
-    
+
+
+# Send a stored PDF as a download named after the list
+def get_pdf_response(content_hash, list_name):
+    filename = list_name.replace(' ', '_').lower() + '.pdf'
+    return FileResponse(open(get_artifact_path(content_hash), 'rb'), as_attachment=True, filename=filename, content_type='application/pdf')
+
+
+# Page the user waits on while their PDF is made. It reloads itself until the PDF is ready,
+# scripts can ask for JSON with the Accept header instead
+@login_required
+def export_status(request, id):
+    fail_lost_jobs(request.user)
+    job = get_object_or_404(ExportJob, uuid=id, user=request.user)
+    download_url = reverse('export-download', args=[job.uuid]) if job.status == 'ready' else None
     
+    if 'application/json' in request.headers.get('Accept', ''):
+        return JsonResponse({'status': job.status, 'download_url': download_url})
     
-      
-        
-        
-        
-        
-        
-        
-        
-          
-            
-            
-            
-            
+    return render(request, 'lists/export-status.html', {'job': job, 'download_url': download_url})
 
+
+@login_required
+def export_download(request, id):
+    job = get_object_or_404(ExportJob, uuid=id, user=request.user, status='ready')
+    
+    # The file is gone if the cache folder was cleared, make it again if the user has room for another export
+    if not get_artifact_path(job.content_hash).exists():
+        fail_lost_jobs(request.user)
         
+        if count_active_jobs(request.user) >= settings.EXPORT_JOBS_PER_USER:
+            return export_limit_reached(request, job.book_list, job.list_status)
         
+        # The timeout counts from when the job was queued again
+        ExportJob.objects.filter(id=job.id).update(status='queued', created_date=timezone.now())
+        queue_export_job(job)
+        return redirect('export-status', job.uuid)
     
-    
-    
-    
-    
-
+    return get_pdf_response(job.content_hash, job.list_name)
@@ -27,8 +27,8 @@ def generate_recommendations(user):
     # Iterate through the authors and use google books api to find books not in seen_books
     for author in favorite_authors:
         
-        # Get ther results from google books api search by author
-        results = search_google_books(author['author'])
+        # Get ther results from google books api search by author, only the first 2 are used
+        results = search_google_books(author['author'], max_results=2)
         
         # If the results are not none add them to recommendations list
         if results:
@@ -142,8 +142,8 @@ def get_claude_recommendations(user):
         # Build the search query to use for the google books api search using the returned recommendations title and author
         search_query = f"{recommendation['title']} {recommendation['author']}"
     
-        # Call search_google_books with the query
-        results = search_google_books(search_query)
+        # Call search_google_books with the query, only the first result is used
+        results = search_google_books(search_query, max_results=1)
     
         # If the results exist and are not empty get the first image and purchase link
         
@@ -1,9 +1,11 @@
 from django.test import TestCase
+import json
 from django.contrib.auth.models import User
 from .models import Recommendation
 from django.urls import reverse
 from unittest.mock import patch, MagicMock
 from books.models import Book
+from books.google_books_cache import clear_google_books_cache
 from .services import generate_recommendations, get_claude_recommendations
 import anthropic
 
@@ -75,6 +77,9 @@ class RecommendationsSignalTests(TestCase):
 class RecommendationsGenerateRecommendationsTests(TestCase):
     
     def setUp(self):
+        # Author searches are cached in memory so clear them to make each test call the mocked Google api
+        clear_google_books_cache()
+        
         self.user = User.objects.create_user(username='testuser', password='testpass123')
         
         # Create 4 books for the user to use later in the tests
@@ -126,7 +131,7 @@ class RecommendationsGenerateRecommendationsTests(TestCase):
         self.assertTrue(results is None)
     
     # Returns recommendations when user has 5 or more finished books   
-    @patch('books.services.requests.get')
+    @patch('books.services.google_books_session.get')
     def test_generate_recommendations_returns_recommendations_when_more_than_5_books(self, mock_get):
         
         # Arrange - create mock data for google books api search, log user in, and create a new book that way they have 5 books
@@ -164,7 +169,8 @@ class RecommendationsGenerateRecommendationsTests(TestCase):
         }
         
         # Make it so that for the google search books api get request the mock data is returned
-        mock_get.return_value.json.return_value = mock_response_data
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.content = json.dumps(mock_response_data).encode()
         
         self.client.login(username='testuser', password='testpass123')
         
@@ -187,7 +193,7 @@ class RecommendationsGenerateRecommendationsTests(TestCase):
         self.assertEqual(results[1]['authors'], 'Author1')
         
     # Excludes books the user has already seen
-    @patch('books.services.requests.get')
+    @patch('books.services.google_books_session.get')
     def test_generate_recommendations_excludes_books_user_has_already_seen(self, mock_get):
         
         # Arrange - create mock data of books uer has already seen before, log user in, and create a two more books of different statuses
@@ -225,7 +231,8 @@ class RecommendationsGenerateRecommendationsTests(TestCase):
         }
         
         # Make it so that for the google search books api get request the mock data is returned
-        mock_get.return_value.json.return_value = mock_response_data
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.content = json.dumps(mock_response_data).encode()
         
         self.client.login(username='testuser', password='testpass123')
         
@@ -312,6 +319,21 @@ class RecommendationsViewTests(TestCase):
         self.assertContains(response, 'book4')
         self.assertContains(response, 'book5')
     
+    # Covers are served through the media proxy instead of linking to Google
+    def test_recommendation_covers_use_media_proxy(self):
+        
+        # Arrange - give a recommendation a Google Books cover and log user in
+        self.recommendation1.cover_link = 'http://books.google.com/books/content?id=abc'
+        self.recommendation1.save()
+        self.client.login(username='testuser', password='testpass123')
+        
+        # Act
+        response = self.client.get(reverse('my-recommendations'))
+        
+        # Assert
+        self.assertContains(response, '/media-proxy/')
+        self.assertNotContains(response, 'books.google.com')
+    
     # Cold start shows not_enough_books message 
     def test_recommendations_display_info_message_when_user_has_less_than_5_books(self):
         